@@ -1,8 +1,9 @@
 import os
 import json
+import uuid
 import logging
 import subprocess
-from flask import Blueprint, request, jsonify, render_template, current_app, send_from_directory
+from flask import Blueprint, Response, request, jsonify, render_template, current_app, send_from_directory
 from werkzeug.utils import secure_filename
 from app.api import bp
 from app.utils import (
@@ -11,11 +12,53 @@ from app.utils import (
     format_features_concise,
     get_all_trials
 )
-from app.core.feature_extraction import highlight_sources, extract_features_with_llm, match_trials_llm
+from app.core.feature_extraction import match_trials_llm
+from app.core.grounding import ground_sources, render_highlights, get_grounding_stats
+from app.core.json_repair import get_salvage_stats
+from app.core.prompt_compaction import get_compaction_stats
+from app.core.explanations import explain_match, get_explanation_stats
+from app.core.rematch import rematch, get_rematch_stats, MatchBusy
+from app.core.match_store import MATCH_STORE_ENABLED, get_match_store, patient_reference
+from app.core.patient_index import (
+    match_patients, get_reverse_match_stats, REVERSE_SHORTLIST_SIZE, REVERSE_MATCH_TIME_BUDGET
+)
+from app.core.hedging import extract_features_hedged, get_hedging_stats
 from app.core.llm_processor import get_llm_processor
+from app.core.criteria import get_dedup_stats
+from app.core.cascade import get_cascade_stats
+from app.core.evaluation_plan import get_rejection_stats
+from app.core.match_state import Deadline, MATCH_TIME_BUDGET, create_match_state, get_match_state, finish_in_background
+from app.core.jobs import get_job_runner, running_job_runner, remove_upload, JOB_WORKERS
+from app.core.streaming import stream_process, get_stream_stats
+from app.core.scheduler import get_scheduler, set_llm_context, SchedulerSaturated
+from app.core.router import get_router
+from app.core.backends import get_backend_stats
+from app.core.batching import get_batching_stats
+from app.core.singleflight import get_single_flight
+from app.core.cancellation import (
+    Cancelled, CancellationToken, cancellation_scope, watch_client, record_cancelled, get_cancellation_stats
+)
 
 bp = Blueprint('api', __name__)
 logger = logging.getLogger(__name__)
+
+
+def request_user():
+    return request.headers.get('X-User-Id') or request.remote_addr or 'anonymous'
+
+
+@bp.before_app_request
+def tag_llm_context():
+    # LLM calls made while serving a request are interactive, fair-shared per user
+    set_llm_context('interactive', request_user())
+
+
+@bp.app_errorhandler(SchedulerSaturated)
+def scheduler_saturated(e):
+    logger.warning(f"⏳ {e}")
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
        
  
 @bp.route('/')
@@ -67,6 +110,23 @@ def get_models():
 
 @bp.route('/process', methods=['POST'])
 def process():
+    # A clinician closing the tab cancels the remaining extraction and matching
+    token = CancellationToken()
+    stop_watching = watch_client(request.environ, token)
+    stage = ['upload']
+    try:
+        with cancellation_scope(token):
+            return _process(stage)
+    except Cancelled as e:
+        record_cancelled(stage[0], e.reason)
+        logger.info(f"🛑 /process cancelled during {stage[0]}")
+        # Nobody is listening any more; 499 is the de-facto "client closed request" code
+        return jsonify({'error': 'Request cancelled.'}), 499
+    finally:
+        stop_watching()
+
+
+def _process(stage):
     try:
         upload_dir = current_app.config.get('UPLOAD_FOLDER', 'uploads')
         os.makedirs(upload_dir, exist_ok=True)
@@ -81,6 +141,7 @@ def process():
             upload_path = os.path.join(upload_dir, pdf_filename)
             file.save(upload_path)
 
+            stage[0] = 'pdf_extraction'
             with open(upload_path, 'rb') as f:
                 text = extract_text_from_pdf(f)
 
@@ -98,35 +159,42 @@ def process():
             logger.warning("❌ Extracted text is empty")
             return jsonify({'error': 'Extracted text is empty.'}), 400
 
+        get_scheduler().admit('interactive')
+        stage[0] = 'feature_extraction'
         logger.info("🤖 Calling LLM for feature extraction...")
-        llm_text = extract_features_with_llm(text)
+        # Regex features run alongside and pre-select candidates; they stand in if the LLM fails
+        extraction = extract_features_hedged(text)
+        llm_text = extraction.features
 
         if not isinstance(llm_text, dict) or not llm_text:
             logger.error("❌ Invalid or empty response from LLM")
             return jsonify({'error': 'LLM returned an invalid or empty response.'}), 500
         logger.info(f"✅ Extracted Features: {llm_text}")
-        # highlighted_text = highlight_sources(text, features)
-    #     print(features)
-    #     return jsonify({
-    #         'features': features,
-    #         'text': text,
-    #         'text_highlighted': 'highlighted_text',
-    #         'pdf_filename': pdf_filename
-    #     })
-
-    # except Exception as e:
-    #     logger.exception("❌ Unhandled exception in /process")
-    #     return jsonify({'error': str(e)}), 500
-    
-        # Step 3: Use extracted features for trial matching
+        sources = ground_sources(text, llm_text)
+
+        # Step 3: Use extracted features for trial matching within the time budget
         logger.info("🤖 Calling LLM for trial matching...")
-        matched_trials = match_trials_llm(llm_text)
+        stage[0] = 'matching'
+        time_budget = request.form.get('time_budget', type=float, default=MATCH_TIME_BUDGET)
+        state = create_match_state(llm_text)
+        state.candidates = extraction.candidates
+        state.degraded = extraction.degraded
+        state.patient_ref = patient_reference(request.form.get('patient_ref'))
+        matched_trials = match_trials_llm(llm_text, deadline=Deadline(time_budget), state=state)
         return jsonify({
             'features': llm_text,
+            'degraded': extraction.degraded,
+            'degraded_reason': extraction.reason,
             'text': text,
+            'sources': sources,
+            'text_highlighted': render_highlights(text, sources),
             'pdf_filename': pdf_filename,
-            'matched_trials': matched_trials
+            'matched_trials': matched_trials,
+            'match_id': state.id,
+            'complete': state.complete
         })
+    except SchedulerSaturated as e:
+        return scheduler_saturated(e)
     except Exception as e:
         logger.exception("❌ Unhandled exception in /process")
         return jsonify({'error': str(e)}), 500
@@ -191,6 +259,261 @@ Return a JSON with:
 
 
 
+@bp.route('/process/stream', methods=['POST'])
+def process_stream():
+    upload_dir = current_app.config.get('UPLOAD_FOLDER', 'uploads')
+    os.makedirs(upload_dir, exist_ok=True)
+
+    file = request.files.get('file')
+    raw_text = request.form.get('text', '').strip()
+    time_budget = request.form.get('time_budget', type=float)
+    pdf_filename = upload_path = None
+
+    if file and file.filename.endswith('.pdf'):
+        pdf_filename = secure_filename(file.filename)
+        # Unique name: concurrent uploads of the same file must not overwrite each other
+        upload_path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.pdf")
+        file.save(upload_path)
+        logger.info(f"📄 PDF '{pdf_filename}' uploaded for streaming")
+    elif not raw_text:
+        logger.warning("❌ No input provided")
+        return jsonify({'error': 'Please upload a PDF or enter clinical text.'}), 400
+
+    get_scheduler().admit('interactive')
+    events = stream_process(current_app._get_current_object(), text=raw_text or None, pdf_path=upload_path,
+                            pdf_filename=pdf_filename, time_budget=time_budget,
+                            patient_ref=patient_reference(request.form.get('patient_ref')))
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.before_app_request
+def start_job_runner():
+    # Started on the first request so queued jobs resume after a restart
+    if JOB_WORKERS > 0:
+        get_job_runner(current_app._get_current_object())
+
+
+@bp.route('/jobs', methods=['POST'])
+def create_job():
+    if JOB_WORKERS <= 0:
+        return jsonify({'error': 'Asynchronous jobs are disabled on this server (JOB_WORKERS=0).'}), 503
+    # Outside the folder swept by /api/clean: a queued job may wait longer than its expiry
+    upload_dir = os.path.join(current_app.config.get('UPLOAD_FOLDER', 'uploads'), 'jobs')
+    os.makedirs(upload_dir, exist_ok=True)
+
+    file = request.files.get('file')
+    raw_text = request.form.get('text', '').strip()
+    time_budget = request.form.get('time_budget', type=float)
+    patient_ref = patient_reference(request.form.get('patient_ref'))
+    runner = get_job_runner(current_app._get_current_object())
+
+    if file and file.filename.endswith('.pdf'):
+        pdf_filename = secure_filename(file.filename)
+        upload_path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.pdf")
+        file.save(upload_path)
+        job_id = runner.store.create(pdf_path=upload_path, pdf_filename=pdf_filename, time_budget=time_budget,
+                                    user=request_user(), patient_ref=patient_ref)
+    elif raw_text:
+        job_id = runner.store.create(text=raw_text, time_budget=time_budget, user=request_user(),
+                                    patient_ref=patient_ref)
+    else:
+        logger.warning("❌ No input provided")
+        return jsonify({'error': 'Please upload a PDF or enter clinical text.'}), 400
+
+    runner.notify()
+    logger.info(f"📥 Job {job_id} queued")
+    response = jsonify({'job_id': job_id, 'status': 'queued'})
+    response.headers['Location'] = f"/jobs/{job_id}"
+    return response, 202
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_runner(current_app._get_current_object()).store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'status': job['status'],
+        'stage': job['stage'],
+        'features': job['features'],
+        'degraded': bool(job['degraded']),
+        'matched_trials': job['matched_trials'] or [],
+        'pdf_filename': job['pdf_filename'],
+        'timings': job['timings'] or {},
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at']
+    })
+
+
+@bp.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    runner = get_job_runner(current_app._get_current_object())
+    job = runner.store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if not runner.store.cancel(job_id):
+        return jsonify({'error': f"Job already {job['status']}", 'status': job['status']}), 409
+    if job['status'] == 'queued':
+        record_cancelled('queued', 'job_cancelled')
+        remove_upload(job)
+    # A job running in this process stops now; other workers notice through the store
+    runner.cancel(job_id)
+    logger.info(f"🛑 Job {job_id} cancelled")
+    return jsonify({'job_id': job_id, 'status': 'cancelled'})
+
+
+@bp.route('/api/matches/<match_id>', methods=['GET'])
+def get_match(match_id):
+    state = get_match_state(match_id)
+    if state is None:
+        return jsonify({'error': 'Unknown or expired match'}), 404
+    matched_trials = sorted(state.results(), key=lambda x: x['match_score'], reverse=True)
+    return jsonify({
+        'match_id': state.id,
+        'complete': state.complete,
+        'running': state.running,
+        'matched_trials': matched_trials
+    })
+
+
+@bp.route('/api/matches/<match_id>/continue', methods=['POST'])
+def continue_match(match_id):
+    state = get_match_state(match_id)
+    if state is None:
+        return jsonify({'error': 'Unknown or expired match'}), 404
+    if state.complete:
+        return jsonify({'match_id': state.id, 'complete': True}), 200
+
+    finish_in_background(state, lambda s: match_trials_llm(s.features, state=s))
+    logger.info(f"⏳ Finishing match {state.id} in background")
+    return jsonify({'match_id': state.id, 'complete': False, 'running': True}), 202
+
+
+@bp.route('/api/matches/<match_id>/features', methods=['PATCH'])
+def edit_match_features(match_id):
+    """Re-rank a match after the clinician corrects extracted features, re-evaluating only the affected trials."""
+    state = get_match_state(match_id)
+    if state is None:
+        return jsonify({'error': 'Unknown or expired match'}), 404
+    data = request.get_json(silent=True) or {}
+    features = data.get('features')
+    if not isinstance(features, dict) or not features:
+        return jsonify({'error': 'Edited features are required.'}), 400
+    if state.running:
+        return jsonify({'error': 'The match is still being completed, retry when it finishes.'}), 409
+
+    try:
+        time_budget = float(data.get('time_budget', MATCH_TIME_BUDGET))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'time_budget must be a number of seconds.'}), 400
+
+    try:
+        get_scheduler().admit('interactive')
+        matched_trials, report = rematch(state, features, deadline=Deadline(time_budget))
+    except MatchBusy:
+        return jsonify({'error': 'The match is still being completed, retry when it finishes.'}), 409
+    except SchedulerSaturated as e:
+        return scheduler_saturated(e)
+    return jsonify({
+        'match_id': state.id,
+        'features': state.features,
+        'matched_trials': matched_trials,
+        'complete': state.complete,
+        'changed': report['changed'],
+        'reevaluated': report['reevaluated'],
+        'reused': report['reused'],
+        'refinalized': report['refinalized']
+    })
+
+
+@bp.route('/api/trials/<trial_id>/explanation', methods=['POST'])
+def explain_trial(trial_id):
+    """Detailed criteria analysis and patient summary of one match, generated when a trial is expanded."""
+    data = request.get_json(silent=True) or {}
+    features = data.get('features')
+    if not isinstance(features, dict) or not features:
+        return jsonify({'error': 'Patient features are required.'}), 400
+    trial = next((t for t in get_all_trials() if t.get('id') == trial_id), None)
+    if trial is None:
+        return jsonify({'error': 'Unknown trial'}), 404
+
+    try:
+        get_scheduler().admit('interactive')
+        shown = data.get('match') if isinstance(data.get('match'), dict) else None
+        explanation, cached = explain_match(features, trial, shown=shown)
+    except SchedulerSaturated as e:
+        return scheduler_saturated(e)
+    if explanation is None:
+        return jsonify({'error': 'The explanation could not be generated, please retry.'}), 502
+    return jsonify({'trial_id': trial_id, 'cached': cached, 'explanation': explanation})
+
+
+@bp.route('/api/trials/<trial_id>/patients', methods=['GET'])
+def trial_patients(trial_id):
+    """Stored (de-identified) patients eligible for a trial: vectorized screen, then LLM check of the shortlist."""
+    if not MATCH_STORE_ENABLED:
+        return jsonify({'error': 'Patients are not stored on this server (MATCH_STORE_ENABLED=0).'}), 404
+    trial = next((t for t in get_all_trials() if t.get('id') == trial_id), None)
+    if trial is None:
+        return jsonify({'error': 'Unknown trial'}), 404
+    # Bounded: every shortlisted patient is one LLM call made inside this request
+    limit = min(max(1, request.args.get('limit', type=int, default=REVERSE_SHORTLIST_SIZE)), REVERSE_SHORTLIST_SIZE)
+    try:
+        time_budget = float(request.args.get('time_budget', REVERSE_MATCH_TIME_BUDGET))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'time_budget must be a number of seconds.'}), 400
+    # Callers may only shorten the server budget
+    if time_budget <= 0 or 0 < REVERSE_MATCH_TIME_BUDGET < time_budget:
+        time_budget = REVERSE_MATCH_TIME_BUDGET
+
+    try:
+        get_scheduler().admit('interactive')
+        return jsonify(match_patients(trial, shortlist_size=limit, deadline=Deadline(time_budget)))
+    except SchedulerSaturated as e:
+        return scheduler_saturated(e)
+
+
+@bp.route('/api/patients/<patient_ref>', methods=['DELETE'])
+def delete_patient(patient_ref):
+    """Remove a stored patient and its match results from the match store."""
+    if not MATCH_STORE_ENABLED or not get_match_store().delete(patient_ref):
+        return jsonify({'error': 'Unknown patient'}), 404
+    logger.info("🗑️ Stored patient deleted")
+    return jsonify({'patient_ref': patient_ref, 'status': 'deleted'})
+
+
+@bp.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    # Metrics only read: neither the job runner nor the match store is started or created here
+    runner = running_job_runner()
+    metrics = {
+        'criteria': get_dedup_stats(),
+        'cascade': get_cascade_stats(),
+        'rejections': get_rejection_stats().snapshot(),
+        'jobs': runner.store.counts() if runner is not None else {},
+        'streaming': get_stream_stats(),
+        'scheduler': get_scheduler().stats(),
+        'backends': get_router().stats(),
+        'llm_backend': get_backend_stats(),
+        'batching': get_batching_stats(),
+        'single_flight': get_single_flight().stats(),
+        'cancellation': get_cancellation_stats(),
+        'hedging': get_hedging_stats(),
+        'grounding': get_grounding_stats(),
+        'json_salvage': get_salvage_stats(),
+        'prompt_compaction': get_compaction_stats(),
+        'explanations': get_explanation_stats(),
+        'rematch': get_rematch_stats(),
+        'reverse_matching': get_reverse_match_stats()
+    }
+    if MATCH_STORE_ENABLED:
+        metrics['match_store'] = get_match_store().counts()
+    return jsonify(metrics)
+
+
 @bp.route('/api/trials', methods=['GET'])
 def get_trials():
     try:
@@ -0,0 +1,157 @@
+"""
+Inference server protocols behind ``LLMProcessor``.
+
+Each backend turns a prompt into an HTTP request for one kind of server
+and the response back into generated text.  The router picks the node;
+the node's ``kind`` picks the backend, so Ollama and llama.cpp servers can
+be mixed in ``LLM_BACKENDS``.
+
+The llama.cpp backend talks to ``llama-server``'s ``/completion``:
+``cache_prompt`` keeps the KV cache between calls and ``id_slot=-1`` lets
+the server pick the idle slot whose cached prompt shares the longest
+prefix with the new one (so shared instructions are not re-evaluated and
+no slot is left queued behind another), ``n_predict`` caps the output,
+and a JSON grammar constrains decoding to valid JSON.  ``/tokenize`` gives exact
+token counts.
+
+Cancellable calls are sent with ``stream`` enabled and read through
+``parse_stream``, which rebuilds the same envelope from the chunks.
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "ollama").lower()
+LLAMACPP_SERVER_URL = os.getenv("LLAMACPP_SERVER_URL", "http://127.0.0.1:8080")
+LLAMACPP_JSON_GRAMMAR = os.getenv("LLAMACPP_JSON_GRAMMAR", "1").lower() in ("1", "true", "yes")
+
+# GBNF grammar for a JSON object (after llama.cpp's grammars/json.gbnf)
+JSON_GRAMMAR = r'''
+root   ::= object
+value  ::= object | array | string | number | ("true" | "false" | "null") ws
+object ::= "{" ws ( string ":" ws value ("," ws string ":" ws value)* )? "}" ws
+array  ::= "[" ws ( value ("," ws value)* )? "]" ws
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" (["\\bfnrt] | "u" [0-9a-fA-F]{4}) )* "\"" ws
+number ::= ("-"? ([0-9] | [1-9] [0-9]{0,15})) ("." [0-9]+)? ([eE] [-+]? [0-9] [1-9]{0,15})? ws
+ws     ::= | " " | "\n" [ \t]{0,20}
+'''
+
+
+class OllamaBackend:
+    """Ollama ``/api/generate``; the raw body is already the envelope callers expect."""
+
+    kind = "ollama"
+
+    def build_request(self, model: str, prompt: str, temperature: float, max_tokens: int,
+                      context_size: int, grammar: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        return "/api/generate", {
+            "model": model,
+            "prompt": prompt,
+            "temperature": temperature,
+            "num_ctx": context_size,
+            "max_tokens": max_tokens,
+            "stream": False
+        }
+
+    def parse_response(self, model: str, body: str) -> Tuple[str, str]:
+        """Return (generated text, Ollama-style envelope)."""
+        try:
+            text = json.loads(body).get("response") or ""
+        except (json.JSONDecodeError, AttributeError):
+            text = body
+        return text, body
+
+    def parse_stream(self, model: str, lines: Iterable[bytes]) -> Tuple[str, str]:
+        """Join the NDJSON chunks of a streamed ``/api/generate``."""
+        parts, last = [], {}
+        for line in lines:
+            last = json.loads(line)
+            parts.append(last.get("response") or "")
+        text = "".join(parts)
+        return text, json.dumps(dict(last, model=last.get("model", model), response=text))
+
+    def tokenize(self, session, base_url: str, text: str) -> Optional[int]:
+        return None
+
+
+class LlamaCppBackend:
+    """llama.cpp ``llama-server`` ``/completion`` with prompt caching."""
+
+    kind = "llamacpp"
+
+    def __init__(self, json_grammar: bool = LLAMACPP_JSON_GRAMMAR):
+        self.json_grammar = json_grammar
+        self._stats = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "predicted_tokens": 0}
+        self._lock = threading.Lock()
+
+    def build_request(self, model: str, prompt: str, temperature: float, max_tokens: int,
+                      context_size: int, grammar: Optional[str] = None) -> Tuple[str, Dict[str, Any]]:
+        payload = {
+            "prompt": prompt,
+            "n_predict": max_tokens,
+            "temperature": temperature,
+            "cache_prompt": True,
+            # Any idle slot, preferring the one with the most similar cached prompt
+            "id_slot": -1,
+            "stream": False
+        }
+        grammar = grammar if grammar is not None else (JSON_GRAMMAR if self.json_grammar else None)
+        if grammar:
+            payload["grammar"] = grammar
+        return "/completion", payload
+
+    def parse_response(self, model: str, body: str) -> Tuple[str, str]:
+        return self.parse_result(model, json.loads(body))
+
+    def parse_stream(self, model: str, lines: Iterable[bytes]) -> Tuple[str, str]:
+        """Join the ``data:`` events of a streamed ``/completion``; the last one carries the stats."""
+        parts, last = [], {}
+        for line in lines:
+            if not line.startswith(b"data:"):
+                continue
+            last = json.loads(line[len(b"data:"):])
+            parts.append(last.get("content") or "")
+        return self.parse_result(model, dict(last, content="".join(parts)))
+
+    def parse_result(self, model: str, data: Dict[str, Any]) -> Tuple[str, str]:
+        """One completion object (a batched call returns a list of them)."""
+        text = data.get("content") or ""
+        timings = data.get("timings") or {}
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["prompt_tokens"] += data.get("tokens_evaluated") or timings.get("prompt_n") or 0
+            self._stats["cached_tokens"] += data.get("tokens_cached") or 0
+            self._stats["predicted_tokens"] += data.get("tokens_predicted") or timings.get("predicted_n") or 0
+        envelope = json.dumps({"model": model, "response": text, "done": True})
+        return text, envelope
+
+    def tokenize(self, session, base_url: str, text: str) -> Optional[int]:
+        response = session.post(base_url + "/tokenize", json={"content": text}, timeout=30)
+        response.raise_for_status()
+        return len(response.json().get("tokens", []))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        evaluated = stats["prompt_tokens"] + stats["cached_tokens"]
+        stats["prompt_cache_hit_rate"] = round(stats["cached_tokens"] / evaluated, 3) if evaluated else 0.0
+        return stats
+
+
+_backends = {"ollama": OllamaBackend(), "llamacpp": LlamaCppBackend()}
+
+
+def get_backend(kind: str):
+    try:
+        return _backends[kind]
+    except KeyError:
+        raise ValueError(f"Unknown LLM backend: {kind}")
+
+
+def get_backend_stats() -> Dict[str, Any]:
+    return {"selected": LLM_BACKEND, "llamacpp": _backends["llamacpp"].stats()}
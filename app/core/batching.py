@@ -0,0 +1,196 @@
+"""
+Micro-batching of concurrent LLM prompts.
+
+Prompts arriving within ``LLM_BATCH_WINDOW_MS`` of each other are grouped
+by generation settings and priority class and sent together: a llama.cpp
+node receives the whole group as one ``/completion`` request with a prompt
+array, decoded in parallel slots.  Only models served by a llama.cpp node
+are batched; Ollama has no batch endpoint, so its prompts bypass the
+batcher (see ``LLMProcessor.generate_response``).  Callers do not hold a
+scheduler slot while they wait for the window: each batch takes one slot
+of its class when it is dispatched.  Every caller gets back its own result
+through a future.  Batch sizes, queueing delay and the throughput gain
+over single-prompt calls are tracked for ``/api/metrics``.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from app.core.backends import get_backend
+from app.core.router import get_router, get_http_session
+from app.core.scheduler import get_llm_context, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+LLM_BATCH_WINDOW_MS = float(os.getenv("LLM_BATCH_WINDOW_MS", "0"))
+LLM_BATCH_MAX_SIZE = int(os.getenv("LLM_BATCH_MAX_SIZE", "8"))
+
+
+def batchable(model: Optional[str]) -> bool:
+    """Prompts for ``model`` can be batched: a llama.cpp node serves it."""
+    return any(node.kind == "llamacpp" and node.serves(model) for node in get_router().nodes)
+
+
+class _Pending:
+    __slots__ = ("llm", "prompt", "temperature", "max_tokens", "grammar", "future", "enqueued", "priority", "user")
+
+    def __init__(self, llm, prompt: str, temperature: float, max_tokens: int, grammar: Optional[str]):
+        self.llm = llm
+        self.prompt = prompt
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.grammar = grammar
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+        # Scheduler class and user of the caller, applied when the batch is dispatched
+        self.priority, self.user = get_llm_context()
+
+    @property
+    def key(self):
+        return (self.llm.model, self.llm.context_size, self.temperature, self.max_tokens, self.grammar,
+                self.priority)
+
+
+def send_llamacpp_batch(items: List[_Pending], timeout: float) -> List[str]:
+    """One ``/completion`` call with a prompt array; returns one envelope per item, in order."""
+    first = items[0]
+
+    def send(node):
+        backend = get_backend(node.kind)
+        path, payload = backend.build_request(first.llm.model, first.prompt, first.temperature,
+                                              first.max_tokens, first.llm.context_size, first.grammar)
+        payload["prompt"] = [item.prompt for item in items]
+        # Slots are assigned by the server for a prompt array
+        payload["id_slot"] = -1
+        response = get_http_session().post(node.base_url + path, json=payload, timeout=timeout)
+        if response.status_code >= 500:
+            raise requests.HTTPError(f"{response.status_code} from {node.base_url}", response=response)
+        response.raise_for_status()
+        results = response.json()
+        if isinstance(results, dict):
+            results = [results]
+        if len(results) != len(items):
+            raise ValueError(f"Expected {len(items)} completions, got {len(results)}")
+        return [backend.parse_result(first.llm.model, result)[1] for result in results]
+
+    return get_router().call(first.llm.model, send, kinds=("llamacpp",))
+
+
+class MicroBatcher:
+    """Collects prompts for a short window and dispatches them as batches."""
+
+    def __init__(self, window_ms: float = LLM_BATCH_WINDOW_MS, max_batch: int = LLM_BATCH_MAX_SIZE,
+                 timeout: float = 600):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._pending: List[_Pending] = []
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max(4, max_batch), thread_name_prefix="llm-batch")
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "items": 0, "wait_seconds": 0.0, "service_seconds": 0.0, "sizes": {}}
+        threading.Thread(target=self._loop, name="llm-batcher", daemon=True).start()
+
+    def submit(self, llm, prompt: str, temperature: float, max_tokens: int, grammar: Optional[str] = None) -> Future:
+        item = _Pending(llm, prompt, temperature, max_tokens, grammar)
+        with self._cond:
+            self._pending.append(item)
+            self._cond.notify_all()
+        return item.future
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0].enqueued + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+
+            groups: Dict[Any, List[_Pending]] = {}
+            for item in batch:
+                groups.setdefault(item.key, []).append(item)
+            for group in groups.values():
+                self._executor.submit(self._dispatch, group)
+
+    def _dispatch(self, items: List[_Pending]) -> None:
+        first = items[0]
+        try:
+            # One scheduler slot per batch: llama-server decodes the prompt array as one request
+            with get_scheduler().slot(first.priority, first.user):
+                started = time.perf_counter()
+                if len(items) > 1:
+                    for item, envelope in zip(items, send_llamacpp_batch(items, self.timeout)):
+                        item.future.set_result(envelope)
+                else:
+                    first.future.set_result(first.llm.complete(first.prompt, first.temperature,
+                                                               first.max_tokens, first.grammar))
+        except Exception as e:
+            logger.warning(f"⚠️ Batch of {len(items)} prompts failed: {e}")
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(e)
+            return
+        self._record(items, started, time.perf_counter() - started)
+
+    def _record(self, items: List[_Pending], started: float, seconds: float) -> None:
+        size = len(items)
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["items"] += size
+            self._stats["wait_seconds"] += sum(started - item.enqueued for item in items)
+            self._stats["service_seconds"] += seconds
+            bucket = self._stats["sizes"].setdefault(size, {"batches": 0, "seconds": 0.0})
+            bucket["batches"] += 1
+            bucket["seconds"] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = {key: value for key, value in self._stats.items() if key != "sizes"}
+            sizes = {size: dict(bucket) for size, bucket in self._stats["sizes"].items()}
+        batches, items = stats["batches"] or 1, stats["items"] or 1
+        stats["window_ms"] = self.window * 1000
+        stats["avg_batch_size"] = round(stats["items"] / batches, 2)
+        stats["avg_wait_ms"] = round(stats["wait_seconds"] / items * 1000, 1)
+        stats["items_per_second"] = round(stats["items"] / stats["service_seconds"], 3) if stats["service_seconds"] else 0.0
+        stats["batch_sizes"] = {
+            size: {"batches": b["batches"], "avg_seconds": round(b["seconds"] / b["batches"], 3)}
+            for size, b in sorted(sizes.items())
+        }
+        # Gain = time the batched prompts would have taken one by one / time they actually took
+        single = sizes.get(1)
+        multi_items = sum(size * b["batches"] for size, b in sizes.items() if size > 1)
+        multi_seconds = sum(b["seconds"] for size, b in sizes.items() if size > 1)
+        if single and multi_seconds:
+            stats["throughput_gain"] = round(single["seconds"] / single["batches"] * multi_items / multi_seconds, 2)
+        else:
+            stats["throughput_gain"] = None
+        return stats
+
+
+_batcher: Optional[MicroBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher() -> MicroBatcher:
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = MicroBatcher()
+        return _batcher
+
+
+def get_batching_stats() -> Dict[str, Any]:
+    if _batcher is None:
+        return {"enabled": LLM_BATCH_WINDOW_MS > 0, "batches": 0}
+    return dict(_batcher.stats(), enabled=True)
@@ -0,0 +1,208 @@
+"""
+Cancellation of abandoned work.
+
+A ``CancellationToken`` is attached to a /process request, a streamed run
+or a job through a context variable.  PDF extraction, feature extraction
+and the per-trial matching loop check it between steps; an LLM call that
+is still queued in the scheduler leaves the queue, and one already running
+is streamed from the backend so that cancelling closes the connection and
+the server stops generating.  Tokens are cancelled when the client hangs
+up or when ``DELETE /jobs/<id>`` is called.
+"""
+
+import time
+import select
+import socket
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CANCEL_POLL_SECONDS = 0.2
+CLIENT_POLL_SECONDS = 0.5
+
+_current: contextvars.ContextVar = contextvars.ContextVar("cancellation_token", default=None)
+
+_stats = {"cancelled": {}, "stages": {}, "llm_calls": {"queued": 0, "in_flight": 0}}
+_stats_lock = threading.Lock()
+
+
+class Cancelled(BaseException):
+    """
+    The work was cancelled. Like ``asyncio.CancelledError`` it derives from
+    BaseException, so the pipeline's ``except Exception`` fallbacks let it through.
+    """
+
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancellationToken:
+    """Thread-safe cancel flag with callbacks run on cancellation."""
+
+    def __init__(self):
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        logger.info(f"🛑 Cancelled: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"⚠️ Cancellation callback failed: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Run ``callback`` on cancellation (now, if already cancelled); returns an unregister function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+
+def current_token() -> Optional[CancellationToken]:
+    return _current.get()
+
+
+def check_cancelled() -> None:
+    """Raise ``Cancelled`` if the work running in this context was cancelled."""
+    token = _current.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+@contextmanager
+def cancellation_scope(token: CancellationToken) -> Iterator[CancellationToken]:
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+
+
+def wait_event(event: threading.Event, token: Optional[CancellationToken] = None) -> None:
+    """``event.wait()`` that gives up with ``Cancelled`` when ``token`` is cancelled."""
+    if token is None:
+        event.wait()
+        return
+    while not event.wait(CANCEL_POLL_SECONDS):
+        token.raise_if_cancelled()
+
+
+def wait_future(future: Future, token: Optional[CancellationToken] = None) -> Any:
+    """``future.result()`` that gives up with ``Cancelled`` when ``token`` is cancelled."""
+    if token is None:
+        return future.result()
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_SECONDS)
+        except FutureTimeout:
+            token.raise_if_cancelled()
+
+
+def iter_response_lines(response, token: CancellationToken) -> Iterator[bytes]:
+    """
+    Lines of a streamed ``requests`` response.  Cancelling ``token`` closes
+    the response, dropping the connection so the backend stops generating.
+    """
+    unregister = token.on_cancel(response.close)
+    try:
+        for line in response.iter_lines():
+            if token.cancelled:
+                break
+            if line:
+                yield line
+        if token.cancelled:
+            record_llm_abort("in_flight")
+            raise Cancelled(token.reason)
+    except Cancelled:
+        raise
+    except Exception:
+        # Reading a response closed under our feet
+        if token.cancelled:
+            record_llm_abort("in_flight")
+            raise Cancelled(token.reason)
+        raise
+    finally:
+        unregister()
+        response.close()
+
+
+def watch_client(environ: Dict[str, Any], token: CancellationToken) -> Callable[[], None]:
+    """
+    Cancel ``token`` when the client of a blocking request hangs up, detected
+    as EOF on the request socket (gunicorn and the Werkzeug dev server expose
+    it in ``environ``).  Returns a function that stops watching.
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    stop = threading.Event()
+    if sock is None:
+        return stop.set
+
+    def loop():
+        while not stop.is_set() and not token.cancelled:
+            try:
+                readable, _, _ = select.select([sock], [], [], CLIENT_POLL_SECONDS)
+                if not readable:
+                    continue
+                if not sock.recv(1, socket.MSG_PEEK):
+                    token.cancel("client_disconnected")
+                    return
+                # Pipelined bytes of a next request, not a hang-up
+                time.sleep(CLIENT_POLL_SECONDS)
+            except (OSError, ValueError):
+                return
+
+    threading.Thread(target=loop, name="client-watch", daemon=True).start()
+    return stop.set
+
+
+def record_cancelled(stage: str, reason: Optional[str]) -> None:
+    """Count one cancelled request or job, by reason and by the stage it was in."""
+    with _stats_lock:
+        reason = reason or "cancelled"
+        _stats["cancelled"][reason] = _stats["cancelled"].get(reason, 0) + 1
+        _stats["stages"][stage] = _stats["stages"].get(stage, 0) + 1
+
+
+def record_llm_abort(kind: str) -> None:
+    """Count an LLM call abandoned while ``queued`` or ``in_flight``."""
+    with _stats_lock:
+        _stats["llm_calls"][kind] += 1
+
+
+def get_cancellation_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return {
+            "cancelled": dict(_stats["cancelled"]),
+            "stages": dict(_stats["stages"]),
+            "llm_calls_aborted": dict(_stats["llm_calls"]),
+        }
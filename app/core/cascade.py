@@ -0,0 +1,238 @@
+"""
+Two-stage model cascade for trial matching.
+
+Stage 1 (screen) scores every candidate cheaply through its evaluation
+plan: structured rules, plus criterion-level verdicts from a small model
+when ``LLM_SCREENER_MODEL`` is set.  Stage 2 (final) sends only the top-K
+candidates, and those whose provisional score falls inside the
+uncertainty band, to the large ``LLM_MODEL``: their criteria are judged
+one by one through the shared criterion evaluator, so a criterion common
+to several finalists is asked once per patient.  The full
+``TRIAL_MATCHING_PROMPT`` analysis is generated on demand (see
+``app.core.explanations``).
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+from app.core.llm_processor import get_llm_processor
+from app.core.prompts.trial_matching import TRIAL_MATCHING_PROMPT, TRIAL_SCORING_PROMPT
+from app.core.criteria import get_criterion_catalog, get_criterion_evaluator
+from app.core.evaluation_plan import build_plan, run_plan, trial_dependencies
+from app.core.match_state import Deadline, MatchState
+from app.core.cancellation import check_cancelled
+from app.core.json_repair import salvage_json
+from app.core.prompt_compaction import trial_prompt_payload
+
+logger = logging.getLogger(__name__)
+
+SCREENER_MODEL = os.getenv("LLM_SCREENER_MODEL", "")
+CASCADE_TOP_K = int(os.getenv("CASCADE_TOP_K", "3"))
+CASCADE_UNCERTAINTY_BAND = tuple(
+    float(bound) for bound in os.getenv("CASCADE_UNCERTAINTY_BAND", "40,70").split(",")
+)
+
+_stats = {"runs": 0, "screened": 0, "promoted": 0, "screen_seconds": 0.0, "final_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+
+def screen_trial(trial: Dict[str, Any], features: Dict[str, Any], catalog=None, evaluator=None) -> Dict[str, Any]:
+    """
+    Provisional result for one trial: the evaluation plan runs structured and
+    regex checks first, small-model criteria last, stopping at a hard exclusion.
+    """
+    result = run_plan(trial, features, build_plan(trial, catalog), evaluator)
+    result["stage"] = "screen"
+    result["screen_score"] = result["match_score"]
+    return result
+
+
+def select_finalists(results: List[Dict[str, Any]], top_k: int = CASCADE_TOP_K,
+                     band: Tuple[float, float] = CASCADE_UNCERTAINTY_BAND) -> List[str]:
+    """
+    Trial ids promoted to the large model, best provisional score first:
+    the top-K plus the uncertainty band.  Promotion follows the ranking, so
+    every trial scoring above a promoted band trial is promoted too.
+    """
+    ranked = sorted(
+        (r for r in results if r["recommendation"] != "NOT_RECOMMENDED"),
+        key=lambda r: r["match_score"], reverse=True
+    )
+    low, high = band
+    last = min(top_k, len(ranked)) - 1
+    for position, r in enumerate(ranked):
+        if low <= r["match_score"] <= high:
+            last = position
+    return [r["trial_id"] for r in ranked[:last + 1]]
+
+
+def finalize_trial(trial: Dict[str, Any], features: Dict[str, Any], catalog, evaluator) -> Dict[str, Any]:
+    """Final result of one finalist: its evaluation plan with every criterion judged by the large model."""
+    result = run_plan(trial, features, build_plan(trial, catalog), evaluator)
+    result["stage"] = "final"
+    result["explanation"] = "on_demand"
+    return result
+
+
+def score_trial_llm(trial: Dict[str, Any], features: Dict[str, Any], llm) -> Dict[str, Any]:
+    """Compact TRIAL_SCORING_PROMPT score of one trial; None if unparseable."""
+    prompt = TRIAL_SCORING_PROMPT.format(
+        patient_features=json.dumps(features, indent=2),
+        trial=trial_prompt_payload(trial)
+    )
+    response = llm.generate_text(prompt)
+    salvaged = salvage_json(response, kind="trial_score")
+    score = salvaged.value
+    if score is None or (salvaged.salvaged and "match_score" not in score):
+        logger.error(f"❌ LLM response could not be parsed for trial scoring: {response}")
+        return None
+    return {
+        "trial_id": trial.get("id"),
+        "title": trial.get("title", "Unknown Trial"),
+        "description": trial.get("description", "No description provided."),
+        "match_score": score.get("match_score", 0),
+        "recommendation": score.get("overall_recommendation", "UNKNOWN"),
+        "criteria_analysis": {},
+        "summary": score.get("summary") or "No summary available.",
+        "explanation": "on_demand",
+        "stage": "final"
+    }
+
+
+def analyze_trial_llm(trial: Dict[str, Any], features: Dict[str, Any], llm) -> Dict[str, Any]:
+    """Full TRIAL_MATCHING_PROMPT analysis of one trial; None if unparseable."""
+    prompt = TRIAL_MATCHING_PROMPT.format(
+        patient_features=json.dumps(features, indent=2),
+        trial=trial_prompt_payload(trial)
+    )
+    response = llm.generate_text(prompt)
+    salvaged = salvage_json(response, kind="trial_match")
+    match_result = salvaged.value
+    if match_result is None:
+        logger.error(f"❌ LLM response could not be parsed for trial matching: {response}")
+        return None
+    if salvaged.salvaged and ("match_score" not in match_result or "match_score" in salvaged.incomplete):
+        logger.error(f"❌ Salvaged trial matching output has no match score: {response[:500]}")
+        return None
+
+    key_factors = match_result.get("key_factors", {})
+    return {
+        "trial_id": trial.get("id"),
+        "title": trial.get("title", "Unknown Trial"),
+        "description": trial.get("description", "No description provided."),
+        "match_score": match_result.get("match_score", 0),
+        "recommendation": match_result.get("overall_recommendation", "UNKNOWN"),
+        "criteria_analysis": match_result.get("criteria_analysis", {}),
+        "key_factors": key_factors,
+        "uncertainty_areas": match_result.get("uncertainty_areas", []),
+        "next_steps": match_result.get("next_steps", []),
+        "summary": match_result.get("summary") or "; ".join(key_factors.get("supporting", [])) or "No summary available.",
+        "stage": "final"
+    }
+
+
+def run_cascade(features: Dict[str, Any], candidates: List[Dict[str, Any]], trials: List[Dict[str, Any]],
+                llm=None, deadline: Deadline = None, state: MatchState = None,
+                on_result: Callable[[Dict[str, Any]], None] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Screen all candidates, then re-evaluate the finalists with the large model.
+
+    Candidates are screened in the given (prior likelihood) order and
+    finalists in provisional-score order.  When ``deadline`` expires the
+    remaining work is skipped; ``state`` keeps completed results so a later
+    call resumes where this one stopped.  A cancelled caller stops between
+    trials with ``Cancelled``.  ``on_result`` is called with every
+    screen or final result as soon as it is available.  Returns the best
+    available result per candidate and a per-stage report.
+    """
+    llm = llm or get_llm_processor()
+    state = state or MatchState(features)
+    deadline = deadline or Deadline()
+    catalog = get_criterion_catalog(trials)
+    finalist_evaluator = get_criterion_evaluator(features, llm)
+    screener = None
+    if SCREENER_MODEL:
+        screener = get_criterion_evaluator(features, get_llm_processor(model=SCREENER_MODEL))
+
+    with state.lock:
+        state.candidates = candidates
+
+    started = time.perf_counter()
+    screened_now = 0
+    for trial in candidates:
+        if trial.get("id") in state.screened:
+            continue
+        if deadline.expired():
+            break
+        check_cancelled()
+        result = screen_trial(trial, features, catalog if screener else None, screener)
+        with state.lock:
+            state.screened[trial.get("id")] = result
+            state.dependencies[trial.get("id")] = trial_dependencies(trial)
+        screened_now += 1
+        if on_result:
+            on_result(result)
+    screen_seconds = time.perf_counter() - started
+
+    with state.lock:
+        promoted = state.promoted = select_finalists(list(state.screened.values()))
+    by_id = {trial.get("id"): trial for trial in candidates}
+    started = time.perf_counter()
+    finalized_now = 0
+    for trial_id in promoted:
+        if trial_id in state.finalized:
+            continue
+        if deadline.expired():
+            break
+        check_cancelled()
+        final = finalize_trial(by_id[trial_id], features, catalog, finalist_evaluator)
+        final["screen_score"] = state.screened[trial_id]["screen_score"]
+        with state.lock:
+            state.finalized[trial_id] = final
+        finalized_now += 1
+        if on_result:
+            on_result(final)
+    final_seconds = time.perf_counter() - started
+
+    with state.lock:
+        state.complete = (
+            len(state.screened) == len(candidates)
+            and all(trial_id in state.finalized for trial_id in promoted)
+        )
+
+    report = {
+        "screener": SCREENER_MODEL or "rules",
+        "finalist_model": getattr(llm, "model", None),
+        "screened": screened_now,
+        "promoted": finalized_now,
+        "screen_seconds": round(screen_seconds, 3),
+        "final_seconds": round(final_seconds, 3),
+        "not_evaluated": state.not_evaluated(),
+        "not_finalized": sum(1 for trial_id in promoted if trial_id not in state.finalized),
+        "complete": state.complete
+    }
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["screened"] += report["screened"]
+        _stats["promoted"] += report["promoted"]
+        _stats["screen_seconds"] += screen_seconds
+        _stats["final_seconds"] += final_seconds
+    logger.info(f"📊 Cascade: {report}")
+    return state.results(), report
+
+
+def get_cascade_stats() -> Dict[str, Any]:
+    """Cumulative per-stage latency and promotion rate, for threshold tuning."""
+    with _stats_lock:
+        stats = dict(_stats)
+    runs = stats["runs"] or 1
+    stats["avg_screen_seconds"] = round(stats["screen_seconds"] / runs, 3)
+    stats["avg_final_seconds"] = round(stats["final_seconds"] / runs, 3)
+    stats["promotion_rate"] = round(stats["promoted"] / stats["screened"], 3) if stats["screened"] else 0.0
+    stats["top_k"] = CASCADE_TOP_K
+    stats["uncertainty_band"] = list(CASCADE_UNCERTAINTY_BAND)
+    return stats
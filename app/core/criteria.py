@@ -0,0 +1,330 @@
+"""
+Criterion-level evaluation with deduplication across the trial catalog.
+
+Many trials repeat the same eligibility criteria ("ECOG 0-1", "adequate
+organ function", "no active brain metastases").  Criteria are split out of
+each trial, normalised and hashed; every unique criterion is then judged by
+the LLM at most once per patient and the verdict is fanned out to every
+trial that contains it.  Concurrent trials needing the same criterion wait
+for the call already in flight instead of issuing their own.
+"""
+
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.cancellation import Cancelled, current_token, wait_future
+from app.core.fingerprint import catalog_hash, features_hash
+from app.core.json_repair import salvage_json
+from app.core.llm_processor import get_llm_processor
+from app.core.prompts.trial_matching import CRITERION_EVALUATION_PROMPT
+from app.core.scheduler import SchedulerSaturated
+
+logger = logging.getLogger(__name__)
+
+EVALUATOR_CACHE_SIZE = 64
+# Handed to waiting callers when the leader's own request was cancelled or rejected
+_RETRY = object()
+
+_HEADER_RE = re.compile(
+    r'^(?:the\s+)?(?:main\s+)?(inclusion|exclusion)(\s+and\s+exclusion)?\s+criteria\b', re.IGNORECASE
+)
+_BULLET_RE = re.compile(r'^\s*(?:[*\-•]|\d+[.)])\s*')
+_NORMALIZATIONS = [
+    (re.compile(r'\\'), ''),
+    (re.compile(r'≥'), '>='),
+    (re.compile(r'≤'), '<='),
+    (re.compile(r'[–—]'), '-'),
+    (re.compile(r'eastern cooperative oncology group\s*(?:\(ecog\))?'), 'ecog'),
+    (re.compile(r'\bperformance status\b'), 'ps'),
+    (re.compile(r'^(?:has|have|had|patients? (?:has|have|with))\s+'), ''),
+    (re.compile(r'^(?:an?|the)\s+'), ''),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def clean_criterion(line: str) -> str:
+    """Strip bullets, numbering and markdown escapes from a criterion line."""
+    return _BULLET_RE.sub('', line).replace('\\', '').strip()
+
+
+def normalize_criterion(text: str) -> str:
+    """Canonical form used to recognise the same criterion across trials."""
+    text = clean_criterion(text).lower()
+    for pattern, replacement in _NORMALIZATIONS:
+        text = pattern.sub(replacement, text)
+    return text.strip(' .;:')
+
+
+def criterion_key(text: str) -> str:
+    return hashlib.sha1(normalize_criterion(text).encode('utf-8')).hexdigest()[:16]
+
+
+def _parse_criteria(lines: List[str], kind: str) -> Dict[str, List[str]]:
+    sections = {"inclusion": [], "exclusion": []}
+    for raw in lines or []:
+        if not isinstance(raw, str) or not raw.strip():
+            continue
+        header = _HEADER_RE.match(raw.strip())
+        if header:
+            if not header.group(2):
+                kind = header.group(1).lower()
+            continue
+        text = clean_criterion(raw)
+        if not text:
+            continue
+        # Indented sub-items ("  1. ...") belong to the criterion above them
+        if raw[:1].isspace() and sections[kind]:
+            separator = " " if sections[kind][-1].endswith(":") else "; "
+            sections[kind][-1] += separator + text
+        else:
+            sections[kind].append(text)
+    return sections
+
+
+def split_eligibility(trial: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """
+    Return (inclusion, exclusion) criteria of a trial.
+    The catalog often stores the full eligibility text in both lists, with
+    "Inclusion Criteria:" / "Exclusion Criteria:" headers inside; those
+    headers decide the section.
+    """
+    inclusion_lines = trial.get('inclusion_criteria') or []
+    exclusion_lines = trial.get('exclusion_criteria') or []
+
+    sections = _parse_criteria(inclusion_lines, "inclusion")
+    if exclusion_lines != inclusion_lines:
+        extra = _parse_criteria(exclusion_lines, "exclusion")
+        sections["inclusion"] += extra["inclusion"]
+        sections["exclusion"] += extra["exclusion"]
+    return sections["inclusion"], sections["exclusion"]
+
+
+class CriterionCatalog:
+    """Unique criteria of a trial catalog and the trials that reference them."""
+
+    def __init__(self, trials: List[Dict[str, Any]]):
+        self.criteria: Dict[str, str] = {}
+        self.trial_criteria: Dict[str, List[Tuple[str, str]]] = {}
+        self.occurrences = 0
+
+        for trial in trials:
+            entries = []
+            inclusion, exclusion = split_eligibility(trial)
+            for kind, items in (("inclusion", inclusion), ("exclusion", exclusion)):
+                for text in items:
+                    key = criterion_key(text)
+                    if (key, kind) in entries:
+                        continue
+                    self.criteria.setdefault(key, text)
+                    entries.append((key, kind))
+            self.trial_criteria[trial.get('id')] = entries
+            self.occurrences += len(entries)
+
+    def stats(self) -> Dict[str, Any]:
+        unique = len(self.criteria)
+        return {
+            "unique_criteria": unique,
+            "criterion_occurrences": self.occurrences,
+            "dedup_ratio": round(1 - unique / self.occurrences, 3) if self.occurrences else 0.0
+        }
+
+
+class CriterionEvaluator:
+    """
+    Judges criteria for one patient, asking the LLM at most once per unique
+    criterion, including when several threads need it at the same time.
+    Shared by every trial evaluated for that patient.
+    """
+
+    def __init__(self, features: Dict[str, Any], llm=None):
+        self.features = features
+        self.llm = llm or get_llm_processor()
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.llm_calls = 0
+        self.cache_hits = 0
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _patient_json(self) -> str:
+        view = {
+            key: value for key, value in self.features.items()
+            if not key.endswith('_source_text') and key != 'original_text'
+        }
+        return json.dumps(view, ensure_ascii=False, separators=(",", ":"))
+
+    def _ask_llm(self, text: str) -> Optional[Dict[str, Any]]:
+        prompt = CRITERION_EVALUATION_PROMPT.format(patient_features=self._patient_json(), criterion=text)
+        response = self.llm.generate_text(prompt)
+        parsed = salvage_json(response, kind="criterion").value
+        if parsed is None:
+            logger.error(f"❌ Criterion verdict could not be parsed: {response}")
+            return None
+        met = parsed.get("met")
+        return {
+            "met": met if isinstance(met, bool) else None,
+            "explanation": parsed.get("explanation", "")
+        }
+
+    def inherit(self, other: "CriterionEvaluator", keep: Callable[[str], bool]) -> int:
+        """Copy the verdicts of ``other`` whose criterion key passes ``keep``; returns how many."""
+        with other._lock:
+            verdicts = dict(other.results)
+        inherited = 0
+        with self._lock:
+            for key, verdict in verdicts.items():
+                if key not in self.results and keep(key):
+                    self.results[key] = verdict
+                    inherited += 1
+        return inherited
+
+    def evaluate(self, key: str, text: str) -> Dict[str, Any]:
+        with self._lock:
+            if key in self.results:
+                self.cache_hits += 1
+                _record_stats(cache_hits=1)
+                return self.results[key]
+            pending = self._pending.get(key)
+            if pending is None:
+                future = self._pending[key] = Future()
+            else:
+                self.cache_hits += 1
+        if pending is not None:
+            _record_stats(cache_hits=1)
+            verdict = wait_future(pending, current_token())
+            if verdict is _RETRY:
+                # The leader's caller went away or was turned down, not ours
+                return self.evaluate(key, text)
+            return verdict
+
+        try:
+            verdict = self._ask_llm(text)
+        except BaseException as e:
+            with self._lock:
+                self._pending.pop(key, None)
+            if isinstance(e, (Cancelled, SchedulerSaturated)):
+                future.set_result(_RETRY)
+            else:
+                future.set_exception(e)
+            raise
+        _record_stats(llm_calls=1)
+        with self._lock:
+            self.llm_calls += 1
+            self._pending.pop(key, None)
+            if verdict is None:
+                # Not cached: a later trial may get a parseable answer
+                verdict = {"met": None, "explanation": "Unable to evaluate criterion."}
+            else:
+                self.results[key] = verdict
+        future.set_result(verdict)
+        return verdict
+
+
+_catalog_lock = threading.Lock()
+_catalog: Optional[CriterionCatalog] = None
+_catalog_hash: Optional[str] = None
+_evaluators: "OrderedDict[str, CriterionEvaluator]" = OrderedDict()
+_evaluators_lock = threading.Lock()
+_stats = {"llm_calls": 0, "cache_hits": 0}
+_stats_lock = threading.Lock()
+
+
+def _record_stats(llm_calls: int = 0, cache_hits: int = 0) -> None:
+    with _stats_lock:
+        _stats["llm_calls"] += llm_calls
+        _stats["cache_hits"] += cache_hits
+
+
+def get_criterion_catalog(trials: List[Dict[str, Any]]) -> CriterionCatalog:
+    """Shared catalog, rebuilt only when the trial catalog changes."""
+    global _catalog, _catalog_hash
+    expected = catalog_hash(trials)
+    with _catalog_lock:
+        if _catalog is None or _catalog_hash != expected:
+            _catalog = CriterionCatalog(trials)
+            _catalog_hash = expected
+            logger.info(f"📊 Criterion catalog built: {_catalog.stats()}")
+        return _catalog
+
+
+def get_criterion_evaluator(features: Dict[str, Any], llm=None) -> CriterionEvaluator:
+    """Evaluator for a patient and model, reused across requests with the same features."""
+    llm = llm or get_llm_processor()
+    key = f"{getattr(llm, 'model', '')}:{features_hash(features)}"
+    with _evaluators_lock:
+        evaluator = _evaluators.get(key)
+        if evaluator is None:
+            evaluator = CriterionEvaluator(features, llm)
+            _evaluators[key] = evaluator
+            while len(_evaluators) > EVALUATOR_CACHE_SIZE:
+                _evaluators.popitem(last=False)
+        else:
+            _evaluators.move_to_end(key)
+        return evaluator
+
+
+def get_dedup_stats() -> Dict[str, Any]:
+    """Dedup ratio of the current catalog and LLM calls saved so far."""
+    with _stats_lock:
+        stats = {"llm_calls": _stats["llm_calls"], "llm_calls_saved": _stats["cache_hits"]}
+    stats.update(_catalog.stats() if _catalog else {})
+    return stats
+
+
+def summarize_trial(trial: Dict[str, Any], inclusion: List[Dict[str, Any]],
+                    exclusion: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Aggregate per-criterion verdicts into a trial match result.
+
+    ``match_score`` is the percentage of criteria judged favourable (an
+    inclusion met, an exclusion not violated), unclear verdicts counting
+    half.  A failed inclusion or violated exclusion makes the trial
+    NOT_RECOMMENDED with score 0; otherwise it is RECOMMENDED only when no
+    verdict is unclear.
+    """
+    met = sum(1 for item in inclusion if item["met"] is True)
+    failed = sum(1 for item in inclusion if item["met"] is False)
+    violated = sum(1 for item in exclusion if item["violated"] is True)
+    clear = sum(1 for item in exclusion if item["violated"] is False)
+    unknown = len(inclusion) + len(exclusion) - met - failed - violated - clear
+    total = len(inclusion) + len(exclusion)
+
+    if violated or failed:
+        recommendation = "NOT_RECOMMENDED"
+    elif unknown:
+        recommendation = "POTENTIALLY_ELIGIBLE"
+    else:
+        recommendation = "RECOMMENDED"
+
+    return {
+        "trial_id": trial.get("id"),
+        "title": trial.get("title", "Unknown Trial"),
+        "description": trial.get("description", "No description provided."),
+        "match_score": 0 if recommendation == "NOT_RECOMMENDED" or not total
+        else round(100 * (met + clear + unknown / 2) / total),
+        "recommendation": recommendation,
+        "criteria_analysis": {
+            "inclusion_criteria": inclusion,
+            "exclusion_criteria": exclusion
+        },
+        "summary": (f"{met}/{len(inclusion)} inclusion criteria met, "
+                    f"{violated} exclusion criteria violated, {unknown} unclear.")
+    }
+
+
+def evaluate_trial(trial: Dict[str, Any], catalog: CriterionCatalog, evaluator: CriterionEvaluator) -> Dict[str, Any]:
+    """Evaluate one trial criterion by criterion, reusing shared verdicts."""
+    inclusion, exclusion = [], []
+    for key, kind in catalog.trial_criteria.get(trial.get("id"), []):
+        text = catalog.criteria[key]
+        verdict = evaluator.evaluate(key, text)
+        if kind == "inclusion":
+            inclusion.append({"criterion": text, "met": verdict["met"], "explanation": verdict["explanation"]})
+        else:
+            exclusion.append({"criterion": text, "violated": verdict["met"], "explanation": verdict["explanation"]})
+    return summarize_trial(trial, inclusion, exclusion)
@@ -0,0 +1,322 @@
+"""
+Semantic retrieval of clinical trials.
+
+Trial embeddings are computed once through the local backend's embeddings
+endpoint and stored on disk as a float32 matrix plus a JSON id map.  The
+matrix is opened with ``numpy.memmap`` in read-only mode, so every gunicorn
+worker shares the same pages from the OS cache instead of holding a copy.
+Retrieval is a brute-force top-K dot product over L2-normalised rows, which
+is exact and fast enough for catalogs of tens of thousands of trials.
+
+The index is built at ingest (``scripts/trials_manager.py``,
+``scripts/build_embeddings.py``).  A request that finds it stale keeps
+serving the previous index while one background thread per process
+rebuilds it; hits on trials no longer in the catalog are dropped.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.fingerprint import catalog_hash, features_hash
+from app.core.router import get_http_session, get_router
+from app.core.scheduler import get_scheduler, llm_context
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", os.path.join("data", "embeddings"))
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+SEMANTIC_TOP_K = int(os.getenv("SEMANTIC_TOP_K", "10"))
+QUERY_CACHE_SIZE = 256
+
+VECTORS_FILE = "trial_vectors.f32"
+IDS_FILE = "trial_vectors.json"
+
+
+class OllamaEmbedder:
+    """
+    Embeds text through Ollama's ``/api/embeddings`` endpoint, on the
+    backend chosen by the router unless ``OLLAMA_EMBEDDINGS_URL`` pins one.
+    """
+
+    def __init__(self, model: str = EMBEDDING_MODEL, api_url: Optional[str] = None, timeout: float = 60):
+        self.model = model
+        self.api_url = api_url or os.getenv("OLLAMA_EMBEDDINGS_URL")
+        self.timeout = timeout
+
+    @property
+    def name(self) -> str:
+        return f"ollama:{self.model}"
+
+    def embed(self, text: str) -> List[float]:
+        payload = {"model": self.model, "prompt": text}
+        with get_scheduler().slot():
+            if self.api_url:
+                response = get_http_session().post(self.api_url, json=payload, timeout=self.timeout)
+            else:
+                response = get_router().post(self.model, "/api/embeddings", payload, timeout=self.timeout)
+        response.raise_for_status()
+        embedding = response.json().get("embedding")
+        if not embedding:
+            raise ValueError(f"Empty embedding returned by {response.url}")
+        return embedding
+
+
+class HashingEmbedder:
+    """
+    Deterministic bag-of-words embedder (signed feature hashing).
+    Needs no model; used by the tests and when no embeddings endpoint exists.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    @property
+    def name(self) -> str:
+        return f"hashing:{self.dim}"
+
+    def embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for token in text.lower().split():
+            token = token.strip(".,;:()[]{}\"'")
+            if not token:
+                continue
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        return vector
+
+
+def get_embedder():
+    if EMBEDDING_BACKEND == "hashing":
+        return HashingEmbedder()
+    return OllamaEmbedder()
+
+
+def _normalize(vector) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm > 0 else array
+
+
+def _feature_value(value: Any) -> Any:
+    """Accepts both flat LLM values and ``{"value": ..., "source": ...}`` entries."""
+    if isinstance(value, dict) and "value" in value:
+        return value["value"]
+    return value
+
+
+def trial_text(trial: Dict[str, Any], max_chars: int = 4000) -> str:
+    """Text used to embed a trial: title, summary and unique eligibility lines."""
+    parts = [trial.get("title", "")]
+    description = trial.get("description", "")
+    if description and description != "No description provided.":
+        parts.append(description)
+
+    seen = set()
+    for line in (trial.get("inclusion_criteria") or []) + (trial.get("exclusion_criteria") or []):
+        line = line.strip() if isinstance(line, str) else ""
+        if line and line not in seen:
+            seen.add(line)
+            parts.append(line)
+
+    return "\n".join(parts)[:max_chars]
+
+
+def features_text(features: Dict[str, Any]) -> str:
+    """Text used to embed a patient query built from extracted features."""
+    parts = []
+    for key in ("diagnosis", "stage", "mutations", "metastases", "previous_treatments"):
+        value = _feature_value(features.get(key))
+        if isinstance(value, list):
+            value = ", ".join(str(_feature_value(v)) for v in value if v)
+        if value and value != "not mentioned":
+            parts.append(f"{key.replace('_', ' ')}: {value}")
+    return "\n".join(parts)
+
+
+class TrialEmbeddingIndex:
+    """Read-only, memory-mapped matrix of trial embeddings with its id map."""
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], model: str, catalog: str, directory: str = None):
+        self.vectors = vectors
+        self.ids = ids
+        self.model = model
+        self.catalog_hash = catalog
+        self.directory = directory
+
+    @property
+    def dim(self) -> int:
+        return int(self.vectors.shape[1]) if len(self.ids) else 0
+
+    @classmethod
+    def build(cls, trials: List[Dict[str, Any]], embedder, directory: str = EMBEDDINGS_DIR) -> "TrialEmbeddingIndex":
+        """Embed every trial and write the matrix atomically next to its id map."""
+        os.makedirs(directory, exist_ok=True)
+        ids = [trial.get("id") for trial in trials]
+        rows = [_normalize(embedder.embed(trial_text(trial))) for trial in trials]
+        dim = len(rows[0]) if rows else 0
+
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        # Per-process temporary files: several workers may rebuild at once
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp_path = vectors_path + suffix
+        if rows:
+            matrix = np.memmap(tmp_path, dtype=np.float32, mode="w+", shape=(len(rows), dim))
+            matrix[:] = np.vstack(rows)
+            matrix.flush()
+            del matrix
+        else:
+            open(tmp_path, "wb").close()
+        os.replace(tmp_path, vectors_path)
+
+        meta = {"ids": ids, "dim": dim, "model": embedder.name, "catalog_hash": catalog_hash(trials)}
+        ids_path = os.path.join(directory, IDS_FILE)
+        with open(ids_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(ids_path + suffix, ids_path)
+
+        logger.info(f"✅ Embedded {len(ids)} trials with {embedder.name} ({dim} dims) into {directory}")
+        return cls.load(directory)
+
+    @classmethod
+    def load(cls, directory: str = EMBEDDINGS_DIR) -> Optional["TrialEmbeddingIndex"]:
+        ids_path = os.path.join(directory, IDS_FILE)
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        if not (os.path.exists(ids_path) and os.path.exists(vectors_path)):
+            return None
+
+        with open(ids_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+
+        ids = meta.get("ids", [])
+        dim = meta.get("dim", 0)
+        if os.path.getsize(vectors_path) != len(ids) * dim * 4:
+            # Matrix already replaced by a rebuild whose id map is not written yet
+            return None
+        if ids:
+            vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(len(ids), dim))
+        else:
+            vectors = np.zeros((0, 0), dtype=np.float32)
+        return cls(vectors, ids, meta.get("model", ""), meta.get("catalog_hash", ""), directory)
+
+    def search(self, query_vector, top_k: int = SEMANTIC_TOP_K) -> List[Tuple[str, float]]:
+        """Return the ``top_k`` (trial_id, cosine score) pairs, best first."""
+        if not self.ids:
+            return []
+        query = _normalize(query_vector)
+        if query.shape[0] != self.dim:
+            raise ValueError(f"Query has {query.shape[0]} dims, index has {self.dim}")
+
+        scores = self.vectors @ query
+        top_k = min(top_k, len(self.ids))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.ids[i], float(scores[i])) for i in top]
+
+
+_index_lock = threading.Lock()
+_index: Optional[TrialEmbeddingIndex] = None
+_rebuilding = False
+_query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def _rebuild_in_background(trials: List[Dict[str, Any]], embedder, directory: str) -> None:
+    global _rebuilding
+    with _index_lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+
+    def worker():
+        global _index, _rebuilding
+        try:
+            with llm_context("ingest"):
+                index = TrialEmbeddingIndex.build(trials, embedder, directory)
+            with _index_lock:
+                _index = index
+        except Exception as e:
+            logger.warning(f"⚠️ Trial embedding index rebuild failed: {e}")
+        finally:
+            with _index_lock:
+                _rebuilding = False
+
+    logger.info("🔧 Trial embedding index missing or stale, rebuilding in background...")
+    threading.Thread(target=worker, name="embedding-rebuild", daemon=True).start()
+
+
+def get_trial_index(trials: List[Dict[str, Any]], embedder=None, directory: str = EMBEDDINGS_DIR) -> Optional[TrialEmbeddingIndex]:
+    """
+    Return the shared index for ``trials``.  When the catalog changed the
+    previous index of the same model is returned while a background rebuild
+    runs; None if there is no usable index yet.
+    """
+    global _index
+    embedder = embedder or get_embedder()
+    expected = catalog_hash(trials)
+
+    def current(index):
+        return (index is not None and index.directory == directory
+                and index.catalog_hash == expected and index.model == embedder.name)
+
+    with _index_lock:
+        if not current(_index):
+            # Possibly rebuilt at ingest or by another worker
+            loaded = TrialEmbeddingIndex.load(directory)
+            if loaded is not None:
+                _index = loaded
+        index = _index
+    if current(index):
+        return index
+    _rebuild_in_background(trials, embedder, directory)
+    if index is not None and index.directory == directory and index.model == embedder.name:
+        return index
+    return None
+
+
+def embed_features(features: Dict[str, Any], embedder=None) -> np.ndarray:
+    """Embed a patient query, cached by feature hash."""
+    embedder = embedder or get_embedder()
+    key = f"{embedder.name}:{features_hash(features)}"
+
+    with _query_cache_lock:
+        if key in _query_cache:
+            _query_cache.move_to_end(key)
+            return _query_cache[key]
+
+    vector = _normalize(embedder.embed(features_text(features)))
+
+    with _query_cache_lock:
+        _query_cache[key] = vector
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return vector
+
+
+def retrieve_trials(features: Dict[str, Any], trials: List[Dict[str, Any]], top_k: int = SEMANTIC_TOP_K,
+                    embedder=None, directory: str = EMBEDDINGS_DIR) -> List[Tuple[Dict[str, Any], float]]:
+    """
+    Semantic top-K retrieval of ``trials`` for a patient.
+    Returns an empty list if the embeddings backend is unavailable.
+    """
+    if not trials or not features_text(features):
+        return []
+    try:
+        embedder = embedder or get_embedder()
+        index = get_trial_index(trials, embedder, directory)
+        if index is None:
+            return []
+        by_id = {trial.get("id"): trial for trial in trials}
+        hits = index.search(embed_features(features, embedder), top_k)
+        return [(by_id[trial_id], score) for trial_id, score in hits if trial_id in by_id]
+    except Exception as e:
+        logger.warning(f"⚠️ Semantic retrieval unavailable: {e}")
+        return []
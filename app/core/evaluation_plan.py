@@ -0,0 +1,351 @@
+"""
+Per-trial evaluation plans ordered by cost and selectivity.
+
+Checks run cheapest tier first (structured fields, then regex over the
+criteria text, then LLM verdicts).  Inside a tier, criterion types that
+historically reject the most patients run first.  A trial stops at the
+first hard exclusion and the reason is recorded; rejection counts are kept
+per criterion type, once per patient and trial, and summed across workers
+in a SQLite file so the ordering adapts over time.
+"""
+
+import os
+import re
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.core.criteria import split_eligibility, summarize_trial
+from app.core.fingerprint import features_hash
+from app.core.rules import check_age, check_gender, check_histology, feature_value, rule_screen
+from app.core.vocabulary import get_vocabulary
+
+logger = logging.getLogger(__name__)
+
+COST_STRUCTURED = 0
+COST_REGEX = 1
+COST_LLM = 2
+
+REJECTION_STATS_DB_PATH = os.getenv("REJECTION_STATS_DB_PATH", os.path.join("data", "rejection_stats.sqlite3"))
+STATS_FLUSH_EVERY = 50
+# (patient, trial, check) outcomes already counted by this process
+STATS_RECORDED_SIZE = 65536
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rejection_stats (
+    check_type TEXT PRIMARY KEY,
+    evaluated INTEGER NOT NULL,
+    rejected INTEGER NOT NULL
+);
+"""
+
+CRITERION_TYPES = [
+    ("brain_metastases", re.compile(r'brain|\bcns\b|central nervous|leptomeningeal', re.I)),
+    ("performance_status", re.compile(r'ecog|performance status|karnofsky', re.I)),
+    ("biomarker", re.compile(r'mutation|\begfr\b|\balk\b|\bros1\b|\bkras\b|\bbraf\b|\bher2\b|pd-l1|\bmet\b|\bret\b|\bntrk\b', re.I)),
+    ("organ_function", re.compile(r'organ function|hepatic|renal|creatinine|bilirubin|neutrophil|platelet|hemoglobin|\bast\b|\balt\b', re.I)),
+    ("infection", re.compile(r'infection|\bhiv\b|hepatitis|tuberculosis', re.I)),
+    ("autoimmune", re.compile(r'autoimmune|pneumonitis|interstitial lung', re.I)),
+    ("pregnancy", re.compile(r'pregnan|breast.?feeding|contracepti', re.I)),
+    ("malignancy", re.compile(r'malignanc', re.I)),
+    ("prior_therapy", re.compile(r'prior|previous|received|treated with', re.I)),
+    ("histology", re.compile(r'histolog|cytolog|carcinoma|nsclc|sclc', re.I)),
+]
+
+# Patient features a criterion can depend on, recognised by the terms it uses.
+# A criterion naming none of them cannot be decided from the extracted features.
+FEATURE_PATTERNS = [
+    ("age", re.compile(r'\bage\b|\baged\b|years? old|\d+\s*years', re.I)),
+    ("gender", re.compile(r'\bmale\b|\bfemale\b|\bwom[ae]n\b|\bmen\b|pregnan|breast.?feeding|childbearing|contracepti', re.I)),
+    ("diagnosis", re.compile(r'histolog|cytolog|carcinoma|nsclc|sclc|squamous|lung cancer|malignanc', re.I)),
+    ("stage", re.compile(r'\bstage\b|metastatic|advanced|locally|unresectable|recurrent|\btnm\b', re.I)),
+    ("ecog", re.compile(r'ecog|performance status|karnofsky', re.I)),
+    ("mutations", re.compile(r'mutation|alteration|rearrangement|fusion|amplification|\begfr\b|\balk\b|\bros1\b|'
+                             r'\bkras\b|\bbraf\b|\bher2\b|pd-l1|\bmet\b|\bret\b|\bntrk\b', re.I)),
+    ("metastases", re.compile(r'metasta|brain|\bcns\b|central nervous|leptomeningeal|lesion', re.I)),
+    ("previous_treatments", re.compile(r'prior|previous|received|treated|therapy|treatment|inhibitor|radiation|surgery|resection', re.I)),
+    ("lab_values", re.compile(r'organ function|hepatic|renal|creatinine|bilirubin|neutrophil|platelet|hemoglobin|'
+                              r'\bast\b|\balt\b|\buln\b|laborator|clearance', re.I)),
+]
+
+# Features read by the structured checks and by the rule-based provisional score
+STRUCTURED_DEPENDENCIES = {"age": ("age",), "gender": ("gender",), "histology": ("diagnosis",),
+                           "excluded_mutation": ("mutations",)}
+RULE_SCREEN_DEPENDENCIES = ("age", "gender", "diagnosis", "mutations")
+
+_MUTATION_CONTEXT = re.compile(r'mutation|alteration|rearrangement|fusion|positive|amplification', re.I)
+_THERAPY_CONTEXT = re.compile(r'prior|previous|therapy|inhibitor|treatment|treated|targeting', re.I)
+
+
+class Uncertain(str):
+    """Check outcome that neither passes nor rejects: the criterion is left undecided."""
+
+
+@lru_cache(maxsize=4096)
+def criterion_type(text: str) -> str:
+    for name, pattern in CRITERION_TYPES:
+        if pattern.search(text):
+            return name
+    return "other"
+
+
+@lru_cache(maxsize=4096)
+def criterion_dependencies(text: str) -> tuple:
+    """Patient features a criterion's verdict depends on."""
+    return tuple(field for field, pattern in FEATURE_PATTERNS if pattern.search(text))
+
+
+def trial_dependencies(trial: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    For each patient feature, the checks and criteria of ``trial`` that read
+    it: the structured checks, the rule-based score, and every criterion
+    (screened by the small model and all seen by the final-stage prompt).
+    """
+    dependencies: Dict[str, List[str]] = {}
+
+    def add(fields, criterion: str) -> None:
+        for field in fields:
+            criteria = dependencies.setdefault(field, [])
+            if criterion not in criteria:
+                criteria.append(criterion)
+
+    add(STRUCTURED_DEPENDENCIES["age"], "Age requirement")
+    add(STRUCTURED_DEPENDENCIES["gender"], "Gender requirement")
+    add(STRUCTURED_DEPENDENCIES["histology"], "Histology")
+    add(RULE_SCREEN_DEPENDENCIES, "Provisional rule score")
+    inclusion, exclusion = split_eligibility(trial)
+    for text in inclusion + exclusion:
+        add(criterion_dependencies(text), text)
+        if text in exclusion and _MUTATION_CONTEXT.search(text):
+            add(STRUCTURED_DEPENDENCIES["excluded_mutation"], text)
+    return dependencies
+
+
+class RejectionStats:
+    """
+    Evaluated/rejected counters per criterion type.  Each worker adds its
+    unflushed counts to a SQLite file shared by every worker and reads back
+    the totals.
+    """
+
+    def __init__(self, path: str = REJECTION_STATS_DB_PATH):
+        self.path = path
+        # Totals of every worker at the last flush plus this worker's unflushed counts
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self._deltas: Dict[str, Dict[str, int]] = {}
+        self._recorded: "OrderedDict[tuple, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self.counts = self._totals(conn)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _totals(conn: sqlite3.Connection) -> Dict[str, Dict[str, int]]:
+        rows = conn.execute("SELECT check_type, evaluated, rejected FROM rejection_stats").fetchall()
+        return {row["check_type"]: {"evaluated": row["evaluated"], "rejected": row["rejected"]} for row in rows}
+
+    def rate(self, check_type: str) -> float:
+        counts = self.counts.get(check_type, {})
+        # Laplace smoothing: unseen types start at 0.5
+        return (counts.get("rejected", 0) + 1) / (counts.get("evaluated", 0) + 2)
+
+    def record(self, check_type: str, rejected: bool, key: tuple = None) -> None:
+        """Count one check outcome; with ``key``, only the first outcome recorded under it."""
+        with self._lock:
+            if key is not None:
+                if key in self._recorded:
+                    self._recorded.move_to_end(key)
+                    return
+                self._recorded[key] = None
+                while len(self._recorded) > STATS_RECORDED_SIZE:
+                    self._recorded.popitem(last=False)
+            for table in (self.counts, self._deltas):
+                counts = table.setdefault(check_type, {"evaluated": 0, "rejected": 0})
+                counts["evaluated"] += 1
+                counts["rejected"] += int(rejected)
+            self._pending += 1
+            if self._pending >= STATS_FLUSH_EVERY:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        """Add this worker's unflushed counts to the shared totals and read them back."""
+        try:
+            with self._connect() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.executemany(
+                        "INSERT INTO rejection_stats (check_type, evaluated, rejected) VALUES (?, ?, ?) "
+                        "ON CONFLICT(check_type) DO UPDATE SET evaluated = evaluated + excluded.evaluated, "
+                        "rejected = rejected + excluded.rejected",
+                        [(check_type, c["evaluated"], c["rejected"]) for check_type, c in self._deltas.items()]
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                self.counts = self._totals(conn)
+            self._deltas = {}
+            self._pending = 0
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Could not persist rejection stats: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                check_type: dict(counts, rejection_rate=round(self.rate(check_type), 3))
+                for check_type, counts in self.counts.items()
+            }
+
+
+_rejection_stats: Optional[RejectionStats] = None
+_rejection_stats_lock = threading.Lock()
+
+
+def get_rejection_stats() -> RejectionStats:
+    global _rejection_stats
+    with _rejection_stats_lock:
+        if _rejection_stats is None:
+            _rejection_stats = RejectionStats()
+        return _rejection_stats
+
+
+def excluded_mutation_check(criterion: str) -> Callable[[Dict[str, Any]], Optional[str]]:
+    """
+    Regex check: an exclusion criterion that excludes carriers of a mutation
+    the patient has.  Mutations are compared as canonical biomarker codes:
+    sharing a variant-level code (one without finer variants in the
+    vocabulary, EGFR_EX19DEL or ALK) rejects, while a criterion naming only
+    the gene of the patient's variant ("KRAS G12D" reads as KRAS for a
+    KRAS G12C patient) is left uncertain for the LLM.
+    """
+    vocabulary = get_vocabulary()
+    genes = set(vocabulary.parents.values())
+    clauses = [
+        (clause.strip(), set(vocabulary.normalize(clause, "biomarker")))
+        for clause in re.split(r'[.;]', criterion)
+        if _MUTATION_CONTEXT.search(clause) and not _THERAPY_CONTEXT.search(clause)
+    ]
+
+    def run(features: Dict[str, Any]) -> Optional[str]:
+        mutations = feature_value(features.get("mutations")) or []
+        if isinstance(mutations, str):
+            mutations = [mutations]
+        uncertain = None
+        for mutation in mutations:
+            mutation = str(feature_value(mutation) or "").strip()
+            codes = vocabulary.normalize(mutation, "biomarker") if mutation else []
+            for clause, excluded in clauses:
+                if (excluded & set(codes)) - genes:
+                    return f"Excluded mutation {mutation}: {clause}"
+                if uncertain is None and excluded & set(vocabulary.expand(codes)):
+                    uncertain = Uncertain(f"Gene of {mutation} named by: {clause}")
+        return uncertain
+    return run
+
+
+def build_plan(trial: Dict[str, Any], catalog=None, stats: RejectionStats = None) -> List[Dict[str, Any]]:
+    """Ordered checks for one trial (ordering uses the current rejection stats)."""
+    plan = [
+        {"type": "age", "cost": COST_STRUCTURED, "kind": "inclusion", "criterion": "Age requirement",
+         "run": lambda features: check_age(trial, features)},
+        {"type": "gender", "cost": COST_STRUCTURED, "kind": "inclusion", "criterion": "Gender requirement",
+         "run": lambda features: check_gender(trial, features)},
+        {"type": "histology", "cost": COST_STRUCTURED, "kind": "inclusion", "criterion": "Histology",
+         "run": lambda features: check_histology(trial, features)},
+    ]
+
+    _, exclusion = split_eligibility(trial)
+    for text in exclusion:
+        if _MUTATION_CONTEXT.search(text):
+            plan.append({"type": "excluded_mutation", "cost": COST_REGEX, "kind": "exclusion",
+                         "criterion": text, "run": excluded_mutation_check(text)})
+
+    if catalog is not None:
+        for key, kind in catalog.trial_criteria.get(trial.get("id"), []):
+            text = catalog.criteria[key]
+            plan.append({"type": criterion_type(text), "cost": COST_LLM, "kind": kind,
+                         "criterion": text, "key": key})
+
+    stats = stats or get_rejection_stats()
+    plan.sort(key=lambda check: (check["cost"], -stats.rate(check["type"])))
+    return plan
+
+
+def run_plan(trial: Dict[str, Any], features: Dict[str, Any], plan: List[Dict[str, Any]],
+             evaluator=None, stats: RejectionStats = None) -> Dict[str, Any]:
+    """
+    Execute a plan with early exit on the first hard exclusion.
+    LLM checks run only when an evaluator is given; otherwise the trial gets
+    the rule-based provisional score.
+    """
+    stats = stats or get_rejection_stats()
+    # Finalists re-run the plan and cached verdicts repeat: each check counts once per patient and trial
+    patient_trial = (features_hash(features), trial.get("id"))
+    inclusion, exclusion = [], []
+    checks_run = 0
+
+    for check in plan:
+        if check["cost"] == COST_LLM:
+            if evaluator is None:
+                continue
+            verdict = evaluator.evaluate(check["key"], check["criterion"])
+            met, explanation = verdict["met"], verdict["explanation"]
+            rejected = (met is False) if check["kind"] == "inclusion" else (met is True)
+            reason = f"{check['criterion']}: {explanation}" if rejected else None
+        else:
+            reason = check["run"](features)
+            if isinstance(reason, Uncertain):
+                rejected, met, explanation = False, None, str(reason)
+            else:
+                rejected = reason is not None
+                met = not rejected if check["kind"] == "inclusion" else rejected
+                explanation = reason or f"{check['criterion']} satisfied"
+
+        checks_run += 1
+        stats.record(check["type"], rejected, key=patient_trial + (check["type"], check["criterion"]))
+        if check["kind"] == "inclusion":
+            inclusion.append({"criterion": check["criterion"], "met": met, "explanation": explanation})
+        else:
+            exclusion.append({"criterion": check["criterion"], "violated": met, "explanation": explanation})
+
+        if rejected:
+            logger.info(f"⛔ {trial.get('id')} rejected by {check['type']} check: {reason}")
+            result = summarize_trial(trial, inclusion, exclusion)
+            result.update({
+                "match_score": 0,
+                "recommendation": "NOT_RECOMMENDED",
+                "rejection_reason": reason,
+                "rejection_type": check["type"],
+                "summary": f"Excluded: {reason}"
+            })
+            result["checks_run"] = checks_run
+            result["checks_skipped"] = len(plan) - checks_run
+            return result
+
+    if evaluator is None:
+        result = rule_screen(trial, features)
+    else:
+        result = summarize_trial(trial, inclusion, exclusion)
+    result["checks_run"] = checks_run
+    result["checks_skipped"] = len(plan) - checks_run
+    return result
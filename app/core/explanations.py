@@ -0,0 +1,141 @@
+"""
+On-demand trial explanations.
+
+Matching returns compact scores only.  The detailed per-criterion analysis
+(``TRIAL_MATCHING_PROMPT``) and the patient-friendly summary
+(``TRIAL_SUMMARY_PROMPT``) are generated when the user expands a trial,
+then cached by (patient features hash, trial content hash): the same
+patient and trial version never pay for them twice, and concurrent
+expansions of the same trial share one generation.  The analysis is an
+independent judgement with its own score: when the caller passes the
+result shown on the card, the explanation says whether the two disagree.
+"""
+
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.fingerprint import content_hash, features_hash
+from app.core.json_repair import salvage_json
+from app.core.singleflight import get_single_flight
+from app.core.prompts.trial_matching import TRIAL_SUMMARY_PROMPT
+
+logger = logging.getLogger(__name__)
+
+EXPLANATION_CACHE_SIZE = int(os.getenv("EXPLANATION_CACHE_SIZE", "512"))
+# Score gap (points) beyond which the analysis is flagged as disagreeing with the shown result
+EXPLANATION_SCORE_TOLERANCE = float(os.getenv("EXPLANATION_SCORE_TOLERANCE", "15"))
+
+_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {"requests": 0, "cache_hits": 0, "generated": 0, "failed": 0, "mismatched": 0}
+_stats_lock = threading.Lock()
+
+
+def explanation_key(features: Dict[str, Any], trial: Dict[str, Any]) -> str:
+    return f"explanation:{features_hash(features)}:{content_hash(trial)}"
+
+
+def _patient_summary(analysis: Dict[str, Any], llm) -> Dict[str, Any]:
+    match_analysis = {key: analysis.get(key) for key in (
+        "match_score", "recommendation", "criteria_analysis", "key_factors", "uncertainty_areas", "next_steps")}
+    prompt = TRIAL_SUMMARY_PROMPT.format(match_analysis=json.dumps(match_analysis, ensure_ascii=False))
+    return salvage_json(llm.generate_text(prompt), kind="trial_summary").value or {}
+
+
+def _generate(features: Dict[str, Any], trial: Dict[str, Any], llm) -> Optional[Dict[str, Any]]:
+    from app.core.cascade import analyze_trial_llm
+
+    analysis = analyze_trial_llm(trial, features, llm)
+    if analysis is None:
+        return None
+    summary = _patient_summary(analysis, llm)
+    return {
+        "trial_id": trial.get("id"),
+        "match_score": analysis["match_score"],
+        "recommendation": analysis["recommendation"],
+        "criteria_analysis": analysis["criteria_analysis"],
+        "key_factors": analysis["key_factors"],
+        "uncertainty_areas": analysis["uncertainty_areas"],
+        "next_steps": analysis["next_steps"],
+        "patient_summary": summary.get("summary") or analysis["summary"],
+        "key_points": summary.get("key_points", []),
+        "patient_guidance": summary.get("patient_guidance", ""),
+    }
+
+
+def compare_with_shown(explanation: Dict[str, Any], shown: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ``explanation`` with the score and recommendation shown on the match
+    card, and ``mismatch`` set when the analysis reaches another
+    recommendation or a score more than ``EXPLANATION_SCORE_TOLERANCE`` away.
+    """
+    try:
+        shown_score = float(shown.get("match_score"))
+    except (TypeError, ValueError):
+        shown_score = None
+    shown_recommendation = shown.get("recommendation")
+    mismatch = bool(shown_recommendation) and shown_recommendation != explanation.get("recommendation")
+    if shown_score is not None:
+        mismatch = mismatch or abs(shown_score - (explanation.get("match_score") or 0)) > EXPLANATION_SCORE_TOLERANCE
+    return dict(explanation, shown_score=shown_score, shown_recommendation=shown_recommendation, mismatch=mismatch)
+
+
+def explain_match(features: Dict[str, Any], trial: Dict[str, Any], llm=None,
+                  shown: Dict[str, Any] = None) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Detailed explanation of one patient/trial match, from the cache when
+    available.  Returns ``(explanation, cached)``; the explanation is None if
+    the model output could not be used (not cached, so it can be retried).
+    ``shown`` (the result displayed for the match) is compared with the
+    analysis, see ``compare_with_shown``.
+    """
+    from app.core.llm_processor import get_llm_processor
+
+    key = explanation_key(features, trial)
+    with _stats_lock:
+        _stats["requests"] += 1
+    with _cache_lock:
+        explanation = _cache.get(key)
+        if explanation is not None:
+            _cache.move_to_end(key)
+    if explanation is not None:
+        with _stats_lock:
+            _stats["cache_hits"] += 1
+        return _compared(explanation, shown), True
+
+    llm = llm or get_llm_processor()
+    explanation = get_single_flight().do(key, lambda: _generate(features, trial, llm))
+    with _stats_lock:
+        _stats["generated" if explanation is not None else "failed"] += 1
+    if explanation is None:
+        return None, False
+    with _cache_lock:
+        _cache[key] = explanation
+        while len(_cache) > EXPLANATION_CACHE_SIZE:
+            _cache.popitem(last=False)
+    logger.info(f"💬 Explanation generated for trial {trial.get('id')}")
+    return _compared(explanation, shown), False
+
+
+def _compared(explanation: Dict[str, Any], shown: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not shown:
+        return explanation
+    explanation = compare_with_shown(explanation, shown)
+    if explanation["mismatch"]:
+        logger.info(f"⚖️ Explanation of trial {explanation.get('trial_id')} disagrees with the shown result")
+        with _stats_lock:
+            _stats["mismatched"] += 1
+    return explanation
+
+
+def get_explanation_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["hit_rate"] = round(stats["cache_hits"] / stats["requests"], 3) if stats["requests"] else 0.0
+    with _cache_lock:
+        stats["cached"] = len(_cache)
+    return stats
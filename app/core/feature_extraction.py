@@ -1,14 +1,25 @@
 import os
 import time
-import re
 import json
 import logging
 import pdfplumber
-from typing import Dict, Any, Union, List
+from typing import Dict, Any, Union, List, Callable
 from datetime import datetime, timedelta
 from flask import current_app
 from app.core.llm_processor import get_llm_processor
-from app.core.schema_validation import ClinicalFeatures, ValidationError
+from app.core.scheduler import SchedulerSaturated
+from app.core.singleflight import get_single_flight
+from app.core.fingerprint import content_hash
+from app.core.cancellation import Cancelled, check_cancelled
+from app.core.schema_validation import ClinicalFeatures, ValidationError, FEATURE_FIELDS, validate_features
+from app.core.json_repair import salvage_json, record_followup
+from app.core.prompts.feature_extraction import FEATURE_FOLLOWUP_PROMPT, FEATURE_FIELD_SPECS
+from app.core.embeddings import retrieve_trials, SEMANTIC_TOP_K
+from app.core.cascade import run_cascade
+from app.core.grounding import ground_sources, render_highlights
+from app.core.vocabulary import annotate_features, feature_concepts, trial_concepts, get_vocabulary
+from app.core.match_state import Deadline, MatchState, save_match_state
+from app.core.match_store import MATCH_STORE_ENABLED, get_match_store
 from app.utils import get_all_trials
 import sys
 
@@ -20,6 +31,7 @@ def extract_text_from_pdf(pdf_file: Union[str, bytes]) -> str:
         text = ""
         with pdfplumber.open(pdf_file) as pdf:
             for page in pdf.pages:
+                check_cancelled()
                 text += (page.extract_text() or "")
         return text.strip()
     except Exception as e:
@@ -27,6 +39,14 @@ def extract_text_from_pdf(pdf_file: Union[str, bytes]) -> str:
         raise Exception(f"Unable to extract text from PDF: {str(e)}")
 
 def extract_features_with_llm(text: str) -> Dict[str, Any]:
+    """
+    LLM feature extraction, coalesced by document hash: a duplicate upload
+    of a document that is already being extracted waits for that run.
+    """
+    return get_single_flight().do("document:" + content_hash(text), lambda: _extract_features(text))
+
+
+def _extract_features(text: str) -> Dict[str, Any]:
     from app.core.llm_processor import get_llm_processor
     llm = get_llm_processor()
     # prompt = f"""
@@ -99,20 +119,40 @@ Text:
             logger.warning(f"⚠️ Failed to write raw debug log: {e}")
         
         
-        # Parse the LLM response to get 'llm_text'
+        # Parse the LLM response to get 'llm_text', salvaging chatty or truncated output
         resp_json = json.loads(response)
-        llm_text = json.loads(resp_json['response'])
-
-        if not isinstance(llm_text, dict):
-            logger.error(f"❌ LLM response is not a valid JSON object: {llm_text}")
+        salvaged = salvage_json(resp_json.get('response', ''), kind='features')
+        if salvaged.value is None:
+            logger.error(f"❌ LLM response is not a valid JSON object: {resp_json.get('response', '')[:1000]}")
             return {}
 
+        llm_text = salvaged.value
+        dropped = []
+        if salvaged.salvaged:
+            # Keep only the schema fields that came through complete and valid
+            valid, invalid = validate_features(llm_text)
+            dropped = invalid + salvaged.incomplete
+            if dropped:
+                logger.warning(f"⚠️ Dropped invalid or truncated fields: {dropped}")
+            llm_text = {key: value for key, value in llm_text.items() if key not in FEATURE_FIELDS}
+            llm_text.update((key, value) for key, value in valid.items() if key not in salvaged.incomplete)
+
+        # Only output that lost fields (truncated, or dropped above) is worth a second call;
+        # a complete answer that omits a key has nothing more to give
+        if salvaged.status == 'repaired' or dropped:
+            missing = [field for field in FEATURE_FIELDS if field not in llm_text]
+            if missing:
+                llm_text.update(_request_missing_fields(llm, text, missing))
+
+        annotate_features(llm_text)
         logger.info(f"✅ Extracted Features (llm_text): {json.dumps(llm_text, indent=2)}")
         return llm_text
 
     except json.JSONDecodeError as e:
         logger.error(f"❌ JSON decoding error: {str(e)} - Raw response: {response}")
         return {}
+    except (SchedulerSaturated, Cancelled):
+        raise
     except Exception as e:
         logger.error(f"❌ Unexpected error in feature extraction: {e}")
         return {}
@@ -135,74 +175,107 @@ Text:
     #     print(f"❌ Unexpected error: {e}")
     # return llm_text
 
+def _request_missing_fields(llm, text: str, fields: List[str]) -> Dict[str, Any]:
+    """Targeted follow-up asking only for the fields the first answer lacked."""
+    logger.info(f"🔁 Re-requesting missing fields: {', '.join(fields)}")
+    prompt = FEATURE_FOLLOWUP_PROMPT.format(
+        fields="\n".join(f'  "{field}": {FEATURE_FIELD_SPECS[field]},' for field in fields).rstrip(","),
+        text=text
+    )
+    try:
+        followup = salvage_json(llm.generate_text(prompt), kind='features_followup')
+    except (SchedulerSaturated, Cancelled):
+        raise
+    except Exception as e:
+        logger.warning(f"⚠️ Follow-up extraction failed: {e}")
+        followup = None
+    recovered = {}
+    if followup is not None and followup.value:
+        valid, _ = validate_features(followup.value)
+        recovered = {key: value for key, value in valid.items() if key in fields and key not in followup.incomplete}
+    record_followup('features', len(fields), len(recovered))
+    return recovered
+
+
 def highlight_sources(text: str, features: Dict[str, Any]) -> str:
-    for key, value in features.items():
-        if key.endswith('_source_text') and isinstance(value, str) and value.strip():
-            try:
-                escaped = re.escape(value.strip())
-                text = re.sub(f"({escaped})", r'<mark>\1</mark>', text, flags=re.IGNORECASE)
-            except Exception as e:
-                logger.warning(f"⚠️ Failed to highlight '{value}': {e}")
-    return text
+    """HTML of ``text`` with each feature's source marked, from the grounded spans."""
+    return render_highlights(text, ground_sources(text, features))
 
 
-def match_trials_llm(llm_text: Dict[str, Any]) -> List[Dict[str, Any]]:
+def select_candidate_trials(llm_text: Dict[str, Any], trials: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
-    Perform fast, efficient trial matching using a Hybrid (Rule + LLM) approach.
+    Candidate trials for a patient, ordered by prior likelihood
+    (lexical matches first, then semantic hits by similarity).
     """
-    llm = get_llm_processor()
-    trials = get_all_trials()  # Load all available trials
-
-    if not trials:
-        logger.error("❌ No trials found in database")
-        return []
-
-    matched_trials = []
-
-    logger.info("🔍 Hybrid Matching: Fast Pre-Filter + LLM Matching...")
-    
-    # ✅ Step 1: Fast Rule-Based Pre-Filter (age, diagnosis, etc.)
+    # ✅ Fast Rule-Based Pre-Filter (age, diagnosis, etc.)
+    # Trials whose inclusion criteria target the patient's specific alteration (canonical codes)
+    vocabulary = get_vocabulary()
+    concepts = llm_text.get('concepts') or feature_concepts(llm_text)
+    alterations = {code for code in concepts.get('biomarker', []) if code in vocabulary.parents}
     filtered_trials = []
     for trial in trials:
         if 'conditions' in trial and llm_text.get('diagnosis') and llm_text['diagnosis'].lower() in trial['conditions'].lower():
             filtered_trials.append(trial)
+        elif alterations & set(trial_concepts(trial).get('biomarker', [])):
+            logger.info(f"🧬 Lexical candidate {trial.get('id')} (targets {', '.join(sorted(alterations))})")
+            filtered_trials.append(trial)
+
+    # ✅ Semantic retrieval (synonyms, Italian notes) on top of the lexical filter
+    selected_ids = {trial.get('id') for trial in filtered_trials}
+    for trial, score in retrieve_trials(llm_text, trials, top_k=SEMANTIC_TOP_K):
+        if trial.get('id') not in selected_ids:
+            logger.info(f"🔍 Semantic candidate {trial.get('id')} (score {score:.3f})")
+            filtered_trials.append(trial)
+            selected_ids.add(trial.get('id'))
 
     logger.info(f"✅ {len(filtered_trials)} trials pre-selected for LLM matching.")
+    return filtered_trials
 
-    # ✅ Step 2: LLM Matching Only on Pre-Filtered Trials
-    for trial in filtered_trials:
-        prompt = f"""
-Does the following patient match this trial?
 
-PATIENT:
-{json.dumps(llm_text, indent=2)}
+def match_trials_llm(llm_text: Dict[str, Any], deadline: Deadline = None, state: MatchState = None,
+                     on_result: Callable[[Dict[str, Any]], None] = None) -> List[Dict[str, Any]]:
+    """
+    Perform fast, efficient trial matching using a Hybrid (Rule + LLM) approach.
 
-TRIAL:
-{json.dumps(trial, indent=2)}
+    With a ``deadline`` the completed evaluations are returned when it expires
+    and the remaining trials are flagged ``not_evaluated``; passing the same
+    ``state`` again finishes them without redoing completed work.
+    ``on_result`` receives each trial result as soon as it is evaluated.
+    Raises ``Cancelled`` between trials once the caller's token is cancelled.
+    """
+    llm = get_llm_processor()
+    trials = get_all_trials()  # Load all available trials
 
-Return a JSON with:
-{{
-  "match_score": integer (0 to 100),
-  "overall_recommendation": string,
-  "criteria_analysis": dict,
-  "summary": string
-}}
-"""
-        response = llm.generate_response(prompt)
-        try:
-            match_result = json.loads(response)
-            matched_trials.append({
-                "trial_id": trial.get("id"),
-                "title": trial.get("title", "Unknown Trial"),
-                "description": trial.get("description", "No description provided."),
-                "match_score": match_result.get("match_score", 0),
-                "recommendation": match_result.get("overall_recommendation", "UNKNOWN"),
-                "criteria_analysis": match_result.get("criteria_analysis", {}),
-                "summary": match_result.get("summary", "No summary available.")
-            })
-        except json.JSONDecodeError:
-            logger.error(f"❌ LLM response could not be parsed for trial matching: {response}")
-            continue
+    if not trials:
+        logger.error("❌ No trials found in database")
+        return []
+
+    logger.info("🔍 Hybrid Matching: Fast Pre-Filter + LLM Matching...")
+
+    # ✅ Step 1: Candidate selection (reused when resuming a previous match)
+    state = state or MatchState(llm_text)
+    candidates = state.candidates if state.candidates is not None else select_candidate_trials(llm_text, trials)
+    check_cancelled()
+
+    def checkpoint(result: Dict[str, Any]) -> None:
+        # Shared states are saved as results arrive, so other workers see the progress
+        save_match_state(state, throttle=True)
+        if on_result:
+            on_result(result)
+
+    # ✅ Step 2: Cascade - cheap screening of all candidates, large model only for finalists
+    matched_trials, _ = run_cascade(llm_text, candidates, trials, llm, deadline=deadline, state=state,
+                                    on_result=checkpoint)
+    save_match_state(state)
+    # Opt-in: persisted so a catalog update re-scores this patient against changed trials only
+    if MATCH_STORE_ENABLED and state.patient_ref:
+        if state.degraded:
+            logger.info("ℹ️ Degraded extraction: match results not persisted")
+        else:
+            try:
+                get_match_store().save(state.patient_ref, llm_text, trials, matched_trials)
+            except Exception as e:
+                logger.warning(f"⚠️ Match results not persisted: {e}")
 
     # ✅ Step 3: Sort by Match Score (High to Low)
     matched_trials.sort(key=lambda x: x['match_score'], reverse=True)
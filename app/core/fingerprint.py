@@ -0,0 +1,32 @@
+import json
+import hashlib
+from typing import Any, Dict, List
+
+
+def content_hash(obj: Any) -> str:
+    """
+    Stable SHA-256 of any JSON-serialisable object (key order does not matter).
+    """
+    payload = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def features_hash(features: Dict[str, Any]) -> str:
+    """
+    Hash of the clinically relevant part of a feature dict.
+    Source snippets and the original text are ignored so that two extractions
+    with the same values share the same key.
+    """
+    relevant = {
+        key: value for key, value in (features or {}).items()
+        if not key.endswith("_source_text") and key != "original_text"
+    }
+    return content_hash(relevant)
+
+
+def catalog_hash(trials: List[Dict[str, Any]]) -> str:
+    """
+    Hash of a whole trial catalog; changes whenever any trial is added,
+    removed or amended.
+    """
+    return content_hash([[trial.get("id"), content_hash(trial)] for trial in trials])
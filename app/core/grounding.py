@@ -0,0 +1,175 @@
+"""
+Source grounding of extracted features.
+
+Every feature is located in the note as a character span: the LLM's
+``<field>_source_text`` snippets when present, the feature values
+otherwise.  All snippets are searched together in one multi-pattern pass
+(``TermMatcher``); snippets the LLM paraphrased or re-spaced fall back to
+a token match anchored on their rarest word, scored by token overlap.
+The document is scanned and tokenized once, so the cost stays linear in
+its length whatever the number of features.  Highlights are rendered from
+the spans, without rewriting the text once per feature.
+"""
+
+import os
+import re
+import html
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.text_patterns import TermMatcher, at_word_boundary
+
+logger = logging.getLogger(__name__)
+
+GROUNDING_FUZZY_THRESHOLD = float(os.getenv("GROUNDING_FUZZY_THRESHOLD", "0.75"))
+# Occurrences of the anchor word examined per paraphrased snippet
+MAX_ANCHORS = 50
+# Extra tokens allowed around a fuzzy window (inserted or dropped words)
+WINDOW_SLACK = 2
+
+_TOKEN = re.compile(r"\w+")
+_EMPTY_VALUES = {"", "not mentioned", "none", "null", "unknown", "other"}
+
+_stats = {"documents": 0, "snippets": 0, "exact": 0, "normalized": 0, "fuzzy": 0, "missed": 0}
+_stats_lock = threading.Lock()
+
+
+def _strings(value: Any) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [item for item in value if isinstance(item, str)]
+    if isinstance(value, dict):
+        return [item for item in value.values() if isinstance(item, str)]
+    return []
+
+
+def source_snippets(features: Dict[str, Any]) -> List[Tuple[str, str, bool]]:
+    """
+    ``(field, snippet, is_value)`` to ground.  Feature values stand in for
+    missing ``_source_text`` snippets; they must match whole words, and
+    short or numeric values are skipped as too ambiguous.
+    """
+    snippets = []
+    for key, value in (features or {}).items():
+        if key in ("original_text", "concepts"):
+            continue
+        if key.endswith("_source_text"):
+            field, is_value = key[:-len("_source_text")], False
+        elif key + "_source_text" in features:
+            continue
+        else:
+            field, is_value = key, True
+        for snippet in _strings(value):
+            snippet = snippet.strip()
+            if is_value and (len(snippet) < 2 or snippet.lower() in _EMPTY_VALUES or snippet.isdigit()):
+                continue
+            if snippet:
+                snippets.append((field, snippet, is_value))
+    return snippets
+
+
+class _Tokens:
+    """Lower-cased word tokens of the document with their offsets and an inverted index."""
+
+    def __init__(self, text: str):
+        self.words: List[str] = []
+        self.spans: List[Tuple[int, int]] = []
+        self.index: Dict[str, List[int]] = {}
+        for match in _TOKEN.finditer(text):
+            word = match.group(0).lower()
+            self.index.setdefault(word, []).append(len(self.words))
+            self.words.append(word)
+            self.spans.append(match.span())
+
+    def locate(self, snippet: str) -> Optional[Tuple[int, int, float]]:
+        """Best ``(start, end, score)`` for a snippet by token overlap, if above the threshold."""
+        wanted = [word.lower() for word in _TOKEN.findall(snippet)]
+        present = [word for word in wanted if word in self.index]
+        if not present:
+            return None
+        anchor = min(present, key=lambda word: len(self.index[word]))
+        offset = wanted.index(anchor)
+        needed = Counter(wanted)
+        best = None
+        for position in self.index[anchor][:MAX_ANCHORS]:
+            low = max(0, position - offset - WINDOW_SLACK)
+            high = min(len(self.words), position - offset + len(wanted) + WINDOW_SLACK)
+            window = self.words[low:high]
+            score = sum((Counter(window) & needed).values()) / len(wanted)
+            if best is None or score > best[2]:
+                # Trim the window to the first and last snippet words it contains
+                inside = [low + i for i, word in enumerate(window) if word in needed]
+                best = (self.spans[inside[0]][0], self.spans[inside[-1]][1], score)
+        if best is None or best[2] < GROUNDING_FUZZY_THRESHOLD:
+            return None
+        return best
+
+
+def ground_sources(text: str, features: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Character spans of the features' sources in ``text``, sorted by offset:
+    ``{"field", "snippet", "start", "end", "match", "score"}`` with ``match``
+    one of ``exact``, ``normalized`` (same words, different spacing or
+    punctuation) or ``fuzzy`` (paraphrase).  Ungrounded snippets are left out.
+    """
+    snippets = source_snippets(features)
+    if not text or not snippets:
+        return []
+
+    hits = TermMatcher([snippet for _, snippet, _ in snippets]).find_all(text)
+    tokens: Optional[_Tokens] = None
+    spans, counts = [], Counter()
+    for field, snippet, is_value in snippets:
+        start = next((p for p in hits[snippet] if not is_value or (
+            at_word_boundary(text, p) and at_word_boundary(text, p + len(snippet)))), None)
+        if start is not None:
+            spans.append({"field": field, "snippet": snippet, "start": start, "end": start + len(snippet),
+                          "match": "exact", "score": 1.0})
+            counts["exact"] += 1
+            continue
+        if tokens is None:
+            tokens = _Tokens(text)
+        located = tokens.locate(snippet)
+        if located is None:
+            counts["missed"] += 1
+            continue
+        start, end, score = located
+        kind = "normalized" if score == 1.0 else "fuzzy"
+        spans.append({"field": field, "snippet": snippet, "start": start, "end": end,
+                      "match": kind, "score": round(score, 3)})
+        counts[kind] += 1
+
+    with _stats_lock:
+        _stats["documents"] += 1
+        _stats["snippets"] += len(snippets)
+        for kind, count in counts.items():
+            _stats[kind] += count
+    spans.sort(key=lambda span: (span["start"], -span["end"]))
+    return spans
+
+
+def render_highlights(text: str, spans: List[Dict[str, Any]]) -> str:
+    """HTML-escaped ``text`` with a ``<mark>`` per span; overlapping spans are clipped."""
+    parts, cursor = [], 0
+    for span in spans:
+        start, end = max(span["start"], cursor), span["end"]
+        if start >= end:
+            continue
+        parts.append(html.escape(text[cursor:start]))
+        field = html.escape(span["field"], quote=True)
+        parts.append(f'<mark data-field="{field}" title="{field}">{html.escape(text[start:end])}</mark>')
+        cursor = end
+    parts.append(html.escape(text[cursor:]))
+    return "".join(parts)
+
+
+def get_grounding_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    snippets = stats["snippets"] or 1
+    stats["grounded_rate"] = round((snippets - stats["missed"]) / snippets, 3) if stats["snippets"] else 0.0
+    stats["fuzzy_threshold"] = GROUNDING_FUZZY_THRESHOLD
+    return stats
@@ -0,0 +1,232 @@
+"""
+Hedged feature extraction.
+
+The regex extractor (``basic_feature_extraction``) runs next to the LLM
+extraction.  Its provisional features start candidate retrieval right away
+(embedding index load, query embedding, pre-filter), so the candidate set
+is usually ready by the time the LLM features arrive.  The LLM features
+are then reconciled with a delta re-filter: the provisional candidates are
+kept when the retrieval inputs are unchanged and re-selected otherwise.
+If the LLM fails or exceeds ``LLM_EXTRACTION_SLO_SECONDS`` the pipeline
+continues on the regex features, flagged ``degraded``.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Dict, List, Optional
+
+from app.core.scheduler import SchedulerSaturated
+from app.core.embeddings import features_text
+from app.core.vocabulary import annotate_features, get_vocabulary
+from app.core.cancellation import (
+    Cancelled, CancellationToken, CANCEL_POLL_SECONDS, cancellation_scope, current_token
+)
+
+logger = logging.getLogger(__name__)
+
+HEDGED_EXTRACTION = os.getenv("HEDGED_EXTRACTION", "1").lower() in ("1", "true", "yes")
+LLM_EXTRACTION_SLO_SECONDS = float(os.getenv("LLM_EXTRACTION_SLO_SECONDS", "120"))
+
+_stats = {"runs": 0, "llm_used": 0, "degraded": {}, "candidates_reused": 0, "refiltered": 0,
+          "trials_added": 0, "trials_removed": 0, "provisional_seconds": 0.0, "llm_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+
+class HedgedExtraction:
+    """Features to match on, their candidate trials and whether they came from the fallback."""
+
+    def __init__(self, features: Dict[str, Any], candidates: Optional[List[Dict[str, Any]]] = None,
+                 degraded: bool = False, reason: Optional[str] = None, timings: Dict[str, float] = None):
+        self.features = features
+        self.candidates = candidates
+        self.degraded = degraded
+        self.reason = reason
+        self.timings = timings or {}
+
+
+# Histologies that make a lung primary a non-small cell cancer
+_NSCLC_HISTOLOGY = re.compile(r"adenocarcinom|squam|large[\s-]*cell|grandi cellule", re.IGNORECASE)
+
+
+def _diagnosis(value: Optional[str], source: str, text: str = "") -> str:
+    """
+    Map the regex diagnosis onto the LLM prompt's NSCLC / SCLC / other
+    vocabulary.  Histology codes of the vocabulary (LUAD, LUSC, ... roll up
+    to NSCLC) are looked up in the matched sentence, then in the whole note,
+    which also covers diagnoses the regex list misses ("lung adenocarcinoma");
+    a lung cancer of unstated type is "not mentioned" rather than "other".
+    """
+    vocabulary = get_vocabulary()
+    for scope in (f"{value or ''} {source}", text):
+        for code in vocabulary.normalize(scope, "histology"):
+            expanded = vocabulary.expand([code])
+            if "NSCLC" in expanded:
+                return "NSCLC"
+            if "SCLC" in expanded:
+                return "SCLC"
+    if not value:
+        return "not mentioned"
+    if "lung" in value.lower():
+        return "NSCLC" if _NSCLC_HISTOLOGY.search(text or source) else "not mentioned"
+    return "other"
+
+
+def regex_features(text: str) -> Dict[str, Any]:
+    """``basic_feature_extraction`` output reshaped to the flat schema of the LLM extraction."""
+    from app.utils import basic_feature_extraction
+
+    basic = basic_feature_extraction(text)
+    stage = basic["stage"]["value"]
+    ecog = basic["ecog"]["value"]
+    return annotate_features({
+        "age": basic["age"]["value"],
+        "gender": basic["gender"]["value"] or "not mentioned",
+        "diagnosis": _diagnosis(basic["diagnosis"]["value"], basic["diagnosis"]["source"], text),
+        "stage": stage.upper().rstrip("ABC") if stage else "not mentioned",
+        "ecog": str(ecog) if ecog is not None else "not mentioned",
+        "mutations": [item["value"] for item in basic["mutations"]],
+        "metastases": [item["value"] for item in basic["metastases"]],
+        "previous_treatments": [item["value"] for item in basic["previous_treatments"]],
+        "lab_values": {name: item["value"] for name, item in basic["lab_values"].items()},
+    })
+
+
+def _informative(features: Dict[str, Any]) -> bool:
+    return features.get("age") is not None or bool(features_text(features))
+
+
+def _same_retrieval_inputs(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """Candidate selection reads only the diagnosis and the semantic query text."""
+    return a.get("diagnosis") == b.get("diagnosis") and features_text(a) == features_text(b)
+
+
+def _run_llm(text: str, token: CancellationToken) -> Future:
+    from app.core.feature_extraction import extract_features_with_llm
+
+    future: Future = Future()
+
+    def run():
+        with cancellation_scope(token):
+            try:
+                future.set_result(extract_features_with_llm(text))
+            except BaseException as e:
+                future.set_exception(e)
+
+    # The LLM thread keeps the caller's priority class and user
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name="llm-extraction", daemon=True).start()
+    return future
+
+
+def _wait_llm(future: Future, parent: Optional[CancellationToken], slo_at: float):
+    """LLM features, or None once the SLO is exceeded."""
+    while True:
+        remaining = slo_at - time.perf_counter()
+        if remaining <= 0:
+            return None
+        try:
+            return future.result(timeout=min(remaining, CANCEL_POLL_SECONDS))
+        except FutureTimeout:
+            if parent is not None:
+                parent.raise_if_cancelled()
+
+
+def extract_features_hedged(text: str, slo_seconds: float = None) -> HedgedExtraction:
+    """
+    LLM features with candidates pre-selected from the regex features
+    meanwhile.  ``candidates`` is None when hedging is disabled.
+    """
+    from app.core.feature_extraction import extract_features_with_llm, select_candidate_trials, get_all_trials
+
+    if not HEDGED_EXTRACTION:
+        return HedgedExtraction(extract_features_with_llm(text))
+
+    slo_seconds = slo_seconds if slo_seconds is not None else LLM_EXTRACTION_SLO_SECONDS
+    started = time.perf_counter()
+    parent = current_token()
+    # Own token, so that missing the SLO cancels only the LLM call
+    token = CancellationToken()
+    unlink = parent.on_cancel(lambda: token.cancel(parent.reason)) if parent is not None else (lambda: None)
+    future = _run_llm(text, token)
+    try:
+        provisional = regex_features(text)
+        trials = get_all_trials()
+        provisional_candidates = select_candidate_trials(provisional, trials) if _informative(provisional) else None
+        timings = {"provisional": round(time.perf_counter() - started, 3)}
+
+        reason = None
+        try:
+            features = _wait_llm(future, parent, started + slo_seconds)
+            if features is None:
+                reason = "llm_slo_exceeded"
+                token.cancel(reason)
+            elif not isinstance(features, dict) or not features:
+                reason = "llm_failed"
+        except Cancelled:
+            if parent is not None and parent.cancelled:
+                raise
+            reason = "llm_failed"
+        except SchedulerSaturated:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ LLM extraction failed: {e}")
+            reason = "llm_failed"
+        timings["llm"] = round(time.perf_counter() - started, 3)
+    except BaseException:
+        token.cancel("abandoned")
+        raise
+    finally:
+        unlink()
+
+    if reason is not None:
+        logger.warning(f"⚠️ Degraded mode ({reason}): matching on regex features")
+        _record(timings, reason=reason)
+        if not _informative(provisional):
+            return HedgedExtraction({}, degraded=True, reason=reason, timings=timings)
+        return HedgedExtraction(provisional, provisional_candidates, degraded=True, reason=reason, timings=timings)
+
+    # Delta re-filter: keep the provisional candidates unless retrieval inputs changed
+    if provisional_candidates is not None and _same_retrieval_inputs(provisional, features):
+        candidates, added, removed = provisional_candidates, 0, 0
+    else:
+        candidates = select_candidate_trials(features, trials)
+        before = {trial.get("id") for trial in provisional_candidates or []}
+        after = {trial.get("id") for trial in candidates}
+        added, removed = len(after - before), len(before - after)
+        logger.info(f"🔁 Re-filtered candidates on LLM features: +{added} -{removed}")
+    timings["reconciled"] = round(time.perf_counter() - started, 3)
+    _record(timings, reused=provisional_candidates is candidates, added=added, removed=removed)
+    return HedgedExtraction(features, candidates, timings=timings)
+
+
+def _record(timings: Dict[str, float], reason: str = None, reused: bool = False,
+            added: int = 0, removed: int = 0) -> None:
+    with _stats_lock:
+        _stats["runs"] += 1
+        _stats["provisional_seconds"] += timings.get("provisional", 0.0)
+        _stats["llm_seconds"] += timings.get("llm", 0.0)
+        if reason:
+            _stats["degraded"][reason] = _stats["degraded"].get(reason, 0) + 1
+            return
+        _stats["llm_used"] += 1
+        _stats["candidates_reused" if reused else "refiltered"] += 1
+        _stats["trials_added"] += added
+        _stats["trials_removed"] += removed
+
+
+def get_hedging_stats() -> Dict[str, Any]:
+    """Degraded-mode rate, candidate reuse and how far ahead the provisional path runs."""
+    with _stats_lock:
+        stats = dict(_stats, degraded=dict(_stats["degraded"]))
+    runs = stats["runs"] or 1
+    stats["enabled"] = HEDGED_EXTRACTION
+    stats["slo_seconds"] = LLM_EXTRACTION_SLO_SECONDS
+    stats["degraded_rate"] = round(sum(stats["degraded"].values()) / runs, 3)
+    stats["avg_provisional_seconds"] = round(stats["provisional_seconds"] / runs, 3)
+    stats["avg_llm_seconds"] = round(stats["llm_seconds"] / runs, 3)
+    return stats
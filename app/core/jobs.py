@@ -0,0 +1,390 @@
+"""
+Asynchronous processing jobs backed by SQLite.
+
+``POST /jobs`` stores a job and returns immediately; a bounded pool of
+worker threads claims queued jobs and runs the /process pipeline (PDF
+extraction, LLM feature extraction, trial matching), saving partial
+results and stage timings after every step.  Running jobs send heartbeats;
+a job whose heartbeat stops (worker killed or restarted) is put back in the
+queue and resumed from its last completed stage.  An uploaded PDF is
+deleted as soon as its text is stored, or when the job ends without
+reaching that point.  ``cancel`` marks a job
+cancelled in the store; the worker running it, in whichever process,
+notices within ``JOB_POLL_SECONDS`` and cancels its LLM calls.
+
+The clinical note is cleared from the row once the job ends, and finished
+jobs (with their extracted features) are deleted after
+``JOB_RETENTION_SECONDS``.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.scheduler import SchedulerSaturated, set_llm_context
+from app.core.cancellation import (
+    Cancelled, CancellationToken, cancellation_scope, check_cancelled, record_cancelled
+)
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join("data", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "300"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+JOB_POLL_SECONDS = 1.0
+JOB_HEARTBEAT_SECONDS = 30.0
+
+_JSON_FIELDS = ("features", "matched_trials", "timings")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stage TEXT,
+    text TEXT,
+    pdf_path TEXT,
+    pdf_filename TEXT,
+    time_budget REAL,
+    features TEXT,
+    matched_trials TEXT,
+    timings TEXT,
+    error TEXT,
+    worker TEXT,
+    user TEXT,
+    degraded INTEGER NOT NULL DEFAULT 0,
+    patient_ref TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class JobStore:
+    """Job rows in a SQLite file shared by every worker process."""
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "user" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN user TEXT")
+            if "degraded" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN degraded INTEGER NOT NULL DEFAULT 0")
+            if "patient_ref" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN patient_ref TEXT")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _row_to_job(self, row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for field in _JSON_FIELDS:
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def create(self, text: str = None, pdf_path: str = None, pdf_filename: str = None,
+               time_budget: float = None, user: str = None, patient_ref: str = None) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, stage, text, pdf_path, pdf_filename, time_budget, timings, "
+                "user, patient_ref, created_at, updated_at) VALUES (?, 'queued', 'queued', ?, ?, ?, ?, '{}', ?, ?, ?, ?)",
+                (job_id, text, pdf_path, pdf_filename, time_budget, user, patient_ref, now, now)
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = fields["heartbeat"] = time.time()
+        for field in _JSON_FIELDS:
+            if field in fields:
+                fields[field] = json.dumps(fields[field], ensure_ascii=False)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def cancel(self, job_id: str) -> bool:
+        """Mark a queued or running job cancelled; False if it already finished."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ?, "
+                "stage = CASE WHEN status = 'queued' THEN 'cancelled' ELSE stage END, "
+                "text = CASE WHEN status = 'queued' THEN NULL ELSE text END "
+                "WHERE id = ? AND status IN ('queued', 'running')",
+                (now, job_id)
+            )
+        return cursor.rowcount > 0
+
+    def status(self, job_id: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row["status"] if row else None
+
+    def touch(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    def claim_next(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Atomically move the oldest queued job to running and return it."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, updated_at = ? WHERE id = ?",
+                    (worker, now, now, row["id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def requeue_stale(self, stale_seconds: float = JOB_STALE_SECONDS) -> int:
+        """Put back in the queue running jobs whose worker stopped sending heartbeats."""
+        cutoff = time.time() - stale_seconds
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat < ?",
+                (cutoff,)
+            )
+        if cursor.rowcount:
+            logger.warning(f"♻️ Re-queued {cursor.rowcount} stale job(s)")
+        return cursor.rowcount
+
+    def purge_expired(self, retention_seconds: float = JOB_RETENTION_SECONDS) -> int:
+        """Delete finished jobs older than the retention period."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND updated_at < ?",
+                (time.time() - retention_seconds,)
+            )
+        if cursor.rowcount:
+            logger.info(f"🧹 Purged {cursor.rowcount} finished job(s)")
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+def remove_upload(job: Dict[str, Any]) -> None:
+    """Delete the uploaded PDF of a job (its text is kept in the job row)."""
+    path = job.get("pdf_path")
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"⚠️ Could not remove upload of job {job['id']}: {e}")
+
+
+def run_job(store: JobStore, job: Dict[str, Any]) -> None:
+    """Run the /process pipeline for one job, skipping stages already completed."""
+    from app.utils import extract_text_from_pdf
+    from app.core.feature_extraction import match_trials_llm
+    from app.core.hedging import extract_features_hedged
+    from app.core.match_state import Deadline, MATCH_TIME_BUDGET, create_match_state
+
+    job_id = job["id"]
+    timings = job.get("timings") or {}
+    text = job.get("text")
+
+    if not text and job.get("pdf_path"):
+        store.update(job_id, stage="pdf_extraction")
+        started = time.perf_counter()
+        with open(job["pdf_path"], "rb") as f:
+            text = extract_text_from_pdf(f)
+        timings["pdf_extraction"] = round(time.perf_counter() - started, 3)
+        store.update(job_id, text=text, timings=timings)
+        remove_upload(job)
+
+    if not text:
+        raise ValueError("Extracted text is empty.")
+
+    features = job.get("features")
+    candidates = None
+    degraded = bool(job.get("degraded"))
+    if not features:
+        store.update(job_id, stage="feature_extraction")
+        started = time.perf_counter()
+        extraction = extract_features_hedged(text)
+        features, candidates, degraded = extraction.features, extraction.candidates, extraction.degraded
+        timings["feature_extraction"] = round(time.perf_counter() - started, 3)
+        if not isinstance(features, dict) or not features:
+            raise ValueError("LLM returned an invalid or empty response.")
+        store.update(job_id, features=features, timings=timings, degraded=int(degraded))
+
+    store.update(job_id, stage="matching")
+    started = time.perf_counter()
+    state = create_match_state(features)
+    state.candidates = candidates
+    state.degraded = degraded
+    state.patient_ref = job.get("patient_ref")
+    budget = job.get("time_budget")
+    deadline = Deadline(budget if budget is not None else MATCH_TIME_BUDGET)
+
+    def on_result(_result: Dict[str, Any]) -> None:
+        # Partial ranking after every evaluated trial (also serves as heartbeat)
+        partial = sorted(state.results(), key=lambda x: x["match_score"], reverse=True)
+        store.update(job_id, matched_trials=partial)
+
+    matched_trials = match_trials_llm(features, deadline=deadline, state=state, on_result=on_result)
+    timings["matching"] = round(time.perf_counter() - started, 3)
+    check_cancelled()
+    # The note is not needed once matching is done: only features and results are kept
+    store.update(job_id, status="done", stage="done", matched_trials=matched_trials, timings=timings, text=None)
+
+
+class JobRunner:
+    """Bounded pool of worker threads polling the job store."""
+
+    def __init__(self, store: JobStore, workers: int = JOB_WORKERS, app=None):
+        self.store = store
+        self.workers = workers
+        self.app = app
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._tokens_lock = threading.Lock()
+
+    def start(self) -> None:
+        self.store.requeue_stale()
+        self.store.purge_expired()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"✅ Job runner started with {self.workers} worker(s) on {self.store.path}")
+
+    def notify(self) -> None:
+        self._wakeup.set()
+
+    def cancel(self, job_id: str) -> None:
+        """Cancel a job running in this process right away (others see the store)."""
+        with self._tokens_lock:
+            token = self._tokens.get(job_id)
+        if token is not None:
+            token.cancel("job_cancelled")
+
+    def _loop(self) -> None:
+        worker = f"{self.name}:{threading.current_thread().name}"
+        while True:
+            try:
+                job = self.store.claim_next(worker)
+                if job is None:
+                    self.store.requeue_stale()
+                    self.store.purge_expired()
+                    self._wakeup.wait(JOB_POLL_SECONDS)
+                    self._wakeup.clear()
+                    continue
+                self._execute(job)
+            except Exception as e:
+                logger.exception(f"❌ Job worker error: {e}")
+                time.sleep(JOB_POLL_SECONDS)
+
+    def _heartbeat(self, job_id: str, token: CancellationToken, done: threading.Event) -> None:
+        # Keeps long LLM calls from looking like a dead worker, and picks up
+        # cancellations made through any process
+        last_touch = time.monotonic()
+        while not done.wait(JOB_POLL_SECONDS):
+            try:
+                if self.store.status(job_id) == "cancelled":
+                    token.cancel("job_cancelled")
+                    return
+                if time.monotonic() - last_touch >= JOB_HEARTBEAT_SECONDS:
+                    self.store.touch(job_id)
+                    last_touch = time.monotonic()
+            except Exception as e:
+                logger.warning(f"⚠️ Heartbeat failed for job {job_id}: {e}")
+
+    def _execute(self, job: Dict[str, Any]) -> None:
+        logger.info(f"🚀 Running job {job['id']}")
+        done = threading.Event()
+        token = CancellationToken()
+        with self._tokens_lock:
+            self._tokens[job["id"]] = token
+        threading.Thread(target=self._heartbeat, args=(job["id"], token, done), daemon=True).start()
+        # A job is a clinician's /process run without the open connection: same class, fair-shared per user
+        set_llm_context("interactive", job.get("user"))
+        finished = True
+        try:
+            with cancellation_scope(token):
+                if self.app is not None:
+                    with self.app.app_context():
+                        run_job(self.store, job)
+                else:
+                    run_job(self.store, job)
+            logger.info(f"✅ Job {job['id']} done")
+        except Cancelled as e:
+            stage = (self.store.get(job["id"]) or {}).get("stage") or "queued"
+            record_cancelled(stage, e.reason)
+            logger.info(f"🛑 Job {job['id']} cancelled during {stage}")
+            self.store.update(job["id"], status="cancelled", text=None)
+        except SchedulerSaturated as e:
+            # Completed stages are kept; the job resumes once the queue drains
+            logger.warning(f"⏳ Job {job['id']} re-queued: {e}")
+            if not token.cancelled:
+                finished = False
+                self.store.update(job["id"], status="queued", worker=None)
+                time.sleep(e.retry_after)
+        except Exception as e:
+            logger.exception(f"❌ Job {job['id']} failed: {e}")
+            self.store.update(job["id"], status="failed", stage="failed", error=str(e), text=None)
+        finally:
+            done.set()
+            with self._tokens_lock:
+                self._tokens.pop(job["id"], None)
+            if finished:
+                remove_upload(job)
+
+
+_runner: Optional[JobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner(app=None) -> JobRunner:
+    """Process-wide runner, started on first use."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner(JobStore(), app=app)
+            _runner.start()
+        return _runner
+
+
+def running_job_runner() -> Optional[JobRunner]:
+    """The runner of this process if it was already started, without starting it."""
+    return _runner
@@ -0,0 +1,162 @@
+"""
+Tolerant parsing of JSON generated by the LLM.
+
+Models add a preamble ("Here is the JSON:"), wrap the object in a markdown
+fence, append comments after it, or stop mid-object when they hit the
+token limit.  ``salvage_json`` scans the text once, tracking string and
+nesting state like a streaming parser: the first balanced object is taken
+as is, and a truncated one is closed at the last point where every value
+was complete, so partially generated values (``"diagnosis": "NSC``) are
+dropped rather than kept.  Outcomes are counted per caller for
+``/api/metrics``.
+"""
+
+import re
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Truncation points tried, from the latest backwards
+MAX_REPAIR_ATTEMPTS = 20
+# Opening braces tried (braces in a preamble come before the object)
+MAX_OBJECT_STARTS = 5
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_CLOSERS = {"{": "}", "[": "]"}
+
+_stats: Dict[str, Dict[str, int]] = {}
+_stats_lock = threading.Lock()
+
+
+class SalvagedJSON:
+    """
+    A parsed object and how it was obtained: ``clean`` (valid JSON),
+    ``extracted`` (balanced object inside other text), ``repaired``
+    (truncated object closed) or ``failed`` (``value`` is None).
+    ``incomplete`` names the top-level field whose list or object was cut
+    short by the truncation, if any.
+    """
+
+    def __init__(self, value: Optional[Dict[str, Any]], status: str, incomplete: List[str] = None):
+        self.value = value
+        self.status = status
+        self.incomplete = incomplete or []
+
+    @property
+    def salvaged(self) -> bool:
+        return self.status in ("extracted", "repaired")
+
+
+def _loads_object(candidate: str) -> Optional[Dict[str, Any]]:
+    for attempt in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+        try:
+            value = json.loads(attempt)
+        except (json.JSONDecodeError, TypeError):
+            continue
+        return value if isinstance(value, dict) else None
+    return None
+
+
+def _scan(text: str, start: int) -> Tuple[Optional[int], List[Tuple[int, str]]]:
+    """
+    Walk the object opening at ``start``.  Returns the end offset of the
+    balanced object (None if the text ends first) and the truncation
+    checkpoints: ``(cut offset, closers needed)`` after every complete
+    string or container and before every comma.
+    """
+    stack: List[str] = []
+    checkpoints: List[Tuple[int, str]] = []
+    in_string = escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                checkpoints.append((i + 1, "".join(reversed(stack))))
+            continue
+        if char == '"':
+            in_string = True
+        elif char in _CLOSERS:
+            stack.append(_CLOSERS[char])
+            checkpoints.append((i + 1, "".join(reversed(stack))))
+        elif char in "}]":
+            if not stack or stack[-1] != char:
+                return None, checkpoints
+            stack.pop()
+            if not stack:
+                return i + 1, checkpoints
+            checkpoints.append((i + 1, "".join(reversed(stack))))
+        elif char == ",":
+            checkpoints.append((i, "".join(reversed(stack))))
+    return None, checkpoints
+
+
+def salvage_json(text: str, kind: str = "generic") -> SalvagedJSON:
+    """First JSON object found in ``text``, repaired if truncated."""
+    result = _salvage(text or "")
+    _record(kind, result.status)
+    if result.salvaged:
+        logger.info(f"🩹 Salvaged {kind} JSON ({result.status}, {len(result.value)} fields)")
+    elif result.value is None:
+        logger.warning(f"⚠️ No JSON object could be salvaged from {kind} output: {text[:200]!r}")
+    return result
+
+
+def _salvage(text: str) -> SalvagedJSON:
+    value = _loads_object(text.strip())
+    if value is not None:
+        return SalvagedJSON(value, "clean")
+
+    start = text.find("{")
+    for _ in range(MAX_OBJECT_STARTS):
+        if start == -1:
+            break
+        end, checkpoints = _scan(text, start)
+        if end is not None:
+            value = _loads_object(text[start:end])
+            if value is not None:
+                return SalvagedJSON(value, "extracted")
+        else:
+            # Truncated: close the object at the latest point that parses
+            for cut, closers in reversed(checkpoints[-MAX_REPAIR_ATTEMPTS:]):
+                value = _loads_object(text[start:cut] + closers)
+                if value:
+                    # Closing more than the object itself means its last field was cut
+                    incomplete = [list(value)[-1]] if len(closers) > 1 else []
+                    return SalvagedJSON(value, "repaired", incomplete)
+        # A brace in the preamble: try the next one
+        start = text.find("{", start + 1)
+    return SalvagedJSON(None, "failed")
+
+
+def _record(kind: str, status: str) -> None:
+    with _stats_lock:
+        counters = _stats.setdefault(kind, {})
+        counters[status] = counters.get(status, 0) + 1
+
+
+def record_followup(kind: str, fields_requested: int, fields_recovered: int) -> None:
+    """Count a targeted follow-up request and how many missing fields it filled."""
+    with _stats_lock:
+        counters = _stats.setdefault(kind, {})
+        counters["followups"] = counters.get("followups", 0) + 1
+        counters["fields_requested"] = counters.get("fields_requested", 0) + fields_requested
+        counters["fields_recovered"] = counters.get("fields_recovered", 0) + fields_recovered
+
+
+def get_salvage_stats() -> Dict[str, Any]:
+    """Per caller: parse outcomes and the share of non-clean outputs that were salvaged."""
+    with _stats_lock:
+        stats = {kind: dict(counters) for kind, counters in _stats.items()}
+    for counters in stats.values():
+        salvaged = counters.get("extracted", 0) + counters.get("repaired", 0)
+        broken = salvaged + counters.get("failed", 0)
+        counters["salvage_rate"] = round(salvaged / broken, 3) if broken else None
+    return stats
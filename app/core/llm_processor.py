@@ -3,6 +3,15 @@ import logging
 import requests
 import json
 import sys
+from typing import Tuple
+
+from app.core.scheduler import get_scheduler, SchedulerSaturated
+from app.core.router import get_router, get_http_session
+from app.core.backends import get_backend
+from app.core.batching import batchable, get_batcher, LLM_BATCH_WINDOW_MS
+from app.core.singleflight import get_single_flight
+from app.core.fingerprint import content_hash
+from app.core.cancellation import Cancelled, current_token, iter_response_lines, wait_future
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,6 +22,8 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "600"))
+
 # Carica i parametri dal file di configurazione
 def load_config():
     try:
@@ -28,39 +39,103 @@ def load_config():
         }
 
 class LLMProcessor:
-    def __init__(self):
+    def __init__(self, model: str = None):
         config = load_config()
-        self.api_url = os.getenv("OLLAMA_SERVER_URL", "http://127.0.0.1:11434/api/generate")
-        self.model = config.get("LLM_MODEL")
+        self.model = model or config.get("LLM_MODEL")
         self.context_size = config.get("LLM_CONTEXT_SIZE")
         self.temperature = config.get("LLM_TEMPERATURE")
         self.max_tokens = min(self.context_size - 512, self.context_size // 2)
 
-    def generate_response(self, prompt: str, temperature: float = None, max_tokens: int = None) -> str:
+    def generate_response(self, prompt: str, temperature: float = None, max_tokens: int = None,
+                          grammar: str = None) -> str:
+        """
+        Raw Ollama-style JSON envelope (``{"response": ...}``) from whichever
+        backend the router picks; "" on failure. ``grammar`` (GBNF) is honoured
+        by llama.cpp backends only. With ``LLM_BATCH_WINDOW_MS`` set and a
+        llama.cpp node serving the model, the prompt is micro-batched with
+        concurrent ones (the batch takes the scheduler slot); an identical prompt
+        already in flight is joined instead of sent again. Raises
+        ``Cancelled`` when the caller's cancellation token fires.
+        """
         temperature = temperature if temperature is not None else self.temperature
         max_tokens = max_tokens if max_tokens is not None else self.max_tokens
+
+        def run():
+            if LLM_BATCH_WINDOW_MS > 0 and batchable(self.model):
+                future = get_batcher().submit(self, prompt, temperature, max_tokens, grammar)
+                return wait_future(future, current_token())
+            with get_scheduler().slot():
+                return self.complete(prompt, temperature, max_tokens, grammar)
+
+        # Identical prompts already in flight (double-posts, concurrent users) are joined
+        key = "prompt:" + content_hash([self.model, self.context_size, temperature, max_tokens, grammar, prompt])
         try:
-            payload = {
-                "model": self.model,
-                "prompt": prompt,
-                "temperature": temperature,
-                "num_ctx": self.context_size,
-                "max_tokens": max_tokens,
-                "stream": False
-            }
-            # print(f"Sending request to Ollama API with payload: {payload}")
-            response = requests.post(self.api_url, json=payload)
-            print(f"Ollama API response status: {response.status_code}")
-            if response.status_code == 200:
-                # print(f"Ollama API response body (truncated): {response.text[:500]}")
-                return response.text
-            else:
-                logger.error(f"Non-200 response from Ollama API: {response.status_code} - {response.text}")
-                return ""
+            return get_single_flight().do(key, run)
+        except (SchedulerSaturated, Cancelled):
+            raise
         except Exception as e:
-            logger.error(f"Error contacting Ollama API: {e}")
+            logger.error(f"Error contacting LLM backend: {e}")
             return ""
 
+    def complete(self, prompt: str, temperature: float, max_tokens: int, grammar: str = None) -> str:
+        """
+        One routed completion call, without scheduling or batching. Under a
+        cancellation token the response is streamed, so cancelling closes
+        the connection and the backend stops generating.
+        """
+        token = current_token()
+
+        def send(node):
+            backend = get_backend(node.kind)
+            path, payload = backend.build_request(self.model, prompt, temperature, max_tokens,
+                                                  self.context_size, grammar)
+            payload["stream"] = token is not None
+            response = get_http_session().post(node.base_url + path, json=payload, timeout=LLM_REQUEST_TIMEOUT,
+                                               stream=token is not None)
+            if response.status_code >= 500:
+                response.close()
+                raise requests.HTTPError(f"{response.status_code} from {node.base_url}", response=response)
+            if response.status_code != 200:
+                return backend, response.status_code, response.text
+            if token is None:
+                return backend, 200, backend.parse_response(self.model, response.text)[1]
+            return backend, 200, backend.parse_stream(self.model, iter_response_lines(response, token))[1]
+
+        backend, status, body = get_router().call(self.model, send)
+        logger.debug(f"{backend.kind} API response status: {status}")
+        if status == 200:
+            return body
+        logger.error(f"Non-200 response from {backend.kind} API: {status} - {body}")
+        return ""
+
+    def count_tokens(self, text: str) -> Tuple[int, bool]:
+        """
+        ``(tokens, estimated)``: exact count from a llama.cpp ``/tokenize``
+        when available, else ~4 chars per token with ``estimated`` True.
+        """
+        router = get_router()
+        if any(node.kind == "llamacpp" for node in router.nodes):
+            try:
+                return router.call(None, lambda node: get_backend(node.kind).tokenize(
+                    get_http_session(), node.base_url, text), kinds=("llamacpp",)), False
+            except Exception as e:
+                logger.warning(f"⚠️ Tokenize failed, estimating: {e}")
+        return max(1, len(text) // 4), True
+
+    def generate_text(self, prompt: str, temperature: float = None, max_tokens: int = None) -> str:
+        """
+        Same as generate_response, but unwraps Ollama's JSON envelope and
+        returns only the generated text.
+        """
+        raw = self.generate_response(prompt, temperature=temperature, max_tokens=max_tokens)
+        try:
+            envelope = json.loads(raw)
+        except (json.JSONDecodeError, TypeError):
+            return raw or ""
+        if isinstance(envelope, dict) and "response" in envelope:
+            return envelope.get("response") or ""
+        return raw
+
 
-def get_llm_processor():
-    return LLMProcessor()
\ No newline at end of file
+def get_llm_processor(model: str = None):
+    return LLMProcessor(model=model)
\ No newline at end of file
@@ -0,0 +1,308 @@
+"""
+Resumable trial-matching state for deadline-aware ("anytime") matching.
+
+A request with a time budget returns whatever was evaluated before the
+deadline, flagging the rest as not evaluated (and finalists still waiting
+for the large model as provisional).  The state keeps every completed
+screen/final result, so a follow-up call can finish the remaining trials
+in the background without redoing completed work.
+
+States are saved to a SQLite file shared by every gunicorn worker, so the
+follow-up calls (``/api/matches/<id>``, ``/continue``, ``PATCH /features``)
+work whichever worker receives them.  A worker finishing a state in the
+background keeps its in-memory copy and checkpoints it while it runs.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MATCH_TIME_BUDGET = float(os.getenv("MATCH_TIME_BUDGET", "0"))
+MATCH_STATE_CACHE_SIZE = 256
+MATCH_STATES_DB_PATH = os.getenv("MATCH_STATES_DB_PATH", os.path.join("data", "match_states.sqlite3"))
+# Saved states older than this are deleted (they hold the patient's extracted features)
+MATCH_STATE_TTL_SECONDS = float(os.getenv("MATCH_STATE_TTL_SECONDS", "3600"))
+# A background run whose checkpoints stop (worker killed) no longer counts as running
+MATCH_STATE_STALE_SECONDS = 300.0
+MATCH_STATE_CHECKPOINT_SECONDS = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS match_states (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    running INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_match_states_created ON match_states (created_at);
+"""
+
+
+class Deadline:
+    """Wall-clock budget; ``seconds`` <= 0 or None means no deadline."""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.seconds = seconds if seconds and seconds > 0 else None
+        self.expires_at = time.monotonic() + self.seconds if self.seconds else None
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+class MatchState:
+    """Completed evaluations of one patient against its candidate trials."""
+
+    def __init__(self, features: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.features = features
+        self.candidates: Optional[List[Dict[str, Any]]] = None
+        self.screened: Dict[str, Dict[str, Any]] = {}
+        # Trial ids selected for the large model, finalized or not
+        self.promoted: List[str] = []
+        self.finalized: Dict[str, Optional[Dict[str, Any]]] = {}
+        # Per trial: patient feature -> criteria that read it (for re-matching after edits)
+        self.dependencies: Dict[str, Dict[str, List[str]]] = {}
+        self.complete = False
+        # Matched on the regex fallback features: never persisted to the match store
+        self.degraded = False
+        # Caller-supplied reference the match store keys persisted results by (None: not persisted)
+        self.patient_ref: Optional[str] = None
+        self.running = False
+        self.created_at = time.time()
+        self.saved_at = 0.0
+        self.lock = threading.RLock()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "id": self.id,
+                "features": self.features,
+                "candidates": self.candidates,
+                "screened": self.screened,
+                "promoted": self.promoted,
+                "finalized": self.finalized,
+                "dependencies": self.dependencies,
+                "complete": self.complete,
+                "degraded": self.degraded,
+                "patient_ref": self.patient_ref,
+                "created_at": self.created_at,
+            }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], running: bool = False) -> "MatchState":
+        state = cls(data["features"])
+        state.id = data["id"]
+        state.candidates = data.get("candidates")
+        state.screened = data.get("screened") or {}
+        state.promoted = data.get("promoted") or []
+        state.finalized = data.get("finalized") or {}
+        state.dependencies = data.get("dependencies") or {}
+        state.complete = bool(data.get("complete"))
+        state.degraded = bool(data.get("degraded"))
+        state.patient_ref = data.get("patient_ref")
+        state.created_at = data.get("created_at", state.created_at)
+        state.running = running
+        return state
+
+    def results(self) -> List[Dict[str, Any]]:
+        """
+        Best available result per candidate: not-evaluated trials flagged, and
+        promoted trials still waiting for the large model marked ``pending_final``.
+        """
+        with self.lock:
+            results = []
+            for trial in self.candidates or []:
+                trial_id = trial.get("id")
+                result = self.finalized.get(trial_id)
+                if result is None and trial_id in self.screened:
+                    result = self.screened[trial_id]
+                    if trial_id in self.promoted:
+                        result = dict(result, pending_final=True)
+                if result is None:
+                    result = {
+                        "trial_id": trial_id,
+                        "title": trial.get("title", "Unknown Trial"),
+                        "description": trial.get("description", "No description provided."),
+                        "match_score": 0,
+                        "recommendation": "NOT_EVALUATED",
+                        "criteria_analysis": {},
+                        "summary": "Not evaluated within the time budget.",
+                        "stage": "not_evaluated"
+                    }
+                results.append(result)
+            return results
+
+    def not_evaluated(self) -> int:
+        with self.lock:
+            return sum(1 for trial in self.candidates or [] if trial.get("id") not in self.screened)
+
+
+class MatchStateStore:
+    """Saved match states in a SQLite file shared by every worker process."""
+
+    def __init__(self, path: str = MATCH_STATES_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def save(self, state: MatchState) -> None:
+        data = state.to_dict()
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO match_states (id, state, running, created_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET state = excluded.state, running = excluded.running, "
+                "updated_at = excluded.updated_at",
+                (state.id, json.dumps(data, ensure_ascii=False), int(state.running), data["created_at"], now)
+            )
+        state.saved_at = now
+
+    def load(self, state_id: str) -> Optional[MatchState]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT state, running, created_at, updated_at FROM match_states WHERE id = ?",
+                               (state_id,)).fetchone()
+        if row is None or time.time() - row["created_at"] > MATCH_STATE_TTL_SECONDS:
+            return None
+        running = bool(row["running"]) and time.time() - row["updated_at"] < MATCH_STATE_STALE_SECONDS
+        state = MatchState.from_dict(json.loads(row["state"]), running=running)
+        state.saved_at = row["updated_at"]
+        return state
+
+    def claim(self, state_id: str) -> bool:
+        """Atomically mark a saved state running; False if another worker is already running it."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE match_states SET running = 1, updated_at = ? WHERE id = ? AND (running = 0 OR updated_at < ?)",
+                (now, state_id, now - MATCH_STATE_STALE_SECONDS)
+            )
+        return cursor.rowcount > 0
+
+    def purge_expired(self) -> int:
+        with self._connect() as conn:
+            cursor = conn.execute("DELETE FROM match_states WHERE created_at < ?",
+                                  (time.time() - MATCH_STATE_TTL_SECONDS,))
+        return cursor.rowcount
+
+
+_store: Optional[MatchStateStore] = None
+_store_lock = threading.Lock()
+
+# States being finished in the background by this process
+_states: "OrderedDict[str, MatchState]" = OrderedDict()
+_states_lock = threading.Lock()
+
+
+def get_match_state_store() -> MatchStateStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MatchStateStore()
+    return _store
+
+
+def save_match_state(state: MatchState, throttle: bool = False) -> None:
+    """
+    Persist a state created by ``create_match_state`` for the other workers
+    (other states are private to their caller and never written); with
+    ``throttle`` at most once per checkpoint interval.
+    """
+    if not state.saved_at or (throttle and time.time() - state.saved_at < MATCH_STATE_CHECKPOINT_SECONDS):
+        return
+    try:
+        get_match_state_store().save(state)
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ Match state {state.id[:8]} not saved: {e}")
+
+
+def create_match_state(features: Dict[str, Any]) -> MatchState:
+    state = MatchState(features)
+    store = get_match_state_store()
+    store.purge_expired()
+    store.save(state)
+    return state
+
+
+def get_match_state(state_id: str) -> Optional[MatchState]:
+    """The running in-process copy of a state, else the last one saved by any worker."""
+    with _states_lock:
+        local = _states.get(state_id)
+    if local is not None and local.running:
+        return local
+    return get_match_state_store().load(state_id)
+
+
+def claim_match_state(state: MatchState) -> bool:
+    """
+    Mark ``state`` running for this caller (atomically across workers for
+    shared states); False if it is already running here or elsewhere.
+    Every successful claim is paired with ``release_match_state``.
+    """
+    with state.lock:
+        if state.running:
+            return False
+        if state.saved_at and not get_match_state_store().claim(state.id):
+            return False
+        state.running = True
+    with _states_lock:
+        _states[state.id] = state
+        while len(_states) > MATCH_STATE_CACHE_SIZE:
+            _states.popitem(last=False)
+    return True
+
+
+def release_match_state(state: MatchState) -> None:
+    with state.lock:
+        state.running = False
+    save_match_state(state)
+    with _states_lock:
+        _states.pop(state.id, None)
+
+
+def finish_in_background(state: MatchState, run: Callable[[MatchState], Any]) -> bool:
+    """
+    Complete the remaining work of ``state`` on a daemon thread.
+    Returns False if it is already complete or already running, in this
+    or another worker.
+    """
+    if state.complete or not claim_match_state(state):
+        return False
+
+    def worker():
+        try:
+            run(state)
+        except Exception as e:
+            logger.exception(f"❌ Background matching {state.id} failed: {e}")
+        finally:
+            release_match_state(state)
+
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(worker,), name=f"match-{state.id[:8]}", daemon=True).start()
+    return True
@@ -0,0 +1,265 @@
+"""
+Persisted match results for re-scoring stored patients on catalog updates.
+
+Persistence is opt-in: only with ``MATCH_STORE_ENABLED`` set, and only for
+matches whose caller supplied a patient reference (``patient_ref``, e.g.
+the hospital's pseudonymous record id), which keys the stored rows and is
+the handle for deleting them (``DELETE /api/patients/<ref>``).  Patients
+not re-matched for ``MATCH_STORE_RETENTION_DAYS`` are purged.
+
+Every completed evaluation is stored per (patient reference, trial id,
+trial content hash), including the catalog trials that were not candidates
+for the patient, so the store knows exactly which trial versions each
+patient has been checked against.  When ``trials_manager
+--rescore-patients`` imports new or amended trials,
+``rescore_stored_patients`` evaluates each stored patient only against the
+trial versions it has not seen and reports, per trial, the patients that
+became eligible.  Patients are stored de-identified: only the structured
+feature fields are kept, never source snippets or the original note.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.core.fingerprint import content_hash
+from app.core.schema_validation import FEATURE_FIELDS
+
+logger = logging.getLogger(__name__)
+
+MATCH_STORE_ENABLED = os.getenv("MATCH_STORE_ENABLED", "0").lower() in ("1", "true", "yes")
+MATCH_RESULTS_DB_PATH = os.getenv("MATCH_RESULTS_DB_PATH", os.path.join("data", "match_results.sqlite3"))
+MATCH_STORE_RETENTION_DAYS = float(os.getenv("MATCH_STORE_RETENTION_DAYS", "30"))
+PATIENT_REF_MAX_LENGTH = 128
+# Final-stage recommendations counted as eligible in the catalog update report
+ELIGIBLE_RECOMMENDATIONS = ("RECOMMENDED", "POTENTIALLY_ELIGIBLE")
+NOT_CANDIDATE = "NOT_CANDIDATE"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    patient_ref TEXT PRIMARY KEY,
+    features TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    features_changed_at REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS match_results (
+    patient_ref TEXT NOT NULL,
+    trial_id TEXT NOT NULL,
+    trial_hash TEXT NOT NULL,
+    match_score REAL NOT NULL,
+    recommendation TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    result TEXT,
+    evaluated_at REAL NOT NULL,
+    PRIMARY KEY (patient_ref, trial_id)
+);
+CREATE INDEX IF NOT EXISTS ix_match_results_trial ON match_results (trial_id, trial_hash);
+"""
+
+
+def deidentify(features: Dict[str, Any]) -> Dict[str, Any]:
+    """Structured feature values and concept codes only: no source snippets or note text."""
+    return {key: value for key, value in features.items() if key in FEATURE_FIELDS or key == "concepts"}
+
+
+def patient_reference(value: Any) -> Optional[str]:
+    """A caller-supplied patient reference, or None when missing or unusable."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value if 0 < len(value) <= PATIENT_REF_MAX_LENGTH else None
+
+
+def is_eligible(result: Optional[Dict[str, Any]]) -> bool:
+    return bool(result) and result.get("stage") == "final" and result.get("recommendation") in ELIGIBLE_RECOMMENDATIONS
+
+
+class MatchResultStore:
+    """Latest result of each stored patient against each trial, in a SQLite file."""
+
+    def __init__(self, path: str = MATCH_RESULTS_DB_PATH, retention_days: float = MATCH_STORE_RETENTION_DAYS):
+        self.path = path
+        self.retention = retention_days * 86400
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(patients)")}
+            if "features_hash" in columns:
+                # Rows of earlier versions were stored without consent and have no reference to delete them by
+                logger.warning("⚠️ Dropping legacy match results keyed by features hash")
+                conn.executescript("DROP TABLE IF EXISTS match_results; DROP TABLE IF EXISTS patients;")
+            conn.executescript(_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(patients)")}
+            if "features_changed_at" not in columns:
+                conn.execute("ALTER TABLE patients ADD COLUMN features_changed_at REAL NOT NULL DEFAULT 0")
+                conn.execute("UPDATE patients SET features_changed_at = updated_at")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def save(self, patient_ref: str, features: Dict[str, Any], trials: List[Dict[str, Any]],
+             results: List[Dict[str, Any]]) -> str:
+        """
+        Store the evaluated ``results`` of a patient, and every other trial
+        of ``trials`` as not a candidate.  Trials left unevaluated by a
+        deadline, and finalists still waiting for the large model, are not
+        stored, so the next catalog update evaluates them.
+        """
+        key = patient_reference(patient_ref)
+        if key is None:
+            raise ValueError("A patient reference is required to store match results")
+        by_id = {result.get("trial_id"): result for result in results}
+        stored = deidentify(features)
+        now = time.time()
+        rows = []
+        for trial in trials:
+            result = by_id.get(trial.get("id"))
+            if result is None:
+                rows.append((key, trial.get("id"), content_hash(trial), 0, NOT_CANDIDATE, "not_candidate", None, now))
+            elif result.get("stage") != "not_evaluated" and not result.get("pending_final"):
+                rows.append((key, trial.get("id"), content_hash(trial), result.get("match_score") or 0,
+                             result.get("recommendation") or "UNKNOWN", result.get("stage") or "",
+                             json.dumps(result, ensure_ascii=False), now))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO patients (patient_ref, features, created_at, updated_at, features_changed_at) "
+                    "VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(patient_ref) DO UPDATE SET updated_at = excluded.updated_at, "
+                    "features_changed_at = CASE WHEN features = excluded.features THEN features_changed_at "
+                    "ELSE excluded.features_changed_at END, features = excluded.features",
+                    (key, json.dumps(stored, ensure_ascii=False), now, now, now)
+                )
+                conn.executemany("INSERT OR REPLACE INTO match_results VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return key
+
+    def delete(self, patient_ref: str) -> bool:
+        """Remove a patient and all its results; False if it was not stored."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM match_results WHERE patient_ref = ?", (patient_ref,))
+                cursor = conn.execute("DELETE FROM patients WHERE patient_ref = ?", (patient_ref,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount > 0
+
+    def purge_expired(self) -> int:
+        """Delete the patients not re-matched within the retention period, with their results."""
+        cutoff = time.time() - self.retention
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM match_results WHERE patient_ref IN "
+                             "(SELECT patient_ref FROM patients WHERE updated_at < ?)", (cutoff,))
+                cursor = conn.execute("DELETE FROM patients WHERE updated_at < ?", (cutoff,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if cursor.rowcount:
+            logger.info(f"🧹 Purged {cursor.rowcount} stored patients past retention")
+        return cursor.rowcount
+
+    def patients(self) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT patient_ref, features FROM patients ORDER BY created_at").fetchall()
+        return [{"patient_ref": row["patient_ref"], "features": json.loads(row["features"])} for row in rows]
+
+    def seen(self, key: str) -> Dict[str, str]:
+        """Trial id → content hash of the version each trial was last evaluated at, for one patient."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT trial_id, trial_hash FROM match_results WHERE patient_ref = ?",
+                                (key,)).fetchall()
+        return {row["trial_id"]: row["trial_hash"] for row in rows}
+
+    def results(self, key: str) -> Dict[str, Dict[str, Any]]:
+        """Stored results of one patient by trial id (candidates only)."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT trial_id, result FROM match_results WHERE patient_ref = ? AND result IS NOT NULL",
+                                (key,)).fetchall()
+        return {row["trial_id"]: json.loads(row["result"]) for row in rows}
+
+    def revision(self) -> tuple:
+        """Changes when a patient is added, removed or its features change (not on a plain re-match)."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT COUNT(*), MAX(features_changed_at) FROM patients").fetchone()
+        return tuple(row)
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            patients = conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+            results = conn.execute("SELECT COUNT(*) FROM match_results").fetchone()[0]
+        return {"patients": patients, "results": results}
+
+
+def rescore_stored_patients(trials: List[Dict[str, Any]], llm=None,
+                            store: MatchResultStore = None) -> Dict[str, Any]:
+    """
+    Evaluate every stored patient against the new or amended trials of
+    ``trials`` only, and persist the results.  Returns per-patient counts
+    and, per trial, the patients that became eligible.
+    """
+    from app.core.cascade import run_cascade
+    from app.core.feature_extraction import select_candidate_trials
+
+    store = store or get_match_store()
+    store.purge_expired()
+    newly_eligible: Dict[str, List[str]] = {}
+    report = {"patients": 0, "trials_evaluated": 0, "trials_skipped": 0, "newly_eligible": newly_eligible}
+    started = time.perf_counter()
+    for patient in store.patients():
+        key, features = patient["patient_ref"], patient["features"]
+        seen = store.seen(key)
+        changed = [trial for trial in trials if seen.get(trial.get("id")) != content_hash(trial)]
+        report["patients"] += 1
+        report["trials_skipped"] += len(trials) - len(changed)
+        if not changed:
+            continue
+        previous = store.results(key)
+        # Retrieval runs on the whole catalog (a subset would rebuild the embedding index with it)
+        changed_ids = {trial.get("id") for trial in changed}
+        candidates = [trial for trial in select_candidate_trials(features, trials) if trial.get("id") in changed_ids]
+        results, _ = run_cascade(features, candidates, trials, llm)
+        store.save(key, features, changed, results)
+        report["trials_evaluated"] += len(changed)
+        for result in results:
+            trial_id = result.get("trial_id")
+            if is_eligible(result) and not is_eligible(previous.get(trial_id)):
+                newly_eligible.setdefault(trial_id, []).append(key)
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(f"🔁 Re-scored {report['patients']} stored patients: {report['trials_evaluated']} trial evaluations, "
+                f"{report['trials_skipped']} skipped, {len(newly_eligible)} trials with newly eligible patients")
+    return report
+
+
+_store: Optional[MatchResultStore] = None
+_store_lock = threading.Lock()
+
+
+def get_match_store() -> MatchResultStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MatchResultStore()
+    return _store
@@ -0,0 +1,194 @@
+"""
+Reverse matching: eligible stored patients for a trial.
+
+The de-identified patients of the match store are loaded into a columnar
+index: numpy arrays for age and sex, and one boolean column per canonical
+concept code (histologies, biomarkers and treatments, raw and with their
+ancestors), the same codes ``trial_concepts`` assigns to trials.  A
+trial → patients query screens every patient with array operations (age
+range, sex, histology compatibility, targeted alterations), ranks the
+survivors and sends only the shortlist to the LLM with the compact
+scoring prompt, so its cost does not grow with the number of patients;
+the LLM checks stop at ``REVERSE_MATCH_TIME_BUDGET`` and the rest of the
+shortlist is reported as not checked.  The index is rebuilt when patients
+are added or removed or their features change.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.core.cancellation import check_cancelled
+from app.core.match_state import Deadline
+from app.core.match_store import MatchResultStore, get_match_store
+from app.core.rules import feature_value, parse_age_years
+from app.core.vocabulary import feature_concepts, get_vocabulary, trial_concepts
+
+logger = logging.getLogger(__name__)
+
+REVERSE_SHORTLIST_SIZE = int(os.getenv("REVERSE_SHORTLIST_SIZE", "20"))
+REVERSE_MATCH_TIME_BUDGET = float(os.getenv("REVERSE_MATCH_TIME_BUDGET", "60"))
+
+_GENDERS = {"male": 1, "female": 2}
+
+_stats = {"queries": 0, "patients_screened": 0, "shortlisted": 0}
+_stats_lock = threading.Lock()
+
+
+def _age(value: Any) -> int:
+    try:
+        return int(feature_value(value))
+    except (TypeError, ValueError):
+        return -1
+
+
+class PatientIndex:
+    """Columnar view of stored patients; -1 / 0 mark an unknown age / sex."""
+
+    def __init__(self, patients: List[Dict[str, Any]]):
+        vocabulary = get_vocabulary()
+        self.keys = [patient["patient_ref"] for patient in patients]
+        self.features = [patient["features"] for patient in patients]
+        self.age = np.array([_age(f.get("age")) for f in self.features], dtype=np.int16)
+        self.gender = np.array([_GENDERS.get(str(feature_value(f.get("gender")) or "").lower(), 0)
+                                for f in self.features], dtype=np.int8)
+
+        concepts = [f.get("concepts") or feature_concepts(f) for f in self.features]
+        raw = [[code for codes in c.values() for code in codes] for c in concepts]
+        self.columns: Dict[str, int] = {}
+        for codes in raw:
+            for code in vocabulary.expand(codes):
+                self.columns.setdefault(code, len(self.columns))
+        self.raw = np.zeros((len(patients), len(self.columns)), dtype=bool)
+        self.expanded = np.zeros_like(self.raw)
+        for row, codes in enumerate(raw):
+            self.raw[row, [self.columns[code] for code in codes]] = True
+            self.expanded[row, [self.columns[code] for code in vocabulary.expand(codes)]] = True
+        self.has_histology = np.array([bool(c.get("histology")) for c in concepts], dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _any(self, matrix: np.ndarray, codes) -> np.ndarray:
+        columns = [self.columns[code] for code in codes if code in self.columns]
+        if not columns:
+            return np.zeros(len(self), dtype=bool)
+        return matrix[:, columns].any(axis=1)
+
+    def screen(self, trial: Dict[str, Any]) -> np.ndarray:
+        """
+        Provisional 0-100 score of every patient for ``trial``, -1 when a
+        structured check rules the patient out (same scale as ``rule_screen``).
+        """
+        vocabulary = get_vocabulary()
+        eligible = np.ones(len(self), dtype=bool)
+        known = self.age >= 0
+        min_age, max_age = parse_age_years(trial.get("min_age")), parse_age_years(trial.get("max_age"))
+        if min_age is not None:
+            eligible &= ~known | (self.age >= min_age)
+        if max_age is not None:
+            eligible &= ~known | (self.age <= max_age)
+        allowed = _GENDERS.get(str(trial.get("gender") or "All").lower())
+        if allowed:
+            eligible &= (self.gender == 0) | (self.gender == allowed)
+
+        concepts = trial_concepts(trial)
+        score = np.full(len(self), 50, dtype=np.int16)
+        histologies = concepts.get("histology", [])
+        if histologies:
+            # Compatible when one histology is the other or one of its ancestors (LUAD ~ NSCLC)
+            compatible = self._any(self.raw, vocabulary.expand(histologies)) | self._any(self.expanded, histologies)
+            eligible &= ~self.has_histology | compatible
+            score += np.where(compatible, 30, 0).astype(np.int16)
+        alterations = [code for code in concepts.get("biomarker", []) if code in vocabulary.parents]
+        if alterations:
+            score += np.where(self._any(self.expanded, alterations), 20, 0).astype(np.int16)
+        return np.where(eligible, np.minimum(score, 100), -1)
+
+
+_index: Optional[PatientIndex] = None
+_index_revision = None
+_index_lock = threading.Lock()
+
+
+def get_patient_index(store: MatchResultStore = None) -> PatientIndex:
+    """Index of the stored patients, rebuilt only when the store changed."""
+    global _index, _index_revision
+    store = store or get_match_store()
+    revision = (store.path, store.revision())
+    with _index_lock:
+        if _index is None or _index_revision != revision:
+            started = time.perf_counter()
+            _index = PatientIndex(store.patients())
+            _index_revision = revision
+            logger.info(f"🗂️ Patient index built: {len(_index)} patients, {len(_index.columns)} concept columns "
+                        f"in {time.perf_counter() - started:.2f}s")
+        return _index
+
+
+def match_patients(trial: Dict[str, Any], llm=None, shortlist_size: int = REVERSE_SHORTLIST_SIZE,
+                   store: MatchResultStore = None, deadline: Deadline = None) -> Dict[str, Any]:
+    """
+    Stored patients eligible for ``trial``: a vectorized screen of the whole
+    index, then the LLM score of the best ``shortlist_size`` patients until
+    ``deadline`` expires.
+    """
+    from app.core.cascade import score_trial_llm
+    from app.core.llm_processor import get_llm_processor
+
+    llm = llm or get_llm_processor()
+    index = get_patient_index(store)
+    started = time.perf_counter()
+    scores = index.screen(trial)
+    passed = np.flatnonzero(scores >= 0)
+    # Stable sort: equal scores keep the store order (oldest patients first)
+    shortlist = passed[np.argsort(-scores[passed], kind="stable")][:shortlist_size]
+    screen_seconds = time.perf_counter() - started
+
+    patients = []
+    not_checked = 0
+    started = time.perf_counter()
+    for position, row in enumerate(shortlist):
+        check_cancelled()
+        if deadline is not None and deadline.expired():
+            not_checked = len(shortlist) - position
+            break
+        result = score_trial_llm(trial, index.features[row], llm)
+        if result is None:
+            continue
+        patients.append({
+            "patient_id": index.keys[row],
+            "features": index.features[row],
+            "screen_score": int(scores[row]),
+            "match_score": result["match_score"],
+            "recommendation": result["recommendation"],
+            "summary": result["summary"],
+        })
+    patients.sort(key=lambda x: x["match_score"], reverse=True)
+
+    with _stats_lock:
+        _stats["queries"] += 1
+        _stats["patients_screened"] += len(index)
+        _stats["shortlisted"] += len(shortlist)
+    logger.info(f"🔎 Reverse match {trial.get('id')}: {len(index)} patients screened, {len(passed)} passed, "
+                f"{len(shortlist) - not_checked} checked by LLM, {not_checked} past the deadline")
+    return {
+        "trial_id": trial.get("id"),
+        "screened": len(index),
+        "passed_screen": int(len(passed)),
+        "shortlisted": int(len(shortlist)),
+        "not_checked": not_checked,
+        "complete": not_checked == 0,
+        "screen_seconds": round(screen_seconds, 4),
+        "llm_seconds": round(time.perf_counter() - started, 3),
+        "patients": patients,
+    }
+
+
+def get_reverse_match_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,190 @@
+"""
+Compact trial payloads for matching prompts.
+
+The full-analysis prompt used to embed ``json.dumps(trial, indent=2)``:
+indentation, summary, sponsor, dates, status and the eligibility text twice
+(the catalog stores it in both criteria lists), with its empty ``""`` lines.
+``compact_trial`` projects only what eligibility depends on (id, title,
+sex, age range and the criteria, split by section and de-duplicated within
+each section) as plain lines.  Fragments and their token counts are precomputed at ingest
+(``scripts/build_prompt_fragments.py``) into a store keyed by trial
+content hash; a trial amended since is compacted on first use.
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.core.criteria import split_eligibility, normalize_criterion
+from app.core.fingerprint import content_hash
+
+logger = logging.getLogger(__name__)
+
+PROMPT_FRAGMENTS_DIR = os.getenv("PROMPT_FRAGMENTS_DIR", os.path.join("data", "prompt_fragments"))
+FRAGMENTS_FILE = "fragments.json"
+
+_UNBOUNDED_AGES = ("", "not specified", "n/a", "none")
+
+_stats = {"prompts": 0, "precomputed": 0, "tokens": 0, "original_tokens": 0}
+_stats_lock = threading.Lock()
+
+
+def _collapse(text: str) -> str:
+    return " ".join(text.split())
+
+
+def verbose_trial(trial: Dict[str, Any]) -> str:
+    """The payload the matching prompt used before compaction, for the savings report."""
+    return json.dumps(trial, indent=2)
+
+
+def compact_trial(trial: Dict[str, Any]) -> str:
+    """Eligibility-relevant projection of a trial, one fact or criterion per line."""
+    lines = [f"ID: {trial.get('id', '')}", f"Title: {_collapse(trial.get('title') or '')}"]
+
+    population = []
+    gender = str(trial.get("gender") or "All")
+    if gender.lower() != "all":
+        population.append(f"sex {gender.lower()}")
+    min_age, max_age = (str(trial.get(key) or "").strip() for key in ("min_age", "max_age"))
+    if min_age.lower() not in _UNBOUNDED_AGES:
+        population.append(f"age >= {min_age}")
+    if max_age.lower() not in _UNBOUNDED_AGES:
+        population.append(f"age <= {max_age}")
+    if population:
+        lines.append("Population: " + ", ".join(population))
+
+    for label, criteria in zip(("Inclusion", "Exclusion"), split_eligibility(trial)):
+        # The same text can be an inclusion and an exclusion criterion with opposite meaning
+        seen = set()
+        unique = []
+        for criterion in criteria:
+            key = normalize_criterion(criterion)
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(f"- {_collapse(criterion)}")
+        if unique:
+            lines.append(f"{label}:")
+            lines.extend(unique)
+    return "\n".join(lines)
+
+
+def _estimate_tokens(text: str) -> Tuple[int, bool]:
+    return max(1, len(text) // 4), True
+
+
+class TrialFragment:
+    """A trial's compact prompt payload and its token counts (compact vs. verbose JSON)."""
+
+    def __init__(self, trial_id: str, text: str, tokens: int, original_tokens: int, estimated: bool = False):
+        self.trial_id = trial_id
+        self.text = text
+        self.tokens = tokens
+        self.original_tokens = original_tokens
+        self.estimated = estimated
+
+    @property
+    def saved(self) -> int:
+        return self.original_tokens - self.tokens
+
+    @classmethod
+    def build(cls, trial: Dict[str, Any], count_tokens: Callable[[str], Tuple[int, bool]] = None) -> "TrialFragment":
+        """``count_tokens`` returns ``(tokens, estimated)``, as ``LLMProcessor.count_tokens``."""
+        text = compact_trial(trial)
+        counter = count_tokens or _estimate_tokens
+        tokens, estimated = counter(text)
+        original_tokens, original_estimated = counter(verbose_trial(trial))
+        return cls(trial.get("id"), text, tokens, original_tokens, estimated=estimated or original_estimated)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"trial_id": self.trial_id, "text": self.text, "tokens": self.tokens,
+                "original_tokens": self.original_tokens, "estimated": self.estimated}
+
+
+class PromptFragmentStore:
+    """Compact fragments by trial content hash, persisted as one JSON file."""
+
+    def __init__(self, fragments: Dict[str, TrialFragment] = None):
+        self.fragments = fragments or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, trials: List[Dict[str, Any]], count_tokens: Callable[[str], Tuple[int, bool]] = None,
+              directory: str = PROMPT_FRAGMENTS_DIR) -> "PromptFragmentStore":
+        """Compact and count every trial, then write the store atomically."""
+        store = cls({content_hash(trial): TrialFragment.build(trial, count_tokens) for trial in trials})
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, FRAGMENTS_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({key: fragment.to_dict() for key, fragment in store.fragments.items()}, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        saved = sum(fragment.saved for fragment in store.fragments.values())
+        logger.info(f"✅ Compacted {len(store.fragments)} trial prompts into {directory} ({saved} tokens saved)")
+        return store
+
+    @classmethod
+    def load(cls, directory: str = PROMPT_FRAGMENTS_DIR) -> "PromptFragmentStore":
+        path = os.path.join(directory, FRAGMENTS_FILE)
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"⚠️ Prompt fragment store unreadable, compacting on demand: {e}")
+            return cls()
+        return cls({key: TrialFragment(**value) for key, value in data.items()})
+
+    def get(self, trial: Dict[str, Any]) -> TrialFragment:
+        key = content_hash(trial)
+        with self._lock:
+            fragment = self.fragments.get(key)
+        if fragment is None:
+            fragment = TrialFragment.build(trial)
+            with self._lock:
+                self.fragments[key] = fragment
+        return fragment
+
+    def report(self) -> List[Dict[str, Any]]:
+        """Tokens saved per trial, largest savings first."""
+        rows = [
+            {"trial_id": f.trial_id, "original_tokens": f.original_tokens, "tokens": f.tokens, "saved": f.saved,
+             "saved_pct": round(100 * f.saved / f.original_tokens, 1) if f.original_tokens else 0.0}
+            for f in self.fragments.values()
+        ]
+        return sorted(rows, key=lambda row: row["saved"], reverse=True)
+
+
+_store: Optional[PromptFragmentStore] = None
+_store_lock = threading.Lock()
+
+
+def get_fragment_store() -> PromptFragmentStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PromptFragmentStore.load()
+                with _stats_lock:
+                    _stats["precomputed"] = len(_store.fragments)
+    return _store
+
+
+def trial_prompt_payload(trial: Dict[str, Any]) -> str:
+    """Compact trial text for a matching prompt, with its token savings counted."""
+    fragment = get_fragment_store().get(trial)
+    with _stats_lock:
+        _stats["prompts"] += 1
+        _stats["tokens"] += fragment.tokens
+        _stats["original_tokens"] += fragment.original_tokens
+    return fragment.text
+
+
+def get_compaction_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tokens_saved"] = stats["original_tokens"] - stats["tokens"]
+    stats["saved_ratio"] = round(stats["tokens_saved"] / stats["original_tokens"], 3) if stats["original_tokens"] else 0.0
+    return stats
@@ -50,3 +50,28 @@ Extract the following medical features from the patient text and return ONLY a v
     }
 }
 '''
+
+
+# Value specifications of the flat extraction schema, reused by the follow-up prompt
+FEATURE_FIELD_SPECS = {
+    "age": 'int or null',
+    "gender": '"male", "female", or "not mentioned"',
+    "diagnosis": '"NSCLC", "SCLC", "other", or "not mentioned"',
+    "stage": '"I", "II", "III", "IV", or "not mentioned"',
+    "ecog": '"0" to "4" or "not mentioned"',
+    "mutations": 'list of gene names or "none"',
+    "metastases": 'list or empty list',
+    "previous_treatments": 'list',
+    "lab_values": 'dict of test name to value',
+}
+
+FEATURE_FOLLOWUP_PROMPT = '''You are a clinical NLP model. Extract ONLY the following fields from the text below as a JSON object, with no explanation or extra text. Use keys:
+
+{{
+{fields}
+}}
+
+Text:
+{text}
+
+'''
@@ -22,34 +22,51 @@ Clinical Trial: {trial}
 7. Biomarkers/Mutations
 
 # OUTPUT FORMAT
-{
+{{
     "match_score": 0-100,
     "overall_recommendation": "RECOMMENDED|NOT_RECOMMENDED|POTENTIALLY_ELIGIBLE",
-    "criteria_analysis": {
+    "criteria_analysis": {{
         "inclusion_criteria": [
-            {
+            {{
                 "criterion": "string",
                 "met": true|false,
                 "explanation": "string",
                 "confidence": 0-100
-            }
+            }}
         ],
         "exclusion_criteria": [
-            {
+            {{
                 "criterion": "string",
                 "violated": true|false,
                 "explanation": "string",
                 "confidence": 0-100
-            }
+            }}
         ]
-    },
-    "key_factors": {
+    }},
+    "key_factors": {{
         "supporting": ["list of main factors supporting eligibility"],
         "opposing": ["list of main factors opposing eligibility"]
-    },
+    }},
     "uncertainty_areas": ["list of criteria that need clarification"],
     "next_steps": ["recommended actions for clarification"]
-}
+}}
+'''
+
+TRIAL_SCORING_PROMPT = '''
+# TASK
+Score how well the patient matches the clinical trial criteria.
+Do not explain each criterion: a detailed analysis is requested separately.
+
+# INPUT
+Patient Features: {patient_features}
+Clinical Trial: {trial}
+
+# OUTPUT FORMAT (JSON ONLY)
+{{
+    "match_score": 0-100,
+    "overall_recommendation": "RECOMMENDED|NOT_RECOMMENDED|POTENTIALLY_ELIGIBLE",
+    "summary": "one short sentence with the deciding factor"
+}}
 '''
 
 TRIAL_SUMMARY_PROMPT = '''
@@ -67,9 +84,26 @@ Match Analysis: {match_analysis}
 5. Next steps
 
 # FORMAT
-{
+{{
     "summary": "2-3 sentence summary",
     "key_points": ["bullet points of most important factors"],
     "patient_guidance": "what the patient should discuss with their doctor"
-}
+}}
+'''
+
+CRITERION_EVALUATION_PROMPT = '''
+# TASK
+Decide whether the patient satisfies ONE eligibility criterion of a clinical trial.
+Answer "met": true if the statement holds for the patient, false if it clearly does not,
+null if the patient features do not allow a decision.
+
+# INPUT
+Patient Features: {patient_features}
+Criterion: {criterion}
+
+# OUTPUT FORMAT (JSON ONLY)
+{{
+    "met": true|false|null,
+    "explanation": "one short sentence"
+}}
 '''
@@ -0,0 +1,154 @@
+"""
+Incremental re-matching after a clinician edits extracted features.
+
+Every screened trial records which patient features its checks and
+criteria read (``trial_dependencies``).  Editing a feature drops only the
+screen results of trials that depend on it; the cascade then re-screens
+those trials and reuses every other screen result of the match state.
+The dependencies come from keyword patterns, so any edit also re-scores
+every finalist with the large model: criterion verdicts (large model, and
+small model when configured) that do not read the edited fields are
+carried over to the evaluators of the new features, so this only re-asks
+the criteria that may have changed.  Candidates are re-selected only when
+a retrieval input changed.  The state is marked running for the duration,
+so a concurrent edit or ``/continue`` is refused instead of racing it.
+"""
+
+import logging
+import threading
+from typing import Any, Dict, List, Tuple
+
+from app.core.cascade import run_cascade, SCREENER_MODEL
+from app.core.criteria import get_criterion_catalog, get_criterion_evaluator
+from app.core.evaluation_plan import criterion_dependencies
+from app.core.feature_extraction import select_candidate_trials
+from app.core.llm_processor import get_llm_processor
+from app.core.match_state import Deadline, MatchState, claim_match_state, release_match_state
+from app.core.vocabulary import annotate_features
+from app.utils import get_all_trials
+
+logger = logging.getLogger(__name__)
+
+# Features that drive candidate selection (lexical filter, concepts and embeddings)
+RETRIEVAL_FIELDS = ("diagnosis", "stage", "mutations", "metastases", "previous_treatments")
+# Derived or provenance entries, never compared
+_IGNORED = ("concepts", "original_text")
+
+_stats = {"rematches": 0, "trials_reevaluated": 0, "trials_reused": 0, "verdicts_reused": 0, "refinalized": 0}
+_stats_lock = threading.Lock()
+
+
+class MatchBusy(Exception):
+    """The match state is being completed or re-matched by another caller."""
+
+
+def changed_fields(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    """Feature fields whose value differs between ``old`` and ``new``."""
+    fields = []
+    for field in sorted(set(old) | set(new)):
+        if field in _IGNORED or field.endswith("_source_text"):
+            continue
+        if old.get(field) != new.get(field):
+            fields.append(field)
+    return fields
+
+
+def _inherit_verdicts(old: Dict[str, Any], new: Dict[str, Any], changed: set, trials: List[Dict[str, Any]],
+                      llm) -> int:
+    catalog = get_criterion_catalog(trials)
+    models = [llm] + ([get_llm_processor(model=SCREENER_MODEL)] if SCREENER_MODEL else [])
+    inherited = 0
+    for model in models:
+        previous = get_criterion_evaluator(old, model)
+        inherited += get_criterion_evaluator(new, model).inherit(
+            previous, lambda key: not changed & set(criterion_dependencies(catalog.criteria.get(key, ""))))
+    return inherited
+
+
+def rematch(state: MatchState, features: Dict[str, Any], deadline: Deadline = None,
+            llm=None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Re-rank ``state`` for the edited ``features``, re-screening only the
+    trials whose criteria read a changed field.  Returns the updated
+    ranking (best first) and a report of what was re-evaluated and reused.
+    Raises ``MatchBusy`` if the state is already running.
+    """
+    if not claim_match_state(state):
+        raise MatchBusy(f"Match {state.id} is still running")
+    try:
+        return _rematch(state, features, deadline, llm or get_llm_processor())
+    finally:
+        release_match_state(state)
+
+
+def _rematch(state: MatchState, features: Dict[str, Any], deadline: Deadline,
+             llm) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    features = annotate_features(dict(features))
+    trials = get_all_trials()
+    with state.lock:
+        previous = state.features
+        changed = changed_fields(previous, features)
+        old_candidates = state.candidates or []
+
+    changed_set = set(changed)
+    if changed_set & set(RETRIEVAL_FIELDS):
+        candidates = select_candidate_trials(features, trials)
+    else:
+        candidates = old_candidates
+    candidate_ids = {trial.get("id") for trial in candidates}
+    added = [tid for tid in candidate_ids if tid not in {trial.get("id") for trial in old_candidates}]
+
+    with state.lock:
+        # Trials screened before dependencies were recorded are re-evaluated
+        affected = sorted(
+            tid for tid in state.screened
+            if tid in candidate_ids
+            and (tid not in state.dependencies or changed_set & set(state.dependencies[tid]))
+        )
+        dropped = [tid for tid in state.screened if tid not in candidate_ids]
+        for tid in affected + dropped:
+            state.screened.pop(tid, None)
+            state.dependencies.pop(tid, None)
+        # Dependencies are keyword-based: any edit re-scores every finalist (unchanged verdicts are reused)
+        refinalized = sorted(tid for tid in state.finalized if tid in candidate_ids) if changed else []
+        if changed:
+            state.finalized.clear()
+        else:
+            for tid in affected + dropped:
+                state.finalized.pop(tid, None)
+        reused = len(state.screened)
+        state.features = features
+        state.candidates = candidates
+        state.complete = False
+
+    verdicts_reused = _inherit_verdicts(previous, features, changed_set, trials, llm) if changed else 0
+    results, report = run_cascade(features, candidates, trials, llm, deadline=deadline, state=state)
+    results.sort(key=lambda x: x["match_score"], reverse=True)
+
+    report.update({
+        "changed": changed,
+        "reevaluated": affected,
+        "added": sorted(added),
+        "removed": sorted(dropped),
+        "reused": reused,
+        "refinalized": refinalized,
+        "verdicts_reused": verdicts_reused,
+    })
+    with _stats_lock:
+        _stats["rematches"] += 1
+        _stats["trials_reevaluated"] += len(affected) + len(added)
+        _stats["trials_reused"] += reused
+        _stats["verdicts_reused"] += verdicts_reused
+        _stats["refinalized"] += len(refinalized)
+    logger.info(f"♻️ Re-match {state.id[:8]} after editing {', '.join(changed) or 'nothing'}: "
+                f"{len(affected)} trials re-evaluated, {len(added)} new, {reused} reused, "
+                f"{len(refinalized)} finalists re-scored")
+    return results, report
+
+
+def get_rematch_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    evaluated = stats["trials_reevaluated"] + stats["trials_reused"]
+    stats["reuse_ratio"] = round(stats["trials_reused"] / evaluated, 3) if evaluated else 0.0
+    return stats
@@ -0,0 +1,152 @@
+"""
+Cheap structured checks between patient features and trial metadata.
+No LLM involved: these run on every candidate before any model is called.
+"""
+
+import re
+from typing import Any, Dict, List, Optional
+
+from app.core.criteria import split_eligibility, summarize_trial
+
+DIAGNOSIS_SYNONYMS = {
+    "nsclc": ["nsclc", "non-small cell lung", "non small cell lung", "non-small-cell lung"],
+    "sclc": ["sclc", "small cell lung", "small-cell lung"],
+}
+
+
+def feature_value(value: Any) -> Any:
+    """Accepts both flat LLM values and ``{"value": ..., "source": ...}`` entries."""
+    if isinstance(value, dict) and "value" in value:
+        return value["value"]
+    return value
+
+
+def parse_age_years(value: Optional[str]) -> Optional[int]:
+    """Parse catalog ages such as "18 Years" or "6 Months"; None if unbounded."""
+    if not value or not isinstance(value, str):
+        return None
+    match = re.match(r'\s*(\d+)\s*(year|month|week|day)?', value, re.IGNORECASE)
+    if not match:
+        return None
+    number = int(match.group(1))
+    unit = (match.group(2) or "year").lower()
+    if unit == "month":
+        return number // 12
+    if unit in ("week", "day"):
+        return 0
+    return number
+
+
+def eligibility_text(trial: Dict[str, Any]) -> str:
+    inclusion, exclusion = split_eligibility(trial)
+    return " ".join([trial.get("title", "")] + inclusion + exclusion).lower()
+
+
+def _negative_text(value: str) -> bool:
+    return value in ("", "none", "not mentioned", "null")
+
+
+def check_age(trial: Dict[str, Any], features: Dict[str, Any]) -> Optional[str]:
+    """Return a rejection reason when the patient age is outside the trial range."""
+    age = feature_value(features.get("age"))
+    try:
+        age = int(age)
+    except (TypeError, ValueError):
+        return None
+    min_age = parse_age_years(trial.get("min_age"))
+    max_age = parse_age_years(trial.get("max_age"))
+    if min_age is not None and age < min_age:
+        return f"Patient age {age} is below the minimum age {min_age}"
+    if max_age is not None and age > max_age:
+        return f"Patient age {age} is above the maximum age {max_age}"
+    return None
+
+
+def check_gender(trial: Dict[str, Any], features: Dict[str, Any]) -> Optional[str]:
+    gender = str(feature_value(features.get("gender")) or "").lower()
+    allowed = str(trial.get("gender") or "All").lower()
+    if gender in ("male", "female") and allowed in ("male", "female") and gender != allowed:
+        return f"Trial enrolls {allowed} patients only"
+    return None
+
+
+def diagnosis_matches(trial: Dict[str, Any], features: Dict[str, Any], text: Optional[str] = None) -> Optional[bool]:
+    """True/False if the diagnosis is (not) mentioned by the trial, None if unknown."""
+    diagnosis = str(feature_value(features.get("diagnosis")) or "").lower()
+    if _negative_text(diagnosis) or diagnosis == "other":
+        return None
+    text = text if text is not None else eligibility_text(trial)
+    terms = DIAGNOSIS_SYNONYMS.get(diagnosis, [diagnosis])
+    if diagnosis == "sclc":
+        # "small cell lung" is a substring of "non-small cell lung"
+        text = re.sub(r'non[\s-]small[\s-]cell', ' ', text)
+        text = re.sub(r'\bnsclc\b', ' ', text)
+    return any(term in text for term in terms)
+
+
+def check_histology(trial: Dict[str, Any], features: Dict[str, Any], text: Optional[str] = None) -> Optional[str]:
+    """
+    Reject when the trial targets a different known histology and never
+    mentions the patient's one (e.g. an SCLC patient on an NSCLC-only trial).
+    """
+    diagnosis = str(feature_value(features.get("diagnosis")) or "").lower()
+    if diagnosis not in DIAGNOSIS_SYNONYMS:
+        return None
+    text = text if text is not None else eligibility_text(trial)
+    if diagnosis_matches(trial, features, text):
+        return None
+    for other in DIAGNOSIS_SYNONYMS:
+        if other != diagnosis and diagnosis_matches(trial, {"diagnosis": other}, text):
+            return f"Trial targets {other.upper()}, patient has {diagnosis.upper()}"
+    return None
+
+
+def matching_mutations(trial: Dict[str, Any], features: Dict[str, Any], text: Optional[str] = None) -> List[str]:
+    """Patient mutations (gene names) mentioned anywhere in the trial."""
+    mutations = feature_value(features.get("mutations")) or []
+    if isinstance(mutations, str):
+        mutations = [mutations]
+    text = text if text is not None else eligibility_text(trial)
+    found = []
+    for mutation in mutations:
+        mutation = str(feature_value(mutation) or "").strip()
+        if not mutation or _negative_text(mutation.lower()):
+            continue
+        gene = mutation.split()[0].lower()
+        if re.search(r'\b' + re.escape(gene) + r'\b', text):
+            found.append(mutation)
+    return found
+
+
+def rule_screen(trial: Dict[str, Any], features: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Provisional 0-100 score from structured checks only.
+    Age and gender mismatches are hard failures (score 0).
+    """
+    inclusion, exclusion = [], []
+    for check, label in ((check_age, "Age requirement"), (check_gender, "Gender requirement")):
+        reason = check(trial, features)
+        inclusion.append({
+            "criterion": label,
+            "met": reason is None,
+            "explanation": reason or f"{label} satisfied"
+        })
+
+    text = eligibility_text(trial)
+    score = 50
+    diagnosis = diagnosis_matches(trial, features, text)
+    if diagnosis is True:
+        score += 30
+    elif diagnosis is False:
+        score -= 30
+    if matching_mutations(trial, features, text):
+        score += 20
+
+    result = summarize_trial(trial, inclusion, exclusion)
+    if result["recommendation"] == "NOT_RECOMMENDED":
+        result["match_score"] = 0
+    else:
+        result["match_score"] = max(0, min(100, score))
+        result["recommendation"] = "POTENTIALLY_ELIGIBLE"
+    result["summary"] = "Provisional score from structured checks."
+    return result
@@ -0,0 +1,244 @@
+"""
+Central scheduler for calls to the shared Ollama instance.
+
+Every LLM or embedding call takes a slot first.  Calls belong to a priority
+class (interactive clinician requests, batch re-matching, trial ingest);
+each class has its own concurrency limit and bounded queue, and the global
+limit is handed to the highest-priority class with waiters.  Inside a class
+the next slot goes round-robin to the waiting user with the fewest calls in
+flight and the oldest last grant, so one user's batch cannot monopolize
+the class.  A full queue raises ``SchedulerSaturated`` (mapped to HTTP 429
+with Retry-After); a waiter whose cancellation token fires leaves the
+queue with ``Cancelled``.
+
+The class and user of the current call come from a context variable set by
+the request or job that triggered it.
+
+Every process has its own scheduler: under gunicorn, priorities and
+per-user fairness hold within one worker.  The configured limits are
+totals for the deployment and each worker enforces its share
+(limit / ``WEB_WORKERS``, at least 1), so the workers together stay
+within the totals.
+"""
+
+import os
+import time
+import logging
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.cancellation import Cancelled, current_token, record_llm_abort
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_CLASSES = ("interactive", "batch", "ingest")
+
+
+def _parse_limits(value: str, default: int) -> Dict[str, int]:
+    limits = {name: default for name in PRIORITY_CLASSES}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, number = item.partition("=")
+        if name.strip() in limits:
+            limits[name.strip()] = int(number)
+    return limits
+
+
+def _per_worker(total: int) -> int:
+    return max(1, total // WEB_WORKERS)
+
+
+# Worker processes sharing the inference server (exported by gunicorn.conf.py)
+WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS", "1")))
+LLM_MAX_CONCURRENCY = _per_worker(int(os.getenv("LLM_MAX_CONCURRENCY", "4")))
+LLM_CLASS_LIMITS = {name: _per_worker(limit) for name, limit in _parse_limits(
+    os.getenv("LLM_CLASS_LIMITS", "interactive=4,batch=2,ingest=1"), 1).items()}
+LLM_QUEUE_LIMITS = {name: _per_worker(limit) for name, limit in _parse_limits(
+    os.getenv("LLM_QUEUE_LIMITS", "interactive=32,batch=256,ingest=256"), 32).items()}
+
+_context: contextvars.ContextVar = contextvars.ContextVar("llm_context", default=("interactive", "anonymous"))
+
+
+class SchedulerSaturated(Exception):
+    """The queue of a priority class is full; retry after ``retry_after`` seconds."""
+
+    def __init__(self, priority: str, retry_after: int):
+        super().__init__(f"LLM queue for '{priority}' requests is full, retry in {retry_after}s")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+def set_llm_context(priority: str = "interactive", user: Optional[str] = None) -> None:
+    """Tag the LLM calls made from the current thread/request."""
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class: {priority}")
+    _context.set((priority, user or "anonymous"))
+
+
+def get_llm_context() -> Tuple[str, str]:
+    return _context.get()
+
+
+@contextmanager
+def llm_context(priority: str, user: Optional[str] = None) -> Iterator[None]:
+    token = _context.set((priority, user or _context.get()[1]))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class _Ticket:
+    __slots__ = ("seq", "priority", "user", "enqueued", "granted")
+
+    def __init__(self, seq: int, priority: str, user: str):
+        self.seq = seq
+        self.priority = priority
+        self.user = user
+        self.enqueued = time.perf_counter()
+        self.granted: Optional[float] = None
+
+
+class LLMScheduler:
+    """Priority classes with per-class limits, bounded queues and per-user fairness."""
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 class_limits: Dict[str, int] = None, queue_limits: Dict[str, int] = None):
+        self.max_concurrency = max_concurrency
+        self.class_limits = dict(class_limits or LLM_CLASS_LIMITS)
+        self.queue_limits = dict(queue_limits or LLM_QUEUE_LIMITS)
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._grants = itertools.count()
+        self._waiting: Dict[str, List[_Ticket]] = {name: [] for name in PRIORITY_CLASSES}
+        self._running: Dict[str, int] = {name: 0 for name in PRIORITY_CLASSES}
+        self._running_by_user: Dict[Tuple[str, str], int] = {}
+        self._last_grant: Dict[Tuple[str, str], int] = {}
+        self._stats = {name: {"completed": 0, "rejected": 0, "cancelled": 0, "wait_seconds": 0.0, "service_seconds": 0.0,
+                              "max_wait_seconds": 0.0} for name in PRIORITY_CLASSES}
+
+    def _next(self) -> Optional[_Ticket]:
+        """The waiter that should get the next free slot, if any slot is free."""
+        if sum(self._running.values()) >= self.max_concurrency:
+            return None
+        for priority in PRIORITY_CLASSES:
+            waiting = self._waiting[priority]
+            if waiting and self._running[priority] < self.class_limits[priority]:
+                return min(waiting, key=lambda t: (self._running_by_user.get((priority, t.user), 0),
+                                                   self._last_grant.get((priority, t.user), -1), t.seq))
+        return None
+
+    def retry_after(self, priority: str) -> int:
+        stats = self._stats[priority]
+        avg_service = stats["service_seconds"] / stats["completed"] if stats["completed"] else 5.0
+        slots = max(1, min(self.class_limits[priority], self.max_concurrency))
+        return max(1, int(avg_service * (len(self._waiting[priority]) + 1) / slots))
+
+    def admit(self, priority: Optional[str] = None) -> None:
+        """Raise ``SchedulerSaturated`` upfront when the class queue is already full."""
+        priority = priority or get_llm_context()[0]
+        with self._cond:
+            if len(self._waiting[priority]) >= self.queue_limits[priority]:
+                self._stats[priority]["rejected"] += 1
+                raise SchedulerSaturated(priority, self.retry_after(priority))
+
+    def acquire(self, priority: Optional[str] = None, user: Optional[str] = None) -> _Ticket:
+        context_priority, context_user = get_llm_context()
+        priority = priority or context_priority
+        user = user or context_user
+        token = current_token()
+        if token is not None:
+            token.raise_if_cancelled()
+        with self._cond:
+            if len(self._waiting[priority]) >= self.queue_limits[priority]:
+                self._stats[priority]["rejected"] += 1
+                raise SchedulerSaturated(priority, self.retry_after(priority))
+            ticket = _Ticket(next(self._seq), priority, user)
+            self._waiting[priority].append(ticket)
+            unregister = token.on_cancel(self._wake) if token is not None else None
+            try:
+                while self._next() is not ticket:
+                    if token is not None and token.cancelled:
+                        self._waiting[priority].remove(ticket)
+                        self._stats[priority]["cancelled"] += 1
+                        self._cond.notify_all()
+                        record_llm_abort("queued")
+                        raise Cancelled(token.reason)
+                    self._cond.wait()
+            finally:
+                if unregister is not None:
+                    unregister()
+            self._waiting[priority].remove(ticket)
+            self._running[priority] += 1
+            key = (priority, user)
+            self._running_by_user[key] = self._running_by_user.get(key, 0) + 1
+            self._last_grant[key] = next(self._grants)
+            ticket.granted = time.perf_counter()
+            # Another slot may still be free for the next waiter
+            self._cond.notify_all()
+        return ticket
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def release(self, ticket: _Ticket) -> None:
+        finished = time.perf_counter()
+        with self._cond:
+            self._running[ticket.priority] -= 1
+            key = (ticket.priority, ticket.user)
+            self._running_by_user[key] -= 1
+            if not self._running_by_user[key]:
+                del self._running_by_user[key]
+            stats = self._stats[ticket.priority]
+            wait = ticket.granted - ticket.enqueued
+            stats["completed"] += 1
+            stats["wait_seconds"] += wait
+            stats["service_seconds"] += finished - ticket.granted
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], wait)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: Optional[str] = None, user: Optional[str] = None) -> Iterator[None]:
+        ticket = self.acquire(priority, user)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, in-flight calls, wait and service time per class."""
+        with self._cond:
+            classes = {}
+            for priority in PRIORITY_CLASSES:
+                stats = self._stats[priority]
+                completed = stats["completed"] or 1
+                classes[priority] = {
+                    "limit": self.class_limits[priority],
+                    "queue_limit": self.queue_limits[priority],
+                    "queued": len(self._waiting[priority]),
+                    "running": self._running[priority],
+                    "completed": stats["completed"],
+                    "rejected": stats["rejected"],
+                    "cancelled": stats["cancelled"],
+                    "avg_wait_seconds": round(stats["wait_seconds"] / completed, 3),
+                    "max_wait_seconds": round(stats["max_wait_seconds"], 3),
+                    "avg_service_seconds": round(stats["service_seconds"] / completed, 3),
+                }
+            # Limits of this worker; the deployment total is about workers x limit
+            return {"max_concurrency": self.max_concurrency, "workers": WEB_WORKERS, "pid": os.getpid(),
+                    "classes": classes}
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
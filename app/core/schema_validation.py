@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, validator, ValidationError
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
 
 class ClinicalFeatures(BaseModel):
     age: Optional[int] = Field(None, ge=0, le=120)
@@ -24,4 +24,31 @@ class ClinicalFeatures(BaseModel):
 
     @validator("lab_values", pre=True, always=True)
     def ensure_dict(cls, v):
-        return v if isinstance(v, dict) else {}
\ No newline at end of file
+        return v if isinstance(v, dict) else {}
+
+FEATURE_FIELDS = list(ClinicalFeatures.model_fields)
+
+
+def validate_features(data: Dict) -> Tuple[Dict, List[str]]:
+    """
+    Split extracted fields into those that validate against ``ClinicalFeatures``
+    (kept with their original values) and the names of the invalid ones.
+    """
+    valid, invalid = {}, []
+    for field in FEATURE_FIELDS:
+        if field not in data:
+            continue
+        value = data[field]
+        # Models often send numbers where the schema has strings (ECOG, lab results)
+        candidate = value
+        if isinstance(value, (int, float)) and field in ("ecog", "stage"):
+            candidate = str(value)
+        elif isinstance(value, dict) and field == "lab_values":
+            candidate = {name: str(result) for name, result in value.items()}
+        try:
+            ClinicalFeatures(**{field: candidate})
+        except ValidationError:
+            invalid.append(field)
+            continue
+        valid[field] = value
+    return valid, invalid
@@ -0,0 +1,208 @@
+"""
+In-flight request coalescing ("single flight").
+
+Identical work that is already running is joined instead of started
+again: an LLM prompt is keyed by the hash of model, prompt and generation
+settings, a whole feature extraction by the hash of the document text.
+Inside a process duplicate callers wait on the leader's result; this is
+the default.  Coalescing across gunicorn workers is opt-in: results hold
+patient data, so they only touch the disk when ``SINGLEFLIGHT_DIR`` is
+set.  There the leader holds an exclusive lock file and, if a duplicate
+in another worker has registered as waiting, writes its (JSON) result
+next to it (owner-only permissions).  The waiter reads it once it gets
+the lock, and the last waiter to read deletes it.  Results older than
+``SINGLEFLIGHT_TTL`` seconds are ignored and swept by ``cleanup``, so this
+is not a completion cache.  If the leader is cancelled, a waiting caller
+that was not cancelled itself runs the call instead.
+"""
+
+import os
+import glob
+import json
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from app.core.cancellation import Cancelled, CancellationToken, current_token, wait_event
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing stays within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Empty = coalesce within the process only, nothing is written to disk
+SINGLEFLIGHT_DIR = os.getenv("SINGLEFLIGHT_DIR", "")
+SINGLEFLIGHT_TTL = float(os.getenv("SINGLEFLIGHT_TTL", "30"))
+SINGLEFLIGHT_LOCK_POLL = 0.1
+CLEANUP_EVERY = 500
+
+_MISSING = object()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self, token: Optional[CancellationToken] = None) -> Any:
+        wait_event(self.done, token)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key, within and across processes."""
+
+    def __init__(self, directory: Optional[str] = SINGLEFLIGHT_DIR or None, ttl: float = SINGLEFLIGHT_TTL):
+        self.directory = directory if directory and fcntl is not None else None
+        self.ttl = ttl
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "joined": 0, "cross_worker_waits": 0, "cross_worker_hits": 0}
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Return ``fn()``, or the result of an identical call already in flight."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+                run_cleanup = self._stats["leaders"] % CLEANUP_EVERY == 0
+            else:
+                self._stats["joined"] += 1
+        if not leader:
+            logger.info(f"🔗 Joined in-flight call {key[:24]}")
+            token = current_token()
+            try:
+                return call.wait(token)
+            except Cancelled:
+                if token is not None and token.cancelled:
+                    raise
+                # The leader's caller went away, not ours
+                return self.do(key, fn)
+
+        try:
+            call.result = self._run_exclusive(key, fn) if self.directory else fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.done.set()
+            with self._lock:
+                self._calls.pop(key, None)
+        if run_cleanup:
+            self.cleanup()
+        return call.result
+
+    def _run_exclusive(self, key: str, fn: Callable[[], Any]) -> Any:
+        base = os.path.join(self.directory, key.replace(":", "_"))
+        marker = None
+        with open(base + ".lock", "a+") as lock_file:
+            try:
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if marker is None:
+                            # Another worker runs the same call: ask it to share the result
+                            marker = f"{base}.wait-{os.getpid()}-{threading.get_ident()}"
+                            open(marker, "a").close()
+                        # Polling keeps gthread/gevent workers responsive
+                        token = current_token()
+                        if token is not None:
+                            token.raise_if_cancelled()
+                        time.sleep(SINGLEFLIGHT_LOCK_POLL)
+                try:
+                    if marker is not None:
+                        with self._lock:
+                            self._stats["cross_worker_waits"] += 1
+                        cached = self._read(base + ".json")
+                        self._leave(base, marker)
+                        marker = None
+                        if cached is not _MISSING:
+                            with self._lock:
+                                self._stats["cross_worker_hits"] += 1
+                            logger.info(f"🔗 Reused result of another worker for {key[:24]}")
+                            return cached
+                    result = fn()
+                    if result and glob.glob(glob.escape(base) + ".wait-*"):
+                        self._write(base + ".json", result)
+                    return result
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            finally:
+                if marker is not None:
+                    self._leave(base, marker)
+
+    def _leave(self, base: str, marker: str) -> None:
+        """Drop a waiter's marker; the last waiter also deletes the shared result."""
+        try:
+            os.remove(marker)
+        except OSError:
+            pass
+        if not glob.glob(glob.escape(base) + ".wait-*"):
+            try:
+                os.remove(base + ".json")
+            except OSError:
+                pass
+
+    def _read(self, path: str) -> Any:
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return _MISSING
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return _MISSING
+
+    def _write(self, path: str, result: Any) -> None:
+        try:
+            fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"⚠️ Could not share result {path}: {e}")
+
+    def cleanup(self) -> None:
+        """Drop expired results and idle lock and waiter files."""
+        if not self.directory:
+            return
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            max_age = self.ttl if name.endswith(".json") else 3600
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats, in_flight=len(self._calls))
+        total = stats["leaders"] + stats["joined"]
+        stats["coalesced_rate"] = round((stats["joined"] + stats["cross_worker_hits"]) / total, 3) if total else 0.0
+        stats["across_workers"] = self.directory is not None
+        return stats
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    global _single_flight
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
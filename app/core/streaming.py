@@ -0,0 +1,161 @@
+"""
+Server-Sent Events stream of a /process run.
+
+The pipeline runs on a worker thread and pushes events to a queue as soon
+as each piece is ready: ``features`` after extraction, one ``trial`` event
+per screen/final evaluation, then a ``summary`` with the final ranking.
+Time to the first trial result is tracked separately from the total time.
+While the pipeline is busy a keep-alive comment is sent every
+``STREAM_KEEPALIVE_SECONDS``; a write to a closed connection closes the
+generator, which cancels the run and its LLM calls.
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import contextvars
+from typing import Any, Dict, Iterator, Optional
+
+from app.core.scheduler import SchedulerSaturated
+from app.core.cancellation import Cancelled, CancellationToken, cancellation_scope, record_cancelled
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEEPALIVE_SECONDS = 5.0
+
+_DONE = object()
+
+_stats = {"streams": 0, "features_seconds": 0.0, "first_result_seconds": 0.0, "total_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _record(timings: Dict[str, Optional[float]]) -> None:
+    with _stats_lock:
+        _stats["streams"] += 1
+        _stats["features_seconds"] += timings.get("features") or 0.0
+        _stats["first_result_seconds"] += timings.get("first_result") or 0.0
+        _stats["total_seconds"] += timings.get("total") or 0.0
+
+
+def stream_process(app, text: str = None, pdf_path: str = None, pdf_filename: str = None,
+                   time_budget: float = None, patient_ref: str = None) -> Iterator[str]:
+    """Run extraction and matching for one note, yielding SSE frames."""
+    from app.utils import extract_text_from_pdf
+    from app.core.feature_extraction import match_trials_llm
+    from app.core.hedging import extract_features_hedged
+    from app.core.grounding import ground_sources, render_highlights
+    from app.core.match_state import Deadline, MATCH_TIME_BUDGET, create_match_state
+
+    events: "queue.Queue" = queue.Queue()
+    started = time.perf_counter()
+    timings: Dict[str, Optional[float]] = {"features": None, "first_result": None, "total": None}
+    token = CancellationToken()
+    stage = {"name": "pdf_extraction" if pdf_path and not text else "feature_extraction"}
+
+    def elapsed() -> float:
+        return round(time.perf_counter() - started, 3)
+
+    def run():
+        try:
+            with app.app_context(), cancellation_scope(token):
+                note = text
+                if not note and pdf_path:
+                    try:
+                        with open(pdf_path, "rb") as f:
+                            note = extract_text_from_pdf(f)
+                    finally:
+                        os.remove(pdf_path)
+                if not note:
+                    events.put(("error", {"error": "Extracted text is empty."}))
+                    return
+
+                stage["name"] = "feature_extraction"
+                extraction = extract_features_hedged(note)
+                features = extraction.features
+                if not isinstance(features, dict) or not features:
+                    events.put(("error", {"error": "LLM returned an invalid or empty response."}))
+                    return
+                timings["features"] = elapsed()
+                state = create_match_state(features)
+                state.candidates = extraction.candidates
+                state.degraded = extraction.degraded
+                state.patient_ref = patient_ref
+                sources = ground_sources(note, features)
+                events.put(("features", {
+                    "features": features,
+                    "degraded": extraction.degraded,
+                    "degraded_reason": extraction.reason,
+                    "text": note,
+                    "sources": sources,
+                    "text_highlighted": render_highlights(note, sources),
+                    "pdf_filename": pdf_filename,
+                    "match_id": state.id,
+                    "seconds": timings["features"]
+                }))
+
+                def on_result(result: Dict[str, Any]) -> None:
+                    if timings["first_result"] is None:
+                        timings["first_result"] = elapsed()
+                    events.put(("trial", {"result": result, "seconds": elapsed()}))
+
+                stage["name"] = "matching"
+                budget = time_budget if time_budget is not None else MATCH_TIME_BUDGET
+                matched_trials = match_trials_llm(features, deadline=Deadline(budget), state=state,
+                                                  on_result=on_result)
+                timings["total"] = elapsed()
+                events.put(("summary", {
+                    "matched_trials": matched_trials,
+                    "match_id": state.id,
+                    "complete": state.complete,
+                    "degraded": extraction.degraded,
+                    "timings": dict(timings)
+                }))
+                _record(timings)
+                logger.info(f"📡 Stream finished: {timings}")
+        except Cancelled as e:
+            record_cancelled(stage["name"], e.reason)
+            logger.info(f"🛑 Stream cancelled during {stage['name']}")
+        except SchedulerSaturated as e:
+            events.put(("error", {"error": str(e), "retry_after": e.retry_after}))
+        except Exception as e:
+            logger.exception("❌ Unhandled exception in streamed /process")
+            events.put(("error", {"error": str(e)}))
+        finally:
+            events.put(_DONE)
+
+    # The worker thread keeps the caller's LLM priority class and user
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name="process-stream", daemon=True).start()
+    finished = False
+    try:
+        while True:
+            try:
+                item = events.get(timeout=STREAM_KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if item is _DONE:
+                finished = True
+                return
+            yield format_sse(*item)
+    finally:
+        if not finished:
+            # Closed before the end: the client went away
+            token.cancel("client_disconnected")
+
+
+def get_stream_stats() -> Dict[str, Any]:
+    """Average time to features, to first trial result and to completion."""
+    with _stats_lock:
+        stats = dict(_stats)
+    streams = stats["streams"] or 1
+    for key in ("features_seconds", "first_result_seconds", "total_seconds"):
+        stats["avg_" + key] = round(stats[key] / streams, 3)
+    return stats
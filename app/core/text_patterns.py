@@ -0,0 +1,113 @@
+"""
+Single-pass multi-pattern matching for the rule-based feature extractor.
+
+``TermMatcher`` compiles a vocabulary into one case-insensitive, trie-shaped
+alternation inside a lookahead, so a single scan of the text reports every
+occurrence of every term, overlapping ones included (the output of an
+Aho-Corasick automaton, produced by the C regex engine).  ``Sentences``
+indexes the periods of a text once, so each hit maps in O(log n) to the
+period-delimited sentence that the legacy ``[^.]*term[^.]*\\.`` patterns
+captured.
+"""
+
+import re
+import bisect
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+WORD_BOUNDARY = re.compile(r"\b")
+_PERIOD = re.compile(r"\.")
+
+
+class TermMatcher:
+    """All case-insensitive occurrences of a fixed set of terms, in one pass."""
+
+    def __init__(self, terms: Sequence[str]):
+        self.terms = list(dict.fromkeys(terms))
+        lowered = [term.lower() for term in self.terms]
+        self._by_lowered: Dict[str, List[int]] = {}
+        for index, term in enumerate(lowered):
+            self._by_lowered.setdefault(term, []).append(index)
+        # The alternation is shaped as a trie, so each position costs one
+        # branch per character; the greedy trie reports the longest term...
+        self._pattern = re.compile(f"(?=({trie_regex(lowered)}))", re.IGNORECASE)
+        # ...and the shorter terms it starts with match there too
+        self._prefixes = [
+            [j for j in range(len(self.terms)) if lowered[j] != lowered[i] and lowered[i].startswith(lowered[j])]
+            for i in range(len(self.terms))
+        ]
+
+    def _resolve(self, matched: str) -> List[int]:
+        indexes = self._by_lowered.get(matched.lower())
+        if indexes is None:
+            # Case-folding corner cases (e.g. the Kelvin sign) that lower() does not map
+            indexes = [i for i, term in enumerate(self.terms)
+                       if re.fullmatch(re.escape(term), matched, re.IGNORECASE)]
+            self._by_lowered[matched.lower()] = indexes
+        return indexes
+
+    def find_all(self, text: str) -> Dict[str, List[int]]:
+        """Start offsets of every term in ``text``, in increasing order."""
+        hits: Dict[str, List[int]] = {term: [] for term in self.terms}
+        for match in self._pattern.finditer(text):
+            position = match.start()
+            indexes = self._resolve(match.group(1))
+            for index in indexes:
+                hits[self.terms[index]].append(position)
+            for prefix in self._prefixes[indexes[0]]:
+                hits[self.terms[prefix]].append(position)
+        return hits
+
+
+def trie_regex(terms: Sequence[str]) -> str:
+    """
+    Regex alternation of ``terms`` shaped as a trie (shared prefixes are
+    factored out); being greedy, it tries the longest term first.
+    """
+    trie: Dict[str, Any] = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return _trie_pattern(trie)
+
+
+def _trie_pattern(node: Dict[str, Any]) -> str:
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return f"(?:{pattern})?" if "" in node else pattern
+
+
+class Sentences:
+    """Period positions of a text, for mapping offsets to sentences."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.periods = [match.start() for match in _PERIOD.finditer(text)]
+
+    def around(self, position: int) -> Optional[Tuple[int, int]]:
+        """
+        ``(start, end)`` of the sentence holding ``position``: from just after
+        the previous period to the next period included.  None when no period
+        follows, as the legacy patterns then do not match.
+        """
+        index = bisect.bisect_left(self.periods, position)
+        if index == len(self.periods):
+            return None
+        start = self.periods[index - 1] + 1 if index else 0
+        return start, self.periods[index] + 1
+
+    def containing(self, positions: Sequence[int]) -> List[Tuple[int, int]]:
+        """Distinct sentences holding any of ``positions`` (sorted), in text order."""
+        spans: List[Tuple[int, int]] = []
+        for position in positions:
+            span = self.around(position)
+            if span is not None and (not spans or spans[-1] != span):
+                spans.append(span)
+        return spans
+
+
+def at_word_boundary(text: str, position: int) -> bool:
+    return WORD_BOUNDARY.match(text, position) is not None
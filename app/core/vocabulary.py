@@ -0,0 +1,162 @@
+"""
+Clinical vocabulary normalization.
+
+Free-text values ("EGFR ex19del", "osimertinib (Tagrisso)", "adenocarcinoma
+polmonare") are mapped to canonical codes (EGFR_EX19DEL, OSIMERTINIB, LUAD)
+using the bundled English/Italian synonym dictionary.  The synonyms are
+compiled into a single trie-shaped regex (see ``trie_regex``), so a lookup
+is one left-to-right scan reporting the longest synonym at each position;
+only the compiled pattern and a synonym → code map are kept in memory.  The
+dictionary is loaded on first use.
+
+Patient features get a ``concepts`` entry at extraction time, trials at
+ingest (``scripts/trials_manager.py``) or lazily for catalogs ingested
+before; the candidate pre-filter compares the two.
+"""
+
+import os
+import re
+import json
+import logging
+import threading
+import unicodedata
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.core.criteria import split_eligibility
+from app.core.fingerprint import content_hash
+from app.core.text_patterns import trie_regex
+
+logger = logging.getLogger(__name__)
+
+CLINICAL_VOCABULARY_PATH = os.getenv(
+    "CLINICAL_VOCABULARY_PATH", os.path.join(os.path.dirname(__file__), "clinical_synonyms.json"))
+CATEGORIES = ("histology", "biomarker", "treatment")
+TRIAL_CONCEPT_CACHE_SIZE = 4096
+
+_SEPARATORS = re.compile(r"[^0-9a-z]+")
+# Feature fields whose values are normalized
+_FEATURE_FIELDS = ("diagnosis", "mutations", "previous_treatments")
+
+
+def fold(text: str) -> str:
+    """Lower-cased, accent-free text with every run of punctuation and spaces as one space."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    return _SEPARATORS.sub(" ", text).strip()
+
+
+class ClinicalVocabulary:
+    """Synonym → canonical code lookup with leftmost-longest matching."""
+
+    def __init__(self, concepts: Dict[str, Dict[str, List[str]]], parents: Dict[str, str] = None):
+        self._codes: Dict[str, Tuple[str, str]] = {}
+        for category, entries in concepts.items():
+            for code, synonyms in entries.items():
+                for synonym in synonyms:
+                    key = fold(synonym)
+                    if key and self._codes.setdefault(key, (category, code)) != (category, code):
+                        logger.warning(f"⚠️ Synonym '{synonym}' already maps to {self._codes[key][1]}, ignored for {code}")
+        self.parents = dict(parents or {})
+        # Synonyms match whole words of the folded text, which is padded with spaces
+        self._pattern = re.compile(f"(?<= )(?:{trie_regex(sorted(self._codes))})(?= )")
+
+    @classmethod
+    def load(cls, path: str = CLINICAL_VOCABULARY_PATH) -> "ClinicalVocabulary":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        vocabulary = cls(data.get("concepts", {}), data.get("parents", {}))
+        logger.info(f"📚 Clinical vocabulary loaded: {len(vocabulary)} synonyms from {path}")
+        return vocabulary
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def find(self, text: str) -> List[Tuple[str, str]]:
+        """``(category, code)`` of every longest synonym match in ``text``, left to right."""
+        if not text:
+            return []
+        return [self._codes[match.group(0)] for match in self._pattern.finditer(f" {fold(text)} ")]
+
+    def normalize(self, value: str, category: Optional[str] = None) -> List[str]:
+        """Distinct codes mentioned by ``value``, optionally restricted to one category."""
+        codes = [code for found, code in self.find(value) if category is None or found == category]
+        return list(dict.fromkeys(codes))
+
+    def expand(self, codes: Iterable[str]) -> List[str]:
+        """``codes`` followed by their ancestors (EGFR_EX19DEL → EGFR, LUAD → NSCLC)."""
+        expanded = []
+        for code in codes:
+            while code and code not in expanded:
+                expanded.append(code)
+                code = self.parents.get(code)
+        return expanded
+
+    def concepts(self, texts: Iterable[str]) -> Dict[str, List[str]]:
+        """Codes mentioned by ``texts``, grouped by category."""
+        grouped: Dict[str, List[str]] = {category: [] for category in CATEGORIES}
+        for text in texts:
+            for category, code in self.find(text):
+                codes = grouped.setdefault(category, [])
+                if code not in codes:
+                    codes.append(code)
+        return grouped
+
+
+_vocabulary: Optional[ClinicalVocabulary] = None
+_vocabulary_lock = threading.Lock()
+_trial_concepts: Dict[str, Dict[str, List[str]]] = {}
+_trial_concepts_lock = threading.Lock()
+
+
+def get_vocabulary() -> ClinicalVocabulary:
+    global _vocabulary
+    if _vocabulary is None:
+        with _vocabulary_lock:
+            if _vocabulary is None:
+                _vocabulary = ClinicalVocabulary.load()
+    return _vocabulary
+
+
+def _texts(value: Any) -> List[str]:
+    if isinstance(value, dict) and "value" in value:
+        value = value["value"]
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [text for item in value for text in _texts(item)]
+    return []
+
+
+def feature_concepts(features: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Canonical codes of the patient's diagnosis, mutations and previous treatments."""
+    return get_vocabulary().concepts(text for field in _FEATURE_FIELDS for text in _texts(features.get(field)))
+
+
+def annotate_features(features: Dict[str, Any]) -> Dict[str, Any]:
+    """Feature post-processing: adds the ``concepts`` entry."""
+    if not isinstance(features, dict) or not features:
+        return features
+    features["concepts"] = feature_concepts(features)
+    return features
+
+
+def trial_concepts(trial: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Codes of what a trial targets (title, summary and inclusion criteria;
+    exclusion criteria name what it does not).  Uses the ``concepts``
+    stored at ingest, computing and caching them for older catalogs.
+    """
+    if isinstance(trial.get("concepts"), dict):
+        return trial["concepts"]
+    key = content_hash(trial)
+    with _trial_concepts_lock:
+        cached = _trial_concepts.get(key)
+    if cached is not None:
+        return cached
+    inclusion, _ = split_eligibility(trial)
+    concepts = get_vocabulary().concepts([trial.get("title", ""), trial.get("description", "")] + inclusion)
+    with _trial_concepts_lock:
+        if len(_trial_concepts) >= TRIAL_CONCEPT_CACHE_SIZE:
+            _trial_concepts.clear()
+        _trial_concepts[key] = concepts
+    return concepts
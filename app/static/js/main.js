@@ -12,11 +12,18 @@ document.addEventListener('DOMContentLoaded', function() {
     const processButton = document.getElementById('process-button');
     const resultsSection = document.getElementById('results-section');
     const featuresContainer = document.getElementById('features-container');
+    const sourceTextContainer = document.getElementById('source-text-container');
     const matchesContainer = document.getElementById('matches-container');
+    const rematchButton = document.getElementById('rematch-button');
     const loadingSpinner = document.getElementById('loading-spinner');
     const alertContainer = document.getElementById('alert-container');
 
     let selectedFile = null;
+    // Features of the displayed patient and the explanations already fetched for them
+    let currentFeatures = null;
+    let explanations = {};
+    // Match state on the server, re-ranked incrementally when features are edited
+    let currentMatchId = null;
 
     // Handle file selection
     if (fileInput) {
@@ -27,6 +34,10 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    if (rematchButton) {
+        rematchButton.addEventListener('click', rematchEditedFeatures);
+    }
+
     // Dropzone for drag-and-drop file upload
     if (dropzone) {
         ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
@@ -73,6 +84,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (fileInput) fileInput.value = '';
         if (textInput) textInput.value = '';
         if (featuresContainer) featuresContainer.innerHTML = '';
+        if (sourceTextContainer) sourceTextContainer.innerHTML = '';
         if (matchesContainer) matchesContainer.innerHTML = '';
         if (resultsSection) resultsSection.classList.add('d-none');
         if (processButton) processButton.disabled = true;
@@ -94,6 +106,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (loadingSpinner) loadingSpinner.classList.remove('d-none');
         if (resultsSection) resultsSection.classList.add('d-none');
         if (featuresContainer) featuresContainer.innerHTML = '';
+        if (sourceTextContainer) sourceTextContainer.innerHTML = '';
         if (matchesContainer) matchesContainer.innerHTML = '';
 
         const formData = new FormData();
@@ -104,18 +117,17 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         try {
-            const response = await fetch('/process', {
+            const response = await fetch('/process/stream', {
                 method: 'POST',
                 body: formData
             });
 
-            const data = await response.json();
-            if (response.ok) {
-                displayResults(data);
-                resultsSection.classList.remove('d-none');
-            } else {
+            if (!response.ok) {
+                const data = await response.json();
                 showAlert(data.error || 'An error occurred while processing the document.', 'danger');
+                return;
             }
+            await readStream(response);
         } catch (error) {
             showAlert('An error occurred while processing the document.', 'danger');
         } finally {
@@ -123,14 +135,133 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Read the server-sent events of /process/stream and render them as they arrive
+    async function readStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        const trials = {};
+        let buffer = '';
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+            for (const frame of frames) {
+                const event = (frame.match(/^event: (.*)$/m) || [])[1];
+                const data = (frame.match(/^data: (.*)$/m) || [])[1];
+                if (!event || !data) continue;
+                handleStreamEvent(event, JSON.parse(data), trials);
+            }
+        }
+    }
+
+    function handleStreamEvent(event, data, trials) {
+        if (event === 'features') {
+            displayFeatures(data.features);
+            displaySourceText(data.text_highlighted);
+            if (data.degraded) {
+                showAlert('The LLM did not answer in time: features were extracted with the rule-based fallback, please review them.', 'warning');
+            }
+            if (matchesContainer) matchesContainer.innerHTML = '<p>Evaluating trials...</p>';
+            if (resultsSection) resultsSection.classList.remove('d-none');
+            if (loadingSpinner) loadingSpinner.classList.add('d-none');
+        } else if (event === 'trial') {
+            // A final evaluation replaces the provisional screening result of the same trial
+            trials[data.result.trial_id] = data.result;
+            displayMatches(Object.values(trials).sort((a, b) => b.match_score - a.match_score));
+        } else if (event === 'summary') {
+            currentMatchId = data.match_id || null;
+            displayMatches(data.matched_trials);
+            if (data.match_id && data.complete === false) {
+                finishRemainingTrials(data.match_id);
+            }
+        } else if (event === 'error') {
+            showAlert(data.error || 'An error occurred while processing the document.', 'danger');
+        }
+    }
+
     // Display the extracted features and matched trials
     function displayResults(data) {
         displayFeatures(data.features);
+        displaySourceText(data.text_highlighted);
         displayMatches(data.matched_trials);
+        currentMatchId = data.match_id || null;
+        if (data.match_id && data.complete === false) {
+            finishRemainingTrials(data.match_id);
+        }
+    }
+
+    // Re-rank after the clinician corrects features: only trials reading the edited fields are re-evaluated
+    async function rematchEditedFeatures() {
+        if (!currentMatchId || !featuresContainer) return;
+        const features = {};
+        try {
+            featuresContainer.querySelectorAll('.feature-value').forEach(element => {
+                features[element.dataset.field] = JSON.parse(element.textContent);
+            });
+        } catch (error) {
+            showAlert('Edited features must be valid JSON values.', 'danger');
+            return;
+        }
+
+        rematchButton.disabled = true;
+        try {
+            const response = await fetch(`/api/matches/${currentMatchId}/features`, {
+                method: 'PATCH',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ features: features })
+            });
+            const data = await response.json();
+            if (!response.ok) {
+                showAlert(data.error || 'Unable to update the matches.', 'danger');
+                return;
+            }
+            displayFeatures(data.features);
+            displayMatches(data.matched_trials);
+            showAlert(`Updated ${data.changed.join(', ') || 'no fields'}: ${data.reevaluated.length} trials re-evaluated, ${data.reused} reused.`, 'info');
+            if (data.complete === false) {
+                finishRemainingTrials(data.match_id);
+            }
+        } catch (error) {
+            showAlert('Unable to update the matches.', 'danger');
+        } finally {
+            rematchButton.disabled = false;
+        }
+    }
+
+    // Trials not evaluated within the time budget are finished in background
+    async function finishRemainingTrials(matchId) {
+        showAlert('Some trials were not evaluated in time, finishing them in background...', 'info');
+        try {
+            await fetch(`/api/matches/${matchId}/continue`, { method: 'POST' });
+            const poll = setInterval(async () => {
+                const response = await fetch(`/api/matches/${matchId}`);
+                if (!response.ok) {
+                    clearInterval(poll);
+                    return;
+                }
+                const data = await response.json();
+                displayMatches(data.matched_trials);
+                if (data.complete || !data.running) clearInterval(poll);
+            }, 3000);
+        } catch (error) {
+            showAlert('Unable to finish the remaining trials.', 'danger');
+        }
+    }
+
+    // Display the note with the grounded feature sources highlighted (server-escaped HTML)
+    function displaySourceText(highlighted) {
+        if (!sourceTextContainer) return;
+        sourceTextContainer.innerHTML = highlighted || '';
     }
 
     // Display extracted features
     function displayFeatures(features) {
+        currentFeatures = features;
+        explanations = {};
         if (!featuresContainer) return;
         featuresContainer.innerHTML = '';
 
@@ -145,6 +276,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const featureValue = document.createElement('div');
             featureValue.className = 'feature-value';
             featureValue.textContent = JSON.stringify(value, null, 2);
+            featureValue.dataset.field = key;
+            featureValue.contentEditable = key !== 'concepts';
 
             featureDiv.appendChild(featureLabel);
             featureDiv.appendChild(featureValue);
@@ -168,9 +301,10 @@ document.addEventListener('DOMContentLoaded', function() {
 
             matchCard.innerHTML = `
                 <h4>Trial ID: ${match.trial_id}</h4>
-                <p><strong>Confidence:</strong> ${match.confidence}%</p>
+                <p><strong>Confidence:</strong> ${match.match_score ?? match.confidence}%</p>
                 <p><strong>Recommendation:</strong> ${match.recommendation}</p>
                 <p><strong>Summary:</strong> ${match.summary}</p>
+                ${match.pending_final ? '<p class="text-muted"><em>Provisional score: the final check has not run yet.</em></p>' : ''}
             `;
 
             // Criteria Analysis (optional)
@@ -191,10 +325,109 @@ document.addEventListener('DOMContentLoaded', function() {
                 matchCard.appendChild(analysisDiv);
             }
 
+            if (match.stage !== 'not_evaluated') {
+                appendExplanationToggle(matchCard, match);
+            }
+
             matchesContainer.appendChild(matchCard);
         });
     }
 
+    // The detailed analysis is generated only when a trial is expanded
+    function appendExplanationToggle(matchCard, match) {
+        const trialId = match.trial_id;
+        const button = document.createElement('button');
+        button.className = 'btn btn-sm btn-outline-primary';
+        button.textContent = 'Show explanation';
+        const explanationDiv = document.createElement('div');
+        explanationDiv.className = 'match-explanation d-none';
+        matchCard.appendChild(button);
+        matchCard.appendChild(explanationDiv);
+
+        button.addEventListener('click', async () => {
+            if (!explanationDiv.classList.contains('d-none')) {
+                explanationDiv.classList.add('d-none');
+                button.textContent = 'Show explanation';
+                return;
+            }
+            button.disabled = true;
+            button.textContent = 'Generating explanation...';
+            try {
+                if (!explanations[trialId]) {
+                    const response = await fetch(`/api/trials/${encodeURIComponent(trialId)}/explanation`, {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({
+                            features: currentFeatures,
+                            match: { match_score: match.match_score, recommendation: match.recommendation }
+                        })
+                    });
+                    const data = await response.json();
+                    if (!response.ok) throw new Error(data.error || 'Unable to generate the explanation.');
+                    explanations[trialId] = data.explanation;
+                }
+                renderExplanation(explanationDiv, explanations[trialId]);
+                explanationDiv.classList.remove('d-none');
+                button.textContent = 'Hide explanation';
+            } catch (error) {
+                showAlert(error.message, 'danger');
+                button.textContent = 'Show explanation';
+            } finally {
+                button.disabled = false;
+            }
+        });
+    }
+
+    function renderExplanation(container, explanation) {
+        container.innerHTML = '';
+        const addSection = (title, items, format) => {
+            if (!items || items.length === 0) return;
+            const heading = document.createElement('h5');
+            heading.textContent = title;
+            const list = document.createElement('ul');
+            items.forEach(item => {
+                const entry = document.createElement('li');
+                entry.textContent = format ? format(item) : item;
+                list.appendChild(entry);
+            });
+            container.appendChild(heading);
+            container.appendChild(list);
+        };
+
+        // The detailed analysis is a separate judgement: show its own verdict
+        const verdict = document.createElement('p');
+        verdict.innerHTML = '<strong>Detailed analysis:</strong> ';
+        verdict.appendChild(document.createTextNode(`${explanation.match_score}%, ${explanation.recommendation}`));
+        container.appendChild(verdict);
+        if (explanation.mismatch) {
+            const note = document.createElement('p');
+            note.className = 'text-warning';
+            note.textContent = `This analysis disagrees with the match result above (${explanation.shown_score}%, ` +
+                `${explanation.shown_recommendation}): review the criteria before relying on either.`;
+            container.appendChild(note);
+        }
+
+        const summary = document.createElement('p');
+        summary.textContent = explanation.patient_summary || '';
+        container.appendChild(summary);
+
+        const analysis = explanation.criteria_analysis || {};
+        addSection('Inclusion criteria', analysis.inclusion_criteria,
+            c => `${c.met ? '✅' : '❌'} ${c.criterion}: ${c.explanation || ''}`);
+        addSection('Exclusion criteria', analysis.exclusion_criteria,
+            c => `${c.violated ? '❌' : '✅'} ${c.criterion}: ${c.explanation || ''}`);
+        const factors = explanation.key_factors || {};
+        addSection('Supporting factors', factors.supporting);
+        addSection('Opposing factors', factors.opposing);
+        addSection('Uncertain areas', explanation.uncertainty_areas);
+        addSection('Next steps', explanation.next_steps);
+        if (explanation.patient_guidance) {
+            const guidance = document.createElement('p');
+            guidance.textContent = explanation.patient_guidance;
+            container.appendChild(guidance);
+        }
+    }
+
     // Show alert message
     function showAlert(message, type = 'info') {
         if (!alertContainer) return;
@@ -9,6 +9,8 @@ import time
 import shutil
 from datetime import datetime, timedelta
 from flask import current_app
+from app.core.cancellation import check_cancelled
+from app.core.text_patterns import TermMatcher, Sentences, at_word_boundary
 
 def extract_text_from_pdf(pdf_stream):
     """
@@ -24,6 +26,8 @@ def extract_text_from_pdf(pdf_stream):
     try:
         with pdfplumber.open(pdf_stream) as pdf:
             for page in pdf.pages:
+                # Stop between pages once the request is abandoned
+                check_cancelled()
                 text += (page.extract_text() or "") + "\n"
         return text.strip()
     except Exception as e:
@@ -388,6 +392,11 @@ def basic_feature_extraction(text):
     - Trattamenti oncologici precedenti
     - Valori di laboratorio comuni
 
+    I termini dei vocabolari sono cercati tutti insieme in un'unica scansione
+    del testo (vedi ``app.core.text_patterns``) e ogni occorrenza viene
+    ricondotta alla propria frase tramite l'indice dei punti; il risultato è
+    identico a quello della vecchia ricerca regex termine per termine.
+
     Args:
         text: Il testo da analizzare
 
@@ -410,185 +419,89 @@ def basic_feature_extraction(text):
     features["original_text"] = text
 
     # Basic age extraction
-    age_match = re.search(r'(\d+)[\s-]*(?:year|yr)s?[\s-]*old', text, re.IGNORECASE)
+    age_match = _AGE_PATTERN.search(text)
     if age_match:
         features["age"]["value"] = int(age_match.group(1))
         features["age"]["source"] = age_match.group(0)
 
     # Basic gender extraction
-    if re.search(r'\b(male|man)\b', text, re.IGNORECASE):
+    if _MALE_PATTERN.search(text):
         features["gender"]["value"] = "male"
         features["gender"]["source"] = "male reference in text"
-    elif re.search(r'\b(female|woman)\b', text, re.IGNORECASE):
+    elif _FEMALE_PATTERN.search(text):
         features["gender"]["value"] = "female"
         features["gender"]["source"] = "female reference in text"
 
+    # Un'unica scansione per tutti i termini dei vocabolari
+    hits = _FEATURE_TERMS.find_all(text)
+    sentences = Sentences(text)
+
     # Basic diagnosis patterns
-    cancer_types = [
-        "lung cancer", "breast cancer", "colorectal cancer", "prostate cancer",
-        "melanoma", "leukemia", "lymphoma", "pancreatic cancer", "ovarian cancer",
-        "non-small cell lung cancer", "NSCLC", "small cell lung cancer", "SCLC",
-        "glioblastoma", "glioma", "hepatocellular carcinoma", "HCC"
-    ]
-
-    for cancer in cancer_types:
-        if cancer.lower() in text.lower():
+    lowered = text.lower()
+    for cancer in _CANCER_TYPES:
+        if cancer.lower() in lowered:
             features["diagnosis"]["value"] = cancer
 
             # Try to find a more precise context
-            context_match = re.search(r'([^.]*' + re.escape(cancer) + r'[^.]*\.)', text, re.IGNORECASE)
-            if context_match:
-                features["diagnosis"]["source"] = context_match.group(1).strip()
+            span = sentences.around(hits[cancer][0]) if hits[cancer] else None
+            if span:
+                features["diagnosis"]["source"] = text[span[0]:span[1]].strip()
             else:
                 features["diagnosis"]["source"] = f"contains '{cancer}'"
 
             break
 
     # Stage extraction
-    stage_match = re.search(r'stage\s+(I{1,3}V?|IV|III|II|I)([A-C])?', text, re.IGNORECASE)
+    stage_match = _STAGE_PATTERN.search(text)
     if stage_match:
         features["stage"]["value"] = stage_match.group(1) + (stage_match.group(2) or "")
         features["stage"]["source"] = stage_match.group(0)
 
     # ECOG extraction
-    ecog_match = re.search(r'ECOG\s*(?:PS|performance status)?\s*(?:of|:)?\s*([0-4])', text, re.IGNORECASE)
+    ecog_match = _ECOG_PATTERN.search(text)
     if ecog_match:
         features["ecog"]["value"] = int(ecog_match.group(1))
         features["ecog"]["source"] = ecog_match.group(0)
 
     # Common mutations
-    mutations = [
-        "EGFR", "ALK", "ROS1", "BRAF V600E", "KRAS", "HER2", "BRCA1", "BRCA2", 
-        "PD-L1", "MSI-H", "dMMR", "NTRK", "RET", "MET"
-    ]
-
-    # Tracciamo le mutazioni già trovate per evitare duplicati
-    found_mutations = set()
-
-    for mutation in mutations:
-        # Se la mutazione è già stata trovata, saltiamo
-        if mutation in found_mutations:
-            continue
-
-        pattern = r'([^.]*\b' + re.escape(mutation) + r'\b[^.]*\.)'
-        best_match = None
-        best_match_text = ""
-
-        # Cerchiamo tutte le occorrenze e manteniamo la migliore (quella con più informazioni)
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            match_text = match.group(0).strip()
-
-            # Se è la prima occorrenza o è più informativa della precedente
-            if best_match is None or len(match_text) > len(best_match_text):
-                # Controlliamo se contiene termini specifici come "mutazione" o "mut" che indicano informazioni più specifiche
-                specificity_terms = ["mutazione", "mut ", "mut:", "mutation", "alterazione", "delezione", "inserzione", "traslocazione"]
-                current_specificity = any(term in match_text.lower() for term in specificity_terms)
-                previous_specificity = any(term in best_match_text.lower() for term in specificity_terms) if best_match_text else False
-
-                # Se la nuova è più specifica o la precedente non era specifica
-                if current_specificity or not previous_specificity:
-                    best_match = match
-                    best_match_text = match_text
-
-        # Se abbiamo trovato almeno un'occorrenza per questa mutazione
-        if best_match is not None:
-            features["mutations"].append({
-                "value": mutation,
-                "source": best_match_text
-            })
-            found_mutations.add(mutation)
-
-    # Common metastasis sites
-    metastasis_sites = [
-        "brain", "liver", "bone", "lung", "adrenal", "lymph node", 
-        "peritoneal", "pleural", "skin"
-    ]
-
-    # Tracciamo i siti metastatici già trovati per evitare duplicati
-    found_metastases = set()
-
-    for site in metastasis_sites:
-        # Se il sito è già stato trovato, saltiamo
-        if site in found_metastases:
-            continue
-
-        pattern = r'([^.]*\b' + re.escape(site) + r'(?:\s+metastases|\s+metastasis|\s+lesions|\s+mets|\s+spread)[^.]*\.)'
-        best_match = None
-        best_match_text = ""
-
-        # Cerchiamo tutte le occorrenze e manteniamo la migliore (quella con più informazioni)
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            match_text = match.group(0).strip()
-
-            # Se è la prima occorrenza o è più informativa della precedente
-            if best_match is None or len(match_text) > len(best_match_text):
-                best_match = match
-                best_match_text = match_text
-
-        # Se abbiamo trovato almeno un'occorrenza per questo sito metastatico
-        if best_match is not None:
-            features["metastases"].append({
-                "value": site,
-                "source": best_match_text
-            })
-            found_metastases.add(site)
-
-    # Common treatments
-    treatments = [
-        "chemotherapy", "radiation", "surgery", "immunotherapy", 
-        "carboplatin", "cisplatin", "paclitaxel", "docetaxel", "pembrolizumab",
-        "nivolumab", "atezolizumab", "durvalumab", "trastuzumab", "osimertinib",
-        "erlotinib", "gefitinib", "crizotinib", "alectinib", "cetuximab"
-    ]
-
-    # Tracciamo i trattamenti già trovati per evitare duplicati
-    found_treatments = set()
-
-    for treatment in treatments:
-        # Se il trattamento è già stato trovato, saltiamo
-        if treatment in found_treatments:
-            continue
-
-        pattern = r'([^.]*\b(?:previous|prior|received|treated with|therapy with)\s[^.]*\b' + re.escape(treatment) + r'\b[^.]*\.)'
-        best_match = None
-        best_match_text = ""
-
-        # Cerchiamo tutte le occorrenze e manteniamo la migliore
-        for match in re.finditer(pattern, text, re.IGNORECASE):
-            match_text = match.group(0).strip()
-
-            # Se è la prima occorrenza o è più informativa della precedente
-            if best_match is None or len(match_text) > len(best_match_text):
-                # Controlliamo se contiene termini specifici come "cicli" o "dosaggio" che indicano informazioni più specifiche
-                specificity_terms = ["cicli", "ciclo", "dose", "dosaggio", "mg", "gr", "effetti collaterali", "tossicità"]
-                current_specificity = any(term in match_text.lower() for term in specificity_terms)
-                previous_specificity = any(term in best_match_text.lower() for term in specificity_terms) if best_match_text else False
-
-                # Se la nuova è più specifica o la precedente non era specifica
-                if current_specificity or not previous_specificity:
-                    best_match = match
-                    best_match_text = match_text
-
-        # Se abbiamo trovato almeno un'occorrenza per questo trattamento
-        if best_match is not None:
-            features["previous_treatments"].append({
-                "value": treatment,
-                "source": best_match_text
-            })
-            found_treatments.add(treatment)
+    for mutation in _MUTATIONS:
+        positions = [p for p in hits[mutation] if _bounded(text, p, mutation)]
+        source = _best_sentence(text, sentences.containing(positions), _MUTATION_SPECIFICITY)
+        if source is not None:
+            features["mutations"].append({"value": mutation, "source": source})
+
+    # Common metastasis sites: il termine deve essere seguito da "metastases", "lesions", ...
+    for site in _METASTASIS_SITES:
+        positions = [
+            p for p in hits[site]
+            if at_word_boundary(text, p) and _METASTASIS_SUFFIX.match(text, p + len(site))
+        ]
+        source = _best_sentence(text, sentences.containing(positions))
+        if source is not None:
+            features["metastases"].append({"value": site, "source": source})
+
+    # Common treatments: nella stessa frase deve comparire prima "previous", "prior", "received", ...
+    first_allowed = {}
+    for trigger in _TREATMENT_TRIGGERS:
+        for p in hits[trigger]:
+            end = p + len(trigger)
+            span = sentences.around(p)
+            if span and at_word_boundary(text, p) and _WHITESPACE.match(text, end):
+                first_allowed[span[0]] = min(first_allowed.get(span[0], end + 1), end + 1)
+
+    for treatment in _TREATMENTS:
+        positions = []
+        for p in hits[treatment]:
+            span = sentences.around(p)
+            if span and first_allowed.get(span[0], p + 1) <= p and _bounded(text, p, treatment):
+                positions.append(p)
+        source = _best_sentence(text, sentences.containing(positions), _TREATMENT_SPECIFICITY)
+        if source is not None:
+            features["previous_treatments"].append({"value": treatment, "source": source})
 
     # Common lab values
-    lab_tests = {
-        "hemoglobin": r'(?:Hgb|Hemoglobin|Hb)[\s:]+(\d+\.?\d*)\s*(?:g/dL|g/dl)',
-        "wbc": r'(?:WBC|White blood cells?)[\s:]+(\d+\.?\d*)\s*(?:K/μL|x10\^9/L)',
-        "platelets": r'(?:PLT|Platelets)[\s:]+(\d+\.?\d*)\s*(?:K/μL|x10\^9/L)',
-        "creatinine": r'(?:Cr|Creatinine)[\s:]+(\d+\.?\d*)\s*(?:mg/dL|mg/dl)',
-        "alt": r'(?:ALT|SGPT)[\s:]+(\d+\.?\d*)\s*(?:U/L|IU/L)',
-        "ast": r'(?:AST|SGOT)[\s:]+(\d+\.?\d*)\s*(?:U/L|IU/L)'
-    }
-
-    for lab_name, pattern in lab_tests.items():
-        match = re.search(pattern, text, re.IGNORECASE)
+    for lab_name, pattern in _LAB_PATTERNS.items():
+        match = pattern.search(text)
         if match:
             features["lab_values"][lab_name] = {
                 "value": match.group(0),
@@ -597,6 +510,83 @@ def basic_feature_extraction(text):
 
     return features
 
+
+def _bounded(text, position, term):
+    """Equivalente di ``\\b`` + termine + ``\\b`` all'offset dato."""
+    return at_word_boundary(text, position) and at_word_boundary(text, position + len(term))
+
+
+def _best_sentence(text, spans, specificity_terms=None):
+    """
+    Sceglie tra le frasi trovate quella con più informazioni (la più lunga),
+    preferendo quelle che contengono termini specifici; None se non ce ne sono.
+    """
+    best_text = None
+    for start, end in spans:
+        match_text = text[start:end].strip()
+
+        # Se è la prima occorrenza o è più informativa della precedente
+        if best_text is None or len(match_text) > len(best_text):
+            if specificity_terms is None:
+                best_text = match_text
+                continue
+            current_specificity = any(term in match_text.lower() for term in specificity_terms)
+            previous_specificity = any(term in best_text.lower() for term in specificity_terms) if best_text else False
+
+            # Se la nuova è più specifica o la precedente non era specifica
+            if current_specificity or not previous_specificity:
+                best_text = match_text
+    return best_text
+
+
+_AGE_PATTERN = re.compile(r'(\d+)[\s-]*(?:year|yr)s?[\s-]*old', re.IGNORECASE)
+_MALE_PATTERN = re.compile(r'\b(male|man)\b', re.IGNORECASE)
+_FEMALE_PATTERN = re.compile(r'\b(female|woman)\b', re.IGNORECASE)
+_STAGE_PATTERN = re.compile(r'stage\s+(I{1,3}V?|IV|III|II|I)([A-C])?', re.IGNORECASE)
+_ECOG_PATTERN = re.compile(r'ECOG\s*(?:PS|performance status)?\s*(?:of|:)?\s*([0-4])', re.IGNORECASE)
+_METASTASIS_SUFFIX = re.compile(r'(?:\s+metastases|\s+metastasis|\s+lesions|\s+mets|\s+spread)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s')
+
+_CANCER_TYPES = [
+    "lung cancer", "breast cancer", "colorectal cancer", "prostate cancer",
+    "melanoma", "leukemia", "lymphoma", "pancreatic cancer", "ovarian cancer",
+    "non-small cell lung cancer", "NSCLC", "small cell lung cancer", "SCLC",
+    "glioblastoma", "glioma", "hepatocellular carcinoma", "HCC"
+]
+
+_MUTATIONS = [
+    "EGFR", "ALK", "ROS1", "BRAF V600E", "KRAS", "HER2", "BRCA1", "BRCA2",
+    "PD-L1", "MSI-H", "dMMR", "NTRK", "RET", "MET"
+]
+
+_METASTASIS_SITES = [
+    "brain", "liver", "bone", "lung", "adrenal", "lymph node",
+    "peritoneal", "pleural", "skin"
+]
+
+_TREATMENTS = [
+    "chemotherapy", "radiation", "surgery", "immunotherapy",
+    "carboplatin", "cisplatin", "paclitaxel", "docetaxel", "pembrolizumab",
+    "nivolumab", "atezolizumab", "durvalumab", "trastuzumab", "osimertinib",
+    "erlotinib", "gefitinib", "crizotinib", "alectinib", "cetuximab"
+]
+
+_TREATMENT_TRIGGERS = ["previous", "prior", "received", "treated with", "therapy with"]
+
+_MUTATION_SPECIFICITY = ["mutazione", "mut ", "mut:", "mutation", "alterazione", "delezione", "inserzione", "traslocazione"]
+_TREATMENT_SPECIFICITY = ["cicli", "ciclo", "dose", "dosaggio", "mg", "gr", "effetti collaterali", "tossicità"]
+
+_LAB_PATTERNS = {
+    "hemoglobin": re.compile(r'(?:Hgb|Hemoglobin|Hb)[\s:]+(\d+\.?\d*)\s*(?:g/dL|g/dl)', re.IGNORECASE),
+    "wbc": re.compile(r'(?:WBC|White blood cells?)[\s:]+(\d+\.?\d*)\s*(?:K/μL|x10\^9/L)', re.IGNORECASE),
+    "platelets": re.compile(r'(?:PLT|Platelets)[\s:]+(\d+\.?\d*)\s*(?:K/μL|x10\^9/L)', re.IGNORECASE),
+    "creatinine": re.compile(r'(?:Cr|Creatinine)[\s:]+(\d+\.?\d*)\s*(?:mg/dL|mg/dl)', re.IGNORECASE),
+    "alt": re.compile(r'(?:ALT|SGPT)[\s:]+(\d+\.?\d*)\s*(?:U/L|IU/L)', re.IGNORECASE),
+    "ast": re.compile(r'(?:AST|SGOT)[\s:]+(\d+\.?\d*)\s*(?:U/L|IU/L)', re.IGNORECASE)
+}
+
+_FEATURE_TERMS = TermMatcher(_CANCER_TYPES + _MUTATIONS + _METASTASIS_SITES + _TREATMENTS + _TREATMENT_TRIGGERS)
+
 def match_trials(patient_features):
     """
     Match patient features with available clinical trials.
@@ -0,0 +1,36 @@
+"""
+Gunicorn configuration.
+
+    gunicorn -c gunicorn.conf.py main:app
+
+SERVE_MODE selects the worker model:
+  sync     one request per worker process (previous behaviour)
+  gthread  WEB_THREADS requests per process, each waiting on Ollama in its own thread
+  gevent   WEB_CONNECTIONS requests per process as greenlets; socket I/O to
+           Ollama is cooperative, so hundreds of matches can wait in one
+           process with flat memory (requires ``pip install gevent``)
+
+See scripts/benchmark_serving.py to compare the modes.
+"""
+
+import os
+
+SERVE_MODE = os.getenv("SERVE_MODE", "gthread").lower()
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_WORKERS", "2"))
+# The LLM scheduler splits its limits across the workers (see app/core/scheduler.py)
+os.environ["WEB_WORKERS"] = str(workers)
+# LLM calls can take minutes; the worker must not be killed while waiting
+timeout = int(float(os.getenv("LLM_REQUEST_TIMEOUT", "600"))) + 30
+graceful_timeout = 30
+keepalive = 5
+
+if SERVE_MODE == "gevent":
+    worker_class = "gevent"
+    worker_connections = int(os.getenv("WEB_CONNECTIONS", "1000"))
+elif SERVE_MODE == "gthread":
+    worker_class = "gthread"
+    threads = int(os.getenv("WEB_THREADS", "64"))
+else:
+    worker_class = "sync"
@@ -0,0 +1,24 @@
+"""Add canonical concept codes to clinical trials
+
+Revision ID: b7e41c2d9a10
+Revises: 611c56aaa026
+Create Date: 2026-10-18 21:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e41c2d9a10'
+down_revision = '611c56aaa026'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('clinical_trials', sa.Column('concepts', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('clinical_trials', 'concepts')
@@ -25,6 +25,7 @@ class ClinicalTrial(db.Model):
     gender = db.Column(db.String(50))
     org_study_id = db.Column(db.String(100), unique=True, nullable=False)
     secondary_ids = db.Column(JSON, default=list)
+    concepts = db.Column(JSON, default=dict)
 
     def __repr__(self):
         return f"<ClinicalTrial {self.id}: {self.title}>"
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+"""
+Offline cohort matching: a directory of PDFs or a JSONL of notes against
+the trial catalog, outside the web tier.
+
+Records flow through stages connected by bounded queues (PDF text
+extraction, LLM feature extraction, trial matching), each with its own
+worker threads, so PDF parsing overlaps with LLM calls.  Results are
+streamed to JSONL or CSV as they complete.  Extracted features are
+checkpointed next to the output: a rerun skips the records already
+written successfully, retries failed ones (the last line of an id wins)
+and resumes the others from their checkpointed features.  LLM
+calls run in the ``batch`` scheduler class, below interactive requests.
+With ``MATCH_STORE_ENABLED``, matched patients are persisted in the match
+store with their record id as patient reference.
+
+Usage:
+    python scripts/batch_match.py --input notes.jsonl --output results.jsonl
+    python scripts/batch_match.py --input clinic_pdfs/ --output results.csv --feature-workers 4
+"""
+
+import os
+import csv
+import sys
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.core.scheduler import set_llm_context
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 64
+CSV_FIELDS = ["id", "status", "failed_stage", "error", "diagnosis", "stage", "ecog", "mutations",
+              "eligible_trials", "top_trials"]
+ELIGIBLE = ("RECOMMENDED", "POTENTIALLY_ELIGIBLE")
+
+_DONE = object()
+
+
+class Stage:
+    """
+    Worker threads applying ``fn`` to the records of ``inbox`` and passing
+    them on to ``outbox``.  ``fn`` returns False when the record already
+    had the stage output (checkpoint or text input); a record that failed
+    upstream is passed through untouched.
+    """
+
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], bool], workers: int,
+                 inbox: queue.Queue, outbox: queue.Queue):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = self.skipped = self.failed = 0
+        self.busy_seconds = 0.0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._active = self.workers
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        for i in range(self.workers):
+            threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True).start()
+
+    def _run(self) -> None:
+        set_llm_context("batch", "batch_match")
+        while True:
+            record = self.inbox.get()
+            if record is _DONE:
+                with self._lock:
+                    self._active -= 1
+                    last = self._active == 0
+                    if last:
+                        self.finished_at = time.perf_counter()
+                # The last worker to stop closes the next stage; the others hand the marker on
+                (self.outbox if last else self.inbox).put(_DONE)
+                return
+            if record.get("error") is None:
+                started = time.perf_counter()
+                with self._lock:
+                    self.started_at = self.started_at or started
+                try:
+                    worked = self.fn(record) is not False
+                    outcome = "processed" if worked else "skipped"
+                except Exception as e:
+                    logger.error(f"❌ {self.name} failed for {record['id']}: {e}")
+                    record["error"] = str(e)
+                    record["failed_stage"] = self.name
+                    outcome = "failed"
+                with self._lock:
+                    setattr(self, outcome, getattr(self, outcome) + 1)
+                    self.busy_seconds += time.perf_counter() - started
+            self.outbox.put(record)
+
+    def report(self) -> Dict[str, Any]:
+        wall = (self.finished_at or time.perf_counter()) - self.started_at if self.started_at else 0.0
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "wall_seconds": round(wall, 3),
+            "per_second": round(self.processed / wall, 3) if wall else 0.0,
+        }
+
+
+def run_pipeline(records: Iterable[Dict[str, Any]], stages: List[Tuple[str, Callable, int]],
+                 sink: Callable[[Dict[str, Any]], None]) -> List[Dict[str, Any]]:
+    """Push ``records`` through the stages and hand each finished record to ``sink``; returns per-stage reports."""
+    queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in range(len(stages) + 1)]
+    running = [Stage(name, fn, workers, queues[i], queues[i + 1]) for i, (name, fn, workers) in enumerate(stages)]
+    for stage in running:
+        stage.start()
+
+    def produce():
+        for record in records:
+            queues[0].put(record)
+        queues[0].put(_DONE)
+
+    threading.Thread(target=produce, name="batch-reader", daemon=True).start()
+    while True:
+        record = queues[-1].get()
+        if record is _DONE:
+            break
+        sink(record)
+    return [stage.report() for stage in running]
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """PDFs of a directory (id = file name) or the lines of a JSONL file with ``text`` and optional ``id``."""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.lower().endswith(".pdf"):
+                yield {"id": os.path.splitext(name)[0], "path": os.path.join(path, name)}
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            note = json.loads(line)
+            yield {"id": str(note.get("id") or f"line-{number}"), "text": note.get("text", "")}
+
+
+class ResultWriter:
+    """Streams finished records to JSONL or CSV, and checkpoints extracted features."""
+
+    def __init__(self, output: str, top_k: int = 10):
+        self.output = output
+        self.format = "csv" if output.lower().endswith(".csv") else "jsonl"
+        self.top_k = top_k
+        self.checkpoint_path = output + ".checkpoint.jsonl"
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def done_ids(self) -> Set[str]:
+        """Records already written successfully, skipped on resume."""
+        if not os.path.exists(self.output):
+            return set()
+        with open(self.output, "r", encoding="utf-8", newline="") as f:
+            if self.format == "csv":
+                rows = [(row["id"], row["status"] == "ok") for row in csv.DictReader(f)]
+            else:
+                rows = [(result["id"], not result.get("error")) for result in map(json.loads, filter(str.strip, f))]
+        status = dict(rows)
+        return {record_id for record_id, ok in status.items() if ok}
+
+    def checkpoints(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        return {entry["id"]: entry["features"] for entry in entries}
+
+    def checkpoint(self, record: Dict[str, Any]) -> None:
+        with self._lock, open(self.checkpoint_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"id": record["id"], "features": record["features"]}, ensure_ascii=False) + "\n")
+
+    def _row(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        features = record.get("features") or {}
+        trials = record.get("matched_trials") or []
+        return {
+            "id": record["id"],
+            "status": "error" if record.get("error") else "ok",
+            "failed_stage": record.get("failed_stage", ""),
+            "error": record.get("error", ""),
+            "diagnosis": features.get("diagnosis", ""),
+            "stage": features.get("stage", ""),
+            "ecog": features.get("ecog", ""),
+            "mutations": "; ".join(str(m) for m in features.get("mutations") or []),
+            "eligible_trials": sum(1 for t in trials if t.get("recommendation") in ELIGIBLE),
+            "top_trials": "; ".join(f"{t['trial_id']}:{t['match_score']}" for t in trials[:self.top_k]),
+        }
+
+    def write(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            new = not os.path.exists(self.output) or os.path.getsize(self.output) == 0
+            with open(self.output, "a", encoding="utf-8", newline="") as f:
+                if self.format == "csv":
+                    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+                    if new:
+                        writer.writeheader()
+                    writer.writerow(self._row(record))
+                else:
+                    result = {key: value for key, value in record.items() if key not in ("text", "path")}
+                    result["matched_trials"] = (record.get("matched_trials") or [])[:self.top_k]
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            self.written += 1
+
+
+def build_stages(writer: ResultWriter, pdf_workers: int, feature_workers: int,
+                 match_workers: int) -> List[Tuple[str, Callable, int]]:
+    from app.core.feature_extraction import extract_text_from_pdf, extract_features_with_llm, match_trials_llm
+    from app.core.match_state import MatchState
+    from app.core.match_store import MATCH_STORE_ENABLED, patient_reference
+
+    def pdf_text(record):
+        if "text" in record or "features" in record:
+            return False
+        with open(record["path"], "rb") as f:
+            record["text"] = extract_text_from_pdf(f)
+
+    def features(record):
+        if "features" in record:
+            return False
+        if not record.get("text"):
+            raise ValueError("Empty clinical text")
+        extracted = extract_features_with_llm(record["text"])
+        if not isinstance(extracted, dict) or not extracted:
+            raise ValueError("LLM returned no features")
+        record["features"] = extracted
+        writer.checkpoint(record)
+
+    def matching(record):
+        state = MatchState(record["features"])
+        if MATCH_STORE_ENABLED:
+            state.patient_ref = patient_reference(record["id"])
+        record["matched_trials"] = match_trials_llm(record["features"], state=state)
+
+    return [("pdf_extraction", pdf_text, pdf_workers), ("feature_extraction", features, feature_workers),
+            ("matching", matching, match_workers)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Match a cohort of clinical notes against the trial catalog')
+    parser.add_argument('--input', required=True, help='Directory of PDFs or JSONL file of {"id", "text"} notes.')
+    parser.add_argument('--output', required=True, help='Results file, .jsonl or .csv (appended on resume).')
+    parser.add_argument('--pdf-workers', type=int, default=2, help='Parallel PDF text extractions.')
+    parser.add_argument('--feature-workers', type=int, default=2, help='Parallel LLM feature extractions.')
+    parser.add_argument('--match-workers', type=int, default=2, help='Parallel trial matchings.')
+    parser.add_argument('--top-k', type=int, default=10, help='Trials kept per patient in the output.')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        logger.error(f"❌ Input not found: {args.input}")
+        return 1
+
+    writer = ResultWriter(args.output, args.top_k)
+    done = writer.done_ids()
+    checkpoints = writer.checkpoints()
+    if done or checkpoints:
+        logger.info(f"♻️ Resuming: {len(done)} records already written, {len(checkpoints)} with checkpointed features")
+
+    def pending():
+        for record in read_records(args.input):
+            if record["id"] in done:
+                continue
+            if record["id"] in checkpoints:
+                record["features"] = checkpoints[record["id"]]
+            yield record
+
+    started = time.perf_counter()
+    stages = build_stages(writer, args.pdf_workers, args.feature_workers, args.match_workers)
+    report = run_pipeline(pending(), stages, writer.write)
+    elapsed = time.perf_counter() - started
+
+    print(f"{'stage':<20}{'workers':>8}{'done':>7}{'skipped':>9}{'failed':>8}{'busy s':>10}{'wall s':>10}{'rec/s':>8}")
+    for row in report:
+        print(f"{row['stage']:<20}{row['workers']:>8}{row['processed']:>7}{row['skipped']:>9}{row['failed']:>8}"
+              f"{row['busy_seconds']:>10}{row['wall_seconds']:>10}{row['per_second']:>8}")
+    print(f"{'total':<20}{'':>8}{writer.written:>7} records in {elapsed:.1f}s "
+          f"({writer.written / elapsed if elapsed else 0.0:.2f} rec/s) -> {args.output}")
+    return 0 if all(row["failed"] == 0 for row in report) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+"""
+Rule-based feature extraction on long clinical notes: the legacy per-term
+regex scan against the single-pass ``basic_feature_extraction``.
+
+Synthetic notes mix narrative sentences with period-free blocks (lab tables,
+medication lists), where ``[^.]*term[^.]*\\.`` patterns backtrack the most.
+The outputs of both implementations are compared for equality.
+
+Usage:
+    python scripts/benchmark_extraction.py --pages 100 --repeat 3
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SENTENCES = [
+    "67-year-old male with stage IIIB non-small cell lung cancer.",
+    "ECOG performance status of 1.",
+    "Molecular profiling showed EGFR exon 19 deletion mutation and PD-L1 expression 60%.",
+    "No ALK or ROS1 rearrangement; KRAS wild type.",
+    "Restaging CT shows new liver metastases and bone lesions in the spine.",
+    "MRI revealed two brain mets, treated with stereotactic radiation.",
+    "He previously received four cycles of carboplatin and paclitaxel with grade 2 toxicity.",
+    "Prior therapy with pembrolizumab was stopped for pneumonitis.",
+    "Hgb: 11.2 g/dL, WBC 6.4 K/μL, PLT 210 K/μL, Creatinine 0.9 mg/dL.",
+    "Paziente con mutazione BRAF V600E, trattato con dabrafenib.",
+    "Family history of breast cancer (BRCA2 carrier mother).",
+    "Follow-up visit, patient reports mild fatigue and no new symptoms.",
+]
+
+BLOCKS = [
+    "Medications: osimertinib 80 mg daily, dexamethasone 4 mg, ondansetron as needed, "
+    "pantoprazole 40 mg, enoxaparin 4000 UI, paracetamol 1 g as needed",
+    "Lab panel ALT 32 U/L AST 28 U/L bilirubin 0,6 mg/dL LDH 240 U/L sodium 139 potassium 4,1 "
+    "calcium 9,4 albumin 3,8 CEA 12,4 CYFRA 21-1 5,3 NSE 14",
+]
+
+PAGE_CHARS = 3000
+
+
+def make_note(pages: int, seed: int = 7) -> str:
+    """About ``pages`` pages (3000 characters each) of clinical text."""
+    rng = random.Random(seed)
+    parts, size = [], 0
+    while size < pages * PAGE_CHARS:
+        part = rng.choice(BLOCKS) if rng.random() < 0.15 else rng.choice(SENTENCES)
+        parts.append(part)
+        size += len(part) + 1
+    return "\n".join(parts)
+
+
+def legacy_basic_feature_extraction(text):
+    """The per-term regex implementation, kept verbatim as the reference output."""
+    features = {
+        "age": {"value": None, "source": ""},
+        "gender": {"value": None, "source": ""},
+        "diagnosis": {"value": None, "source": ""},
+        "stage": {"value": None, "source": ""},
+        "ecog": {"value": None, "source": ""},
+        "mutations": [],
+        "metastases": [],
+        "previous_treatments": [],
+        "lab_values": {}
+    }
+
+    # Salviamo anche il testo originale per mostrarlo nella UI
+    features["original_text"] = text
+
+    # Basic age extraction
+    age_match = re.search(r'(\d+)[\s-]*(?:year|yr)s?[\s-]*old', text, re.IGNORECASE)
+    if age_match:
+        features["age"]["value"] = int(age_match.group(1))
+        features["age"]["source"] = age_match.group(0)
+
+    # Basic gender extraction
+    if re.search(r'\b(male|man)\b', text, re.IGNORECASE):
+        features["gender"]["value"] = "male"
+        features["gender"]["source"] = "male reference in text"
+    elif re.search(r'\b(female|woman)\b', text, re.IGNORECASE):
+        features["gender"]["value"] = "female"
+        features["gender"]["source"] = "female reference in text"
+
+    # Basic diagnosis patterns
+    cancer_types = [
+        "lung cancer", "breast cancer", "colorectal cancer", "prostate cancer",
+        "melanoma", "leukemia", "lymphoma", "pancreatic cancer", "ovarian cancer",
+        "non-small cell lung cancer", "NSCLC", "small cell lung cancer", "SCLC",
+        "glioblastoma", "glioma", "hepatocellular carcinoma", "HCC"
+    ]
+
+    for cancer in cancer_types:
+        if cancer.lower() in text.lower():
+            features["diagnosis"]["value"] = cancer
+
+            # Try to find a more precise context
+            context_match = re.search(r'([^.]*' + re.escape(cancer) + r'[^.]*\.)', text, re.IGNORECASE)
+            if context_match:
+                features["diagnosis"]["source"] = context_match.group(1).strip()
+            else:
+                features["diagnosis"]["source"] = f"contains '{cancer}'"
+
+            break
+
+    # Stage extraction
+    stage_match = re.search(r'stage\s+(I{1,3}V?|IV|III|II|I)([A-C])?', text, re.IGNORECASE)
+    if stage_match:
+        features["stage"]["value"] = stage_match.group(1) + (stage_match.group(2) or "")
+        features["stage"]["source"] = stage_match.group(0)
+
+    # ECOG extraction
+    ecog_match = re.search(r'ECOG\s*(?:PS|performance status)?\s*(?:of|:)?\s*([0-4])', text, re.IGNORECASE)
+    if ecog_match:
+        features["ecog"]["value"] = int(ecog_match.group(1))
+        features["ecog"]["source"] = ecog_match.group(0)
+
+    # Common mutations
+    mutations = [
+        "EGFR", "ALK", "ROS1", "BRAF V600E", "KRAS", "HER2", "BRCA1", "BRCA2", 
+        "PD-L1", "MSI-H", "dMMR", "NTRK", "RET", "MET"
+    ]
+
+    # Tracciamo le mutazioni già trovate per evitare duplicati
+    found_mutations = set()
+
+    for mutation in mutations:
+        # Se la mutazione è già stata trovata, saltiamo
+        if mutation in found_mutations:
+            continue
+
+        pattern = r'([^.]*\b' + re.escape(mutation) + r'\b[^.]*\.)'
+        best_match = None
+        best_match_text = ""
+
+        # Cerchiamo tutte le occorrenze e manteniamo la migliore (quella con più informazioni)
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            match_text = match.group(0).strip()
+
+            # Se è la prima occorrenza o è più informativa della precedente
+            if best_match is None or len(match_text) > len(best_match_text):
+                # Controlliamo se contiene termini specifici come "mutazione" o "mut" che indicano informazioni più specifiche
+                specificity_terms = ["mutazione", "mut ", "mut:", "mutation", "alterazione", "delezione", "inserzione", "traslocazione"]
+                current_specificity = any(term in match_text.lower() for term in specificity_terms)
+                previous_specificity = any(term in best_match_text.lower() for term in specificity_terms) if best_match_text else False
+
+                # Se la nuova è più specifica o la precedente non era specifica
+                if current_specificity or not previous_specificity:
+                    best_match = match
+                    best_match_text = match_text
+
+        # Se abbiamo trovato almeno un'occorrenza per questa mutazione
+        if best_match is not None:
+            features["mutations"].append({
+                "value": mutation,
+                "source": best_match_text
+            })
+            found_mutations.add(mutation)
+
+    # Common metastasis sites
+    metastasis_sites = [
+        "brain", "liver", "bone", "lung", "adrenal", "lymph node", 
+        "peritoneal", "pleural", "skin"
+    ]
+
+    # Tracciamo i siti metastatici già trovati per evitare duplicati
+    found_metastases = set()
+
+    for site in metastasis_sites:
+        # Se il sito è già stato trovato, saltiamo
+        if site in found_metastases:
+            continue
+
+        pattern = r'([^.]*\b' + re.escape(site) + r'(?:\s+metastases|\s+metastasis|\s+lesions|\s+mets|\s+spread)[^.]*\.)'
+        best_match = None
+        best_match_text = ""
+
+        # Cerchiamo tutte le occorrenze e manteniamo la migliore (quella con più informazioni)
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            match_text = match.group(0).strip()
+
+            # Se è la prima occorrenza o è più informativa della precedente
+            if best_match is None or len(match_text) > len(best_match_text):
+                best_match = match
+                best_match_text = match_text
+
+        # Se abbiamo trovato almeno un'occorrenza per questo sito metastatico
+        if best_match is not None:
+            features["metastases"].append({
+                "value": site,
+                "source": best_match_text
+            })
+            found_metastases.add(site)
+
+    # Common treatments
+    treatments = [
+        "chemotherapy", "radiation", "surgery", "immunotherapy", 
+        "carboplatin", "cisplatin", "paclitaxel", "docetaxel", "pembrolizumab",
+        "nivolumab", "atezolizumab", "durvalumab", "trastuzumab", "osimertinib",
+        "erlotinib", "gefitinib", "crizotinib", "alectinib", "cetuximab"
+    ]
+
+    # Tracciamo i trattamenti già trovati per evitare duplicati
+    found_treatments = set()
+
+    for treatment in treatments:
+        # Se il trattamento è già stato trovato, saltiamo
+        if treatment in found_treatments:
+            continue
+
+        pattern = r'([^.]*\b(?:previous|prior|received|treated with|therapy with)\s[^.]*\b' + re.escape(treatment) + r'\b[^.]*\.)'
+        best_match = None
+        best_match_text = ""
+
+        # Cerchiamo tutte le occorrenze e manteniamo la migliore
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            match_text = match.group(0).strip()
+
+            # Se è la prima occorrenza o è più informativa della precedente
+            if best_match is None or len(match_text) > len(best_match_text):
+                # Controlliamo se contiene termini specifici come "cicli" o "dosaggio" che indicano informazioni più specifiche
+                specificity_terms = ["cicli", "ciclo", "dose", "dosaggio", "mg", "gr", "effetti collaterali", "tossicità"]
+                current_specificity = any(term in match_text.lower() for term in specificity_terms)
+                previous_specificity = any(term in best_match_text.lower() for term in specificity_terms) if best_match_text else False
+
+                # Se la nuova è più specifica o la precedente non era specifica
+                if current_specificity or not previous_specificity:
+                    best_match = match
+                    best_match_text = match_text
+
+        # Se abbiamo trovato almeno un'occorrenza per questo trattamento
+        if best_match is not None:
+            features["previous_treatments"].append({
+                "value": treatment,
+                "source": best_match_text
+            })
+            found_treatments.add(treatment)
+
+    # Common lab values
+    lab_tests = {
+        "hemoglobin": r'(?:Hgb|Hemoglobin|Hb)[\s:]+(\d+\.?\d*)\s*(?:g/dL|g/dl)',
+        "wbc": r'(?:WBC|White blood cells?)[\s:]+(\d+\.?\d*)\s*(?:K/μL|x10\^9/L)',
+        "platelets": r'(?:PLT|Platelets)[\s:]+(\d+\.?\d*)\s*(?:K/μL|x10\^9/L)',
+        "creatinine": r'(?:Cr|Creatinine)[\s:]+(\d+\.?\d*)\s*(?:mg/dL|mg/dl)',
+        "alt": r'(?:ALT|SGPT)[\s:]+(\d+\.?\d*)\s*(?:U/L|IU/L)',
+        "ast": r'(?:AST|SGOT)[\s:]+(\d+\.?\d*)\s*(?:U/L|IU/L)'
+    }
+
+    for lab_name, pattern in lab_tests.items():
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            features["lab_values"][lab_name] = {
+                "value": match.group(0),
+                "source": match.group(0)
+            }
+
+    return features
+
+
+def timed(fn, text, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(text)
+        best = min(best, time.perf_counter() - started)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from app.utils import basic_feature_extraction
+
+    print(f"{'pages':>6} {'chars':>9} {'legacy s':>10} {'single-pass s':>14} {'speed-up':>9}  identical")
+    for pages in args.pages:
+        note = make_note(pages)
+        expected, legacy_seconds = timed(legacy_basic_feature_extraction, note, args.repeat)
+        actual, seconds = timed(basic_feature_extraction, note, args.repeat)
+        print(f"{pages:>6} {len(note):>9} {legacy_seconds:>10.3f} {seconds:>14.3f} "
+              f"{legacy_seconds / seconds:>8.1f}x  {actual == expected}")
+
+
+if __name__ == "__main__":
+    main()
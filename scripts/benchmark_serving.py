@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+Concurrent-request capacity of the serving modes in gunicorn.conf.py.
+
+A stub Ollama server answers every /api/generate call after a fixed delay,
+so the measurement isolates how many /process requests each worker model
+can keep in flight while waiting on the LLM.
+
+Usage:
+    python scripts/benchmark_serving.py --modes sync gthread gevent --concurrency 50 --latency 1.0
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NOTE = "Paziente di 62 anni, NSCLC stadio IV, ECOG 1, mutazione KRAS G12C."
+STUB_FEATURES = {"age": 62, "gender": "male", "diagnosis": "NSCLC", "stage": "IV", "ecog": 1,
+                 "mutations": ["KRAS G12C"], "metastases": [], "previous_treatments": [], "lab_values": {}}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub_ollama(port: int, latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            body = json.dumps({"response": json.dumps(STUB_FEATURES), "done": True}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def process_tree_rss_mb(pid: int) -> float:
+    """Resident memory of a process and its children, from /proc (Linux only)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return round(total / 1024, 1)
+
+
+def wait_until_up(url: str, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.5)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def run_mode(mode: str, args, ollama_url: str) -> dict:
+    port = free_port()
+    env = dict(os.environ,
+               SERVE_MODE=mode, PORT=str(port), HOST="127.0.0.1", WEB_WORKERS=str(args.workers),
+               OLLAMA_SERVER_URL=ollama_url, EMBEDDING_BACKEND="hashing",
+               EMBEDDINGS_DIR=tempfile.mkdtemp(), JOB_WORKERS="0", MATCH_TIME_BUDGET="0",
+               DATABASE_URL=args.database_url or f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    latencies, errors, peak_rss = [], 0, 0.0
+    try:
+        wait_until_up(base_url + "/")
+
+        stop = threading.Event()
+
+        def sample_memory():
+            nonlocal peak_rss
+            while not stop.wait(0.2):
+                peak_rss = max(peak_rss, process_tree_rss_mb(server.pid))
+
+        threading.Thread(target=sample_memory, daemon=True).start()
+
+        def one_request(_):
+            started = time.perf_counter()
+            try:
+                response = requests.post(base_url + "/process", data={"text": NOTE}, timeout=args.timeout)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            return ok, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for ok, seconds in pool.map(one_request, range(args.requests)):
+                if ok:
+                    latencies.append(seconds)
+                else:
+                    errors += 1
+        wall = time.perf_counter() - started
+        stop.set()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 2) if latencies else None
+
+    return {
+        "mode": mode,
+        "requests": args.requests,
+        "errors": errors,
+        "wall_seconds": round(wall, 2),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50_seconds": percentile(0.5),
+        "p95_seconds": percentile(0.95),
+        "peak_rss_mb": peak_rss,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent /process capacity per serving mode")
+    parser.add_argument("--modes", nargs="+", default=["sync", "gthread", "gevent"])
+    parser.add_argument("--workers", type=int, default=2, help="Gunicorn worker processes")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=1.0, help="Stub LLM latency per call (seconds)")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--database-url", help="Defaults to a throwaway SQLite database")
+    args = parser.parse_args()
+
+    ollama_port = free_port()
+    stub = start_stub_ollama(ollama_port, args.latency)
+    ollama_url = f"http://127.0.0.1:{ollama_port}/api/generate"
+
+    results = []
+    for mode in args.modes:
+        if mode == "gevent":
+            try:
+                import gevent  # noqa: F401
+            except ImportError:
+                print("⚠️ gevent not installed, skipping (pip install gevent)")
+                continue
+        print(f"🚀 Benchmarking {mode}...")
+        results.append(run_mode(mode, args, ollama_url))
+        print(json.dumps(results[-1]))
+    stub.shutdown()
+
+    print(f"\n{'mode':<8} {'rps':>7} {'p50':>7} {'p95':>7} {'errors':>7} {'rss MB':>8}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['throughput_rps']:>7} {r['p50_seconds']!s:>7} {r['p95_seconds']!s:>7} "
+              f"{r['errors']:>7} {r['peak_rss_mb']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+# scripts/build_embeddings.py
+import os
+import sys
+import logging
+import argparse
+
+# Add the main directory to the path for imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.database_utils import load_trials_from_json
+from app.core.embeddings import TrialEmbeddingIndex, HashingEmbedder, OllamaEmbedder, EMBEDDINGS_DIR, EMBEDDING_MODEL
+from app.core.scheduler import set_llm_context
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the memory-mapped trial embedding index')
+    parser.add_argument('--json-file', type=str, default='trials_int.json', help='JSON file with trial data.')
+    parser.add_argument('--output-dir', type=str, default=EMBEDDINGS_DIR, help='Directory for the vector matrix and id map.')
+    parser.add_argument('--model', type=str, default=EMBEDDING_MODEL, help='Ollama embedding model.')
+    parser.add_argument('--hashing', action='store_true', help='Use the deterministic hashing embedder (no LLM needed).')
+    args = parser.parse_args()
+
+    trials = load_trials_from_json(args.json_file)
+    if not trials:
+        logger.error(f"❌ No trials found in {args.json_file}.")
+        return 1
+
+    set_llm_context('ingest', 'build_embeddings')
+    embedder = HashingEmbedder() if args.hashing else OllamaEmbedder(model=args.model)
+    index = TrialEmbeddingIndex.build(trials, embedder, args.output_dir)
+    logger.info(f"✅ Index ready: {len(index.ids)} trials x {index.dim} dims")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
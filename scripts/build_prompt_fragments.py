@@ -0,0 +1,46 @@
+# scripts/build_prompt_fragments.py
+import os
+import sys
+import logging
+import argparse
+
+# Add the main directory to the path for imports
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.database_utils import load_trials_from_json
+from app.core.prompt_compaction import PromptFragmentStore, PROMPT_FRAGMENTS_DIR
+from app.core.llm_processor import get_llm_processor
+from app.core.scheduler import set_llm_context
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute compact trial payloads for the matching prompts')
+    parser.add_argument('--json-file', type=str, default='trials_int.json', help='JSON file with trial data.')
+    parser.add_argument('--output-dir', type=str, default=PROMPT_FRAGMENTS_DIR, help='Directory for the fragment store.')
+    parser.add_argument('--estimate', action='store_true', help='Estimate tokens (~4 chars each) instead of asking the tokenizer.')
+    args = parser.parse_args()
+
+    trials = load_trials_from_json(args.json_file)
+    if not trials:
+        logger.error(f"❌ No trials found in {args.json_file}.")
+        return 1
+
+    set_llm_context('ingest', 'build_prompt_fragments')
+    count_tokens = None if args.estimate else get_llm_processor().count_tokens
+    store = PromptFragmentStore.build(trials, count_tokens, args.output_dir)
+
+    report = store.report()
+    print(f"{'trial':<14}{'verbose':>9}{'compact':>9}{'saved':>9}{'%':>7}")
+    for row in report:
+        print(f"{row['trial_id']:<14}{row['original_tokens']:>9}{row['tokens']:>9}{row['saved']:>9}{row['saved_pct']:>7}")
+    original = sum(row['original_tokens'] for row in report)
+    saved = sum(row['saved'] for row in report)
+    print(f"{'total':<14}{original:>9}{original - saved:>9}{saved:>9}{round(100 * saved / original, 1) if original else 0.0:>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
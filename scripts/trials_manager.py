@@ -2,6 +2,7 @@
 import os
 import sys
 import logging
+import argparse
 import requests
 from dotenv import load_dotenv
 from flask import Flask
@@ -10,6 +11,12 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, project_root)
 from models import db, ClinicalTrial
 from scripts.database_utils import save_trials_to_json, import_trials_to_db
+from app.core.vocabulary import trial_concepts
+from app.core.prompt_compaction import PromptFragmentStore
+from app.core.embeddings import TrialEmbeddingIndex, get_embedder
+from app.core.match_store import rescore_stored_patients
+from app.core.llm_processor import get_llm_processor
+from app.core.scheduler import llm_context
 from sqlalchemy import inspect
 
 
@@ -109,15 +116,19 @@ def process_study_data_v2(study):
             logger.error("❌ No NCT ID found for this trial. Skipping...")
             return None
 
+        # Canonical histology / biomarker / treatment codes for the pre-filter index
+        trial["concepts"] = trial_concepts(trial)
         return trial
     except Exception as e:
         logger.error(f"❌ Error processing trial data: {str(e)}")
         return None
 
 
-def save_and_import_trials(trials):
+def save_and_import_trials(trials, rescore=False):
     """
     Saves the fetched trials to JSON and imports them into the database.
+    With ``rescore``, stored patients are re-checked against the new and
+    amended trials (LLM calls for every stored patient).
     """
     if not trials:
         logger.error("❌ No trials to save or import.")
@@ -126,17 +137,40 @@ def save_and_import_trials(trials):
     save_trials_to_json(trials, "trials_int.json")
     logger.info("✅ Trials saved to JSON.")
 
+    # Token counting and embeddings yield to clinicians' requests, as in the other ingest scripts
+    with llm_context('ingest', 'trials_manager'):
+        # Compact matching-prompt payloads and their token counts
+        PromptFragmentStore.build(trials, get_llm_processor().count_tokens)
+        # Embedding index built here, so requests never rebuild it
+        try:
+            TrialEmbeddingIndex.build(trials, get_embedder())
+        except Exception as e:
+            logger.warning(f"⚠️ Trial embedding index not rebuilt, requests will rebuild it in background: {e}")
+
     with app.app_context():
         import_trials_to_db(trials)
         logger.info("✅ Trials imported to database.")
+
+    if not rescore:
+        return None
+    # Re-check stored patients against the new and amended trials only
+    with llm_context('batch', 'trials_manager'):
+        report = rescore_stored_patients(trials)
+    for trial_id, patients in report["newly_eligible"].items():
+        logger.info(f"🆕 {trial_id}: {len(patients)} newly eligible patient(s)")
+    return report
         
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Importazione dei trial essenziali MedMatchINT')
+    parser.add_argument('--rescore-patients', action='store_true',
+                        help='Rivaluta i pazienti salvati sui trial nuovi o modificati')
+    args = parser.parse_args()
     with app.app_context():
         logger.info("🚀 Fetching and Importing Essential Trials...")
         trials = fetch_trials_from_clinicaltrials_gov(ESSENTIAL_TRIAL_IDS)
         if trials:
-            save_and_import_trials(trials)
+            save_and_import_trials(trials, rescore=args.rescore_patients)
             logger.info("✅ Database updated with essential trials.")
         else:
             logger.error("❌ No trials fetched. Database not updated.")
\ No newline at end of file
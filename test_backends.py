@@ -0,0 +1,65 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import app.core.router as router
+from app.core.router import BackendNode, BackendRouter
+from app.core.llm_processor import LLMProcessor
+
+
+def start_llamacpp_stub():
+    """llama-server stand-in recording /completion payloads."""
+    payloads = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, body):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._reply({"status": "ok"})
+
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if self.path == "/tokenize":
+                self._reply({"tokens": list(range(len(payload["content"].split())))})
+                return
+            payloads.append(payload)
+            self._reply({"content": '{"met": true}', "tokens_evaluated": 10,
+                         "tokens_cached": 90 if len(payloads) > 1 else 0, "tokens_predicted": 5})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", payloads
+
+
+def test_llamacpp_completion_with_prompt_cache_and_grammar():
+    server, url, payloads = start_llamacpp_stub()
+    previous = router._router
+    router._router = BackendRouter([BackendNode("llamacpp", url, [LLMProcessor().model])])
+    try:
+        llm = LLMProcessor()
+        prefix = "Evaluate the criterion for this patient. " * 20
+        assert llm.generate_text(prefix + "Criterion A") == '{"met": true}'
+        assert json.loads(llm.generate_response(prefix + "Criterion B"))["response"] == '{"met": true}'
+        assert llm.count_tokens("three word text") == (3, False)
+    finally:
+        router._router = previous
+        server.shutdown()
+
+    first, second = payloads
+    assert first["cache_prompt"] is True and "grammar" in first
+    assert first["n_predict"] == llm.max_tokens
+    # The server picks the slot by cached-prompt similarity
+    assert first["id_slot"] == second["id_slot"] == -1
+
+
+if __name__ == "__main__":
+    test_llamacpp_completion_with_prompt_cache_and_grammar()
+    print("✅ Backend tests passed")
@@ -0,0 +1,46 @@
+import random
+from app.utils import basic_feature_extraction
+from app.core.text_patterns import TermMatcher, Sentences
+from scripts.benchmark_extraction import legacy_basic_feature_extraction, make_note, SENTENCES, BLOCKS
+
+EDGE_CASES = [
+    "",
+    "no periods at all: EGFR mutation, prior chemotherapy with cisplatin",
+    "Stage IV NSCLC. Previously treated with docetaxel. Previous docetaxel 75 mg. ",
+    "LUNG METASTASES. lung cancer. Non-Small Cell Lung Cancer, small cell lung cancer.",
+    "chemotherapy with carboplatin (no trigger). Received  carboplatin. therapy withcarboplatin.",
+    "METHOTREXATE and MET amplification. RETURN visit, RET fusion. KRAS-mutant.",
+    "Brain\nmets noted.\nBone lesions. Liver spread. Lymph node metastasis. skin.",
+    "\u212aRAS mutation (Kelvin sign). ALK. ALKALINE phosphatase. \u017fkin lesions. BRAF V600E muta\u017fion.",
+    "Hb: 9.8 g/dL. Patient is a 71 yr old woman, ECOG: 2.",
+]
+
+FRAGMENTS = SENTENCES + BLOCKS + ["prior", "received", "lung", "mets", ".", " ", "\n", "EGFR", "mg", "HCC"]
+
+
+def test_output_is_identical_to_legacy_extractor():
+    notes = list(EDGE_CASES) + [make_note(1, seed) for seed in range(3)]
+    rng = random.Random(11)
+    for _ in range(40):
+        notes.append(" ".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 25))))
+    for note in notes:
+        assert basic_feature_extraction(note) == legacy_basic_feature_extraction(note), note
+
+
+def test_matcher_reports_overlapping_terms_and_sentences():
+    matcher = TermMatcher(["lung", "lung cancer", "small cell lung cancer", "SCLC", "NSCLC"])
+    text = "Small cell lung cancer. NSCLC"
+    hits = matcher.find_all(text)
+    assert hits["small cell lung cancer"] == [0]
+    assert hits["lung cancer"] == [11] and hits["lung"] == [11]
+    assert hits["NSCLC"] == [24] and hits["SCLC"] == [25]
+
+    sentences = Sentences(text)
+    assert sentences.around(11) == (0, 23)
+    assert sentences.around(24) is None
+
+
+if __name__ == "__main__":
+    test_output_is_identical_to_legacy_extractor()
+    test_matcher_reports_overlapping_terms_and_sentences()
+    print("✅ Basic extraction tests passed")
@@ -0,0 +1,90 @@
+import os
+import json
+import tempfile
+import app.core.feature_extraction as feature_extraction
+import app.core.match_store as match_store
+from scripts.batch_match import ResultWriter, build_stages, read_records, run_pipeline
+
+
+def _notes(directory, count):
+    path = os.path.join(directory, "notes.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            f.write(json.dumps({"id": f"p{i}", "text": f"note {i}"}) + "\n")
+    return path
+
+
+def test_pipeline_streams_every_record_and_reports_stages():
+    directory = tempfile.mkdtemp()
+    writer = ResultWriter(os.path.join(directory, "results.jsonl"))
+
+    def features(record):
+        if record["id"] == "p3":
+            raise ValueError("LLM returned no features")
+        record["features"] = {"diagnosis": "NSCLC"}
+
+    def matching(record):
+        record["matched_trials"] = [{"trial_id": "NCT1", "match_score": 80, "recommendation": "RECOMMENDED"}]
+
+    stages = [("feature_extraction", features, 3), ("matching", matching, 2)]
+    report = run_pipeline(read_records(_notes(directory, 10)), stages, writer.write)
+
+    assert writer.written == 10
+    assert [(row["stage"], row["processed"], row["failed"]) for row in report] == [
+        ("feature_extraction", 9, 1), ("matching", 9, 0)]
+    with open(writer.output, encoding="utf-8") as f:
+        failed = [r for r in map(json.loads, f) if r.get("error")]
+    assert [(r["id"], r["failed_stage"]) for r in failed] == [("p3", "feature_extraction")]
+
+
+def test_resume_retries_failures_and_reuses_checkpoints():
+    directory = tempfile.mkdtemp()
+    writer = ResultWriter(os.path.join(directory, "results.csv"))
+    writer.write({"id": "p0", "features": {"diagnosis": "NSCLC"}, "matched_trials": []})
+    writer.write({"id": "p2", "error": "LLM returned no features", "failed_stage": "feature_extraction"})
+    writer.checkpoint({"id": "p1", "features": {"diagnosis": "SCLC"}})
+
+    assert writer.done_ids() == {"p0"}
+    assert writer.checkpoints() == {"p1": {"diagnosis": "SCLC"}}
+
+    extracted = []
+
+    def features(record):
+        if "features" in record:
+            return False
+        extracted.append(record["id"])
+        record["features"] = {}
+
+    records = [r for r in read_records(_notes(directory, 3)) if r["id"] not in writer.done_ids()]
+    records[0]["features"] = writer.checkpoints()["p1"]
+    report = run_pipeline(records, [("feature_extraction", features, 2)], writer.write)
+    assert extracted == ["p2"]
+    assert report[0]["skipped"] == 1
+    assert writer.done_ids() == {"p0", "p1", "p2"}
+
+
+def test_matching_stores_patients_by_record_id_only_when_enabled():
+    writer = ResultWriter(os.path.join(tempfile.mkdtemp(), "results.jsonl"))
+    references = []
+
+    def fake_match(features, deadline=None, state=None, on_result=None):
+        references.append(state.patient_ref)
+        return []
+
+    original = (feature_extraction.match_trials_llm, match_store.MATCH_STORE_ENABLED)
+    feature_extraction.match_trials_llm = fake_match
+    try:
+        for enabled in (False, True):
+            match_store.MATCH_STORE_ENABLED = enabled
+            matching = dict((name, fn) for name, fn, _ in build_stages(writer, 1, 1, 1))["matching"]
+            matching({"id": "p0", "features": {"diagnosis": "NSCLC"}})
+    finally:
+        feature_extraction.match_trials_llm, match_store.MATCH_STORE_ENABLED = original
+    assert references == [None, "p0"]
+
+
+if __name__ == "__main__":
+    test_pipeline_streams_every_record_and_reports_stages()
+    test_resume_retries_failures_and_reuses_checkpoints()
+    test_matching_stores_patients_by_record_id_only_when_enabled()
+    print("✅ Batch matching tests passed")
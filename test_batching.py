@@ -0,0 +1,89 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import app.core.router as router
+import app.core.llm_processor as llm_processor
+from app.core.router import BackendNode, BackendRouter
+from app.core.batching import MicroBatcher
+from app.core.llm_processor import LLMProcessor
+from app.core.scheduler import get_scheduler
+from test_router import start_stub
+
+
+def start_batch_stub():
+    """llama-server stand-in: echoes each prompt of a prompt array back as its content."""
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            requests_seen.append(payload["prompt"])
+            prompts = payload["prompt"] if isinstance(payload["prompt"], list) else [payload["prompt"]]
+            results = [{"content": f"echo:{p}", "tokens_predicted": 1} for p in prompts]
+            data = json.dumps(results if isinstance(payload["prompt"], list) else results[0]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", requests_seen
+
+
+def test_concurrent_prompts_share_one_batched_request():
+    server, url, requests_seen = start_batch_stub()
+    previous = router._router
+    router._router = BackendRouter([BackendNode("llamacpp", url, [LLMProcessor().model])])
+    try:
+        llm = LLMProcessor()
+        batcher = MicroBatcher(window_ms=200, max_batch=8)
+        completed = get_scheduler().stats()["classes"]["interactive"]["completed"]
+
+        def call(i):
+            envelope = batcher.submit(llm, f"note {i}", 0.1, 64).result(timeout=10)
+            return json.loads(envelope)["response"]
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(call, range(4)))
+    finally:
+        router._router = previous
+        server.shutdown()
+
+    assert results == [f"echo:note {i}" for i in range(4)]
+    assert len(requests_seen) == 1 and sorted(requests_seen[0]) == [f"note {i}" for i in range(4)]
+    stats = batcher.stats()
+    assert stats["batches"] == 1 and stats["avg_batch_size"] == 4
+    # The whole batch took a single scheduler slot
+    assert get_scheduler().stats()["classes"]["interactive"]["completed"] == completed + 1
+
+
+def test_ollama_prompts_bypass_the_batcher():
+    server, url, hits = start_stub()
+    previous = router._router, llm_processor.LLM_BATCH_WINDOW_MS, llm_processor.get_batcher
+    router._router = BackendRouter([BackendNode("ollama", url)])
+    llm_processor.LLM_BATCH_WINDOW_MS = 200
+
+    def no_batcher():
+        raise AssertionError("Ollama has no batch endpoint")
+
+    llm_processor.get_batcher = no_batcher
+    try:
+        envelope = LLMProcessor(model="llama3.1:8b").generate_response("note", max_tokens=16)
+    finally:
+        router._router, llm_processor.LLM_BATCH_WINDOW_MS, llm_processor.get_batcher = previous
+        server.shutdown()
+
+    assert json.loads(envelope)["response"] == "ok"
+    assert hits == ["llama3.1:8b"]
+
+
+if __name__ == "__main__":
+    test_concurrent_prompts_share_one_batched_request()
+    test_ollama_prompts_bypass_the_batcher()
+    print("✅ Batching tests passed")
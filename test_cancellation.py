@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import app.core.router as router
+from app.core.router import BackendNode, BackendRouter
+from app.core.cancellation import Cancelled, CancellationToken, cancellation_scope, get_cancellation_stats
+from app.core.scheduler import LLMScheduler
+from app.core.llm_processor import LLMProcessor
+from app.core.jobs import JobStore
+
+
+def start_streaming_stub(chunks, delay):
+    """llama-server stand-in streaming ``chunks`` as SSE events, ``delay`` seconds apart."""
+    disconnected = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            try:
+                for i, chunk in enumerate(chunks):
+                    event = {"content": chunk, "stop": i == len(chunks) - 1, "tokens_predicted": i + 1}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(delay)
+            except (BrokenPipeError, ConnectionResetError):
+                disconnected.set()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}", disconnected
+
+
+def test_streamed_completion_joins_chunks_and_cancel_closes_connection():
+    server, url, disconnected = start_streaming_stub(['{"met":', ' true}'] + [" "] * 50, delay=0.05)
+    previous = router._router
+    router._router = BackendRouter([BackendNode("llamacpp", url, [LLMProcessor().model])])
+    try:
+        llm = LLMProcessor()
+        with cancellation_scope(CancellationToken()):
+            envelope = json.loads(llm.complete("prompt", 0.1, 64))
+        assert envelope["response"].strip() == '{"met": true}'
+
+        token = CancellationToken()
+        threading.Timer(0.3, token.cancel, args=("client_disconnected",)).start()
+        before = get_cancellation_stats()["llm_calls_aborted"]["in_flight"]
+        started = time.perf_counter()
+        try:
+            with cancellation_scope(token):
+                llm.complete("prompt", 0.1, 64)
+            assert False, "expected Cancelled"
+        except Cancelled as e:
+            assert e.reason == "client_disconnected"
+        assert time.perf_counter() - started < 2
+        assert get_cancellation_stats()["llm_calls_aborted"]["in_flight"] == before + 1
+        assert disconnected.wait(3)
+        assert router._router.nodes[0].in_flight == 0 and router._router.nodes[0].errors == 0
+    finally:
+        router._router = previous
+        server.shutdown()
+
+
+def test_cancelled_waiter_leaves_scheduler_queue():
+    scheduler = LLMScheduler(max_concurrency=1)
+    holder = scheduler.acquire("interactive", "a")
+    token = CancellationToken()
+    outcome = []
+
+    def wait():
+        with cancellation_scope(token):
+            try:
+                scheduler.acquire("interactive", "b")
+            except Cancelled:
+                outcome.append("cancelled")
+
+    waiter = threading.Thread(target=wait)
+    waiter.start()
+    time.sleep(0.1)
+    assert scheduler.stats()["classes"]["interactive"]["queued"] == 1
+    token.cancel("job_cancelled")
+    waiter.join(2)
+    scheduler.release(holder)
+
+    assert outcome == ["cancelled"]
+    stats = scheduler.stats()["classes"]["interactive"]
+    assert stats["queued"] == 0 and stats["cancelled"] == 1
+
+
+def test_only_unfinished_jobs_can_be_cancelled():
+    store = JobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+    queued = store.create(text="note")
+    finished = store.create(text="other note")
+    store.update(finished, status="done", stage="done")
+
+    assert store.cancel(queued) is True
+    assert store.get(queued)["stage"] == "cancelled"
+    assert store.claim_next("w1") is None
+    assert store.cancel(finished) is False and store.status(finished) == "done"
+
+
+if __name__ == "__main__":
+    test_streamed_completion_joins_chunks_and_cancel_closes_connection()
+    test_cancelled_waiter_leaves_scheduler_queue()
+    test_only_unfinished_jobs_can_be_cancelled()
+    print("✅ Cancellation tests passed")
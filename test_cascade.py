@@ -0,0 +1,101 @@
+import json
+import itertools
+from app.core.cascade import run_cascade, select_finalists
+from app.core.match_state import Deadline, MatchState
+
+TRIALS = [
+    {"id": "NCT-NSCLC", "title": "KRAS G12C inhibitor in NSCLC", "min_age": "18 Years", "max_age": "Not specified",
+     "gender": "All", "inclusion_criteria": ["Metastatic NSCLC with KRAS G12C"], "exclusion_criteria": []},
+    {"id": "NCT-SCLC", "title": "Extensive stage small cell lung cancer", "min_age": "18 Years", "max_age": "Not specified",
+     "gender": "All", "inclusion_criteria": ["Extensive-stage SCLC"], "exclusion_criteria": []},
+    {"id": "NCT-ELDERLY", "title": "NSCLC in elderly patients", "min_age": "75 Years", "max_age": "Not specified",
+     "gender": "All", "inclusion_criteria": ["NSCLC"], "exclusion_criteria": []},
+]
+
+
+class StubLLM:
+    """Large model answering criterion prompts; a fresh model name keeps each test's verdict cache apart."""
+    _instances = itertools.count()
+
+    def __init__(self):
+        self.model = f"large-{next(self._instances)}"
+        self.criteria_seen = []
+
+    def generate_text(self, prompt):
+        criterion = prompt.split("Criterion: ", 1)[1].split("\n", 1)[0]
+        self.criteria_seen.append(criterion)
+        return json.dumps({"met": "infection" not in criterion, "explanation": "stub"})
+
+
+def test_select_finalists_top_k_and_band():
+    results = [
+        {"trial_id": "a", "match_score": 95, "recommendation": "POTENTIALLY_ELIGIBLE"},
+        {"trial_id": "b", "match_score": 60, "recommendation": "POTENTIALLY_ELIGIBLE"},
+        {"trial_id": "c", "match_score": 20, "recommendation": "POTENTIALLY_ELIGIBLE"},
+        {"trial_id": "d", "match_score": 0, "recommendation": "NOT_RECOMMENDED"},
+    ]
+    assert select_finalists(results, top_k=1, band=(40, 70)) == ["a", "b"]
+
+
+def test_promotion_follows_provisional_score():
+    results = [
+        {"trial_id": "unknown-diagnosis", "match_score": 50, "recommendation": "POTENTIALLY_ELIGIBLE"},
+        {"trial_id": "diagnosis-1", "match_score": 80, "recommendation": "POTENTIALLY_ELIGIBLE"},
+        {"trial_id": "diagnosis-2", "match_score": 80, "recommendation": "POTENTIALLY_ELIGIBLE"},
+        {"trial_id": "diagnosis-3", "match_score": 80, "recommendation": "POTENTIALLY_ELIGIBLE"},
+        {"trial_id": "mismatch", "match_score": 20, "recommendation": "POTENTIALLY_ELIGIBLE"},
+    ]
+    # A band trial is never promoted ahead of, or instead of, a better-scored one
+    assert select_finalists(results, top_k=1, band=(40, 70)) == \
+        ["diagnosis-1", "diagnosis-2", "diagnosis-3", "unknown-diagnosis"]
+    assert select_finalists(results, top_k=2, band=(90, 95)) == ["diagnosis-1", "diagnosis-2"]
+
+
+def test_only_finalists_reach_large_model():
+    llm = StubLLM()
+    features = {"age": 60, "diagnosis": "NSCLC", "mutations": ["KRAS G12C"]}
+    results, report = run_cascade(features, TRIALS, TRIALS, llm)
+
+    by_id = {r["trial_id"]: r for r in results}
+    assert by_id["NCT-ELDERLY"]["recommendation"] == "NOT_RECOMMENDED"
+    assert by_id["NCT-NSCLC"]["stage"] == "final"
+    assert report["screened"] == 3
+    assert llm.criteria_seen == ["Metastatic NSCLC with KRAS G12C"]
+    assert report["screener"] == "rules" and report["promoted"] == 1
+
+
+def test_shared_finalist_criteria_are_judged_once():
+    llm = StubLLM()
+    trials = [dict(TRIALS[0], id=f"NCT-KRAS-{i}", exclusion_criteria=["Active infection"]) for i in range(3)]
+    results, report = run_cascade({"age": 60, "diagnosis": "NSCLC", "mutations": ["KRAS G12C"]}, trials, trials, llm)
+    assert report["promoted"] == 3
+    assert all(r["stage"] == "final" and r["recommendation"] == "RECOMMENDED" for r in results)
+    assert sorted(llm.criteria_seen) == ["Active infection", "Metastatic NSCLC with KRAS G12C"]
+
+
+def test_expired_deadline_flags_trials_and_resume_skips_done_work():
+    llm = StubLLM()
+    features = {"age": 60, "diagnosis": "NSCLC", "mutations": ["KRAS G12C"]}
+    state = MatchState(features)
+
+    expired = Deadline(0.001)
+    while not expired.expired():
+        pass
+    results, report = run_cascade(features, TRIALS, TRIALS, llm, deadline=expired, state=state)
+    assert all(r["stage"] == "not_evaluated" for r in results)
+    assert report["complete"] is False
+
+    run_cascade(features, TRIALS, TRIALS, llm, state=state)
+    calls = len(llm.criteria_seen)
+    results, report = run_cascade(features, TRIALS, TRIALS, llm, state=state)
+    assert report["complete"] is True
+    assert report["screened"] == 0
+    assert len(llm.criteria_seen) == calls
+
+
+if __name__ == "__main__":
+    test_select_finalists_top_k_and_band()
+    test_promotion_follows_provisional_score()
+    test_only_finalists_reach_large_model()
+    test_shared_finalist_criteria_are_judged_once()
+    test_expired_deadline_flags_trials_and_resume_skips_done_work()
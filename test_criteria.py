@@ -0,0 +1,132 @@
+import json
+import time
+import threading
+from app.core.cancellation import Cancelled
+from app.core.criteria import (
+    CriterionCatalog, CriterionEvaluator, split_eligibility, normalize_criterion, evaluate_trial, summarize_trial
+)
+
+ELIGIBILITY = [
+    "Inclusion Criteria:",
+    "",
+    "* ECOG performance status 0-1",
+    "* Patients must have one of the following:",
+    "  1. No evidence of brain metastases",
+    "",
+    "Exclusion Criteria:",
+    "",
+    "* Has an active infection requiring systemic therapy."
+]
+
+TRIALS = [
+    {"id": "NCT-A", "inclusion_criteria": ELIGIBILITY, "exclusion_criteria": ELIGIBILITY},
+    {"id": "NCT-B", "inclusion_criteria": ["Inclusion Criteria:", "* ECOG Performance Status 0-1",
+                                           "Exclusion Criteria:", "* Active infection requiring systemic therapy"],
+     "exclusion_criteria": []},
+]
+
+
+class StubLLM:
+    def __init__(self):
+        self.prompts = []
+
+    def generate_text(self, prompt):
+        self.prompts.append(prompt)
+        return json.dumps({"met": "infection" not in prompt, "explanation": "stub"})
+
+
+def test_split_eligibility_uses_section_headers():
+    inclusion, exclusion = split_eligibility(TRIALS[0])
+    assert inclusion == ["ECOG performance status 0-1",
+                         "Patients must have one of the following: No evidence of brain metastases"]
+    assert exclusion == ["Has an active infection requiring systemic therapy."]
+
+
+def test_normalization_merges_equivalent_criteria():
+    assert normalize_criterion("* Has an active infection requiring systemic therapy.") == \
+        normalize_criterion("Active infection requiring systemic therapy")
+
+
+def test_shared_criteria_evaluated_once_per_patient():
+    catalog = CriterionCatalog(TRIALS)
+    assert catalog.stats()["unique_criteria"] == 3
+    assert catalog.stats()["criterion_occurrences"] == 5
+
+    llm = StubLLM()
+    evaluator = CriterionEvaluator({"ecog": "1"}, llm)
+    results = [evaluate_trial(trial, catalog, evaluator) for trial in TRIALS]
+
+    assert len(llm.prompts) == 3
+    assert evaluator.cache_hits == 2
+    assert results[1]["criteria_analysis"]["exclusion_criteria"][0]["violated"] is False
+    assert results[1]["recommendation"] == "RECOMMENDED"
+
+
+def test_concurrent_evaluations_share_one_call():
+    class SlowLLM(StubLLM):
+        def generate_text(self, prompt):
+            time.sleep(0.1)
+            return super().generate_text(prompt)
+
+    llm = SlowLLM()
+    evaluator = CriterionEvaluator({"ecog": "1"}, llm)
+    verdicts = []
+    threads = [threading.Thread(target=lambda: verdicts.append(evaluator.evaluate("k", "ECOG 0-1")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(llm.prompts) == 1
+    assert [v["met"] for v in verdicts] == [True] * 4
+
+
+def test_waiters_retry_when_the_leader_is_cancelled():
+    class LeaderCancelledLLM(StubLLM):
+        def generate_text(self, prompt):
+            time.sleep(0.1)
+            if not self.prompts:
+                self.prompts.append(prompt)
+                raise Cancelled("client_disconnected")
+            return super().generate_text(prompt)
+
+    llm = LeaderCancelledLLM()
+    evaluator = CriterionEvaluator({"ecog": "1"}, llm)
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(evaluator.evaluate("k", "ECOG 0-1")["met"])
+        except Cancelled:
+            outcomes.append("cancelled")
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    time.sleep(0.02)
+    waiter = threading.Thread(target=call)
+    waiter.start()
+    leader.join()
+    waiter.join()
+    # Only the leader's own request fails; the waiter evaluates the criterion itself
+    assert sorted(outcomes, key=str) == [True, "cancelled"]
+    assert len(llm.prompts) == 2
+
+
+def test_score_counts_unclear_verdicts_half_and_failures_as_zero():
+    inclusion = [{"criterion": "a", "met": True}, {"criterion": "b", "met": None}]
+    exclusion = [{"criterion": "c", "violated": False}, {"criterion": "d", "violated": False}]
+    result = summarize_trial({"id": "T"}, inclusion, exclusion)
+    assert (result["match_score"], result["recommendation"]) == (88, "POTENTIALLY_ELIGIBLE")
+
+    exclusion[1]["violated"] = True
+    result = summarize_trial({"id": "T"}, inclusion, exclusion)
+    assert (result["match_score"], result["recommendation"]) == (0, "NOT_RECOMMENDED")
+
+
+if __name__ == "__main__":
+    test_split_eligibility_uses_section_headers()
+    test_normalization_merges_equivalent_criteria()
+    test_shared_criteria_evaluated_once_per_patient()
+    test_concurrent_evaluations_share_one_call()
+    test_waiters_retry_when_the_leader_is_cancelled()
+    test_score_counts_unclear_verdicts_half_and_failures_as_zero()
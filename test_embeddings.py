@@ -0,0 +1,73 @@
+import time
+import tempfile
+from app.core.embeddings import HashingEmbedder, TrialEmbeddingIndex, retrieve_trials, embed_features
+from app.core.fingerprint import catalog_hash
+
+TRIALS = [
+    {"id": "NCT-LUNG", "title": "Adagrasib in NSCLC with KRAS G12C mutation",
+     "inclusion_criteria": ["Metastatic NSCLC", "KRAS G12C mutation"], "exclusion_criteria": []},
+    {"id": "NCT-BREAST", "title": "Trastuzumab in HER2 positive breast cancer",
+     "inclusion_criteria": ["HER2 positive breast cancer"], "exclusion_criteria": []},
+    {"id": "NCT-MELANOMA", "title": "BRAF V600E melanoma immunotherapy",
+     "inclusion_criteria": ["Unresectable melanoma", "BRAF V600E"], "exclusion_criteria": []},
+]
+
+
+def test_index_roundtrip_and_search():
+    embedder = HashingEmbedder()
+    with tempfile.TemporaryDirectory() as directory:
+        TrialEmbeddingIndex.build(TRIALS, embedder, directory)
+        index = TrialEmbeddingIndex.load(directory)
+        assert index.ids == ["NCT-LUNG", "NCT-BREAST", "NCT-MELANOMA"]
+        assert index.vectors.shape == (3, embedder.dim)
+
+        hits = index.search(embedder.embed("HER2 positive breast cancer"), top_k=2)
+        assert hits[0][0] == "NCT-BREAST"
+        assert len(hits) == 2
+
+
+def test_retrieve_trials_ranks_by_features():
+    embedder = HashingEmbedder()
+    features = {"diagnosis": "NSCLC", "mutations": ["KRAS G12C"]}
+    with tempfile.TemporaryDirectory() as directory:
+        TrialEmbeddingIndex.build(TRIALS, embedder, directory)
+        hits = retrieve_trials(features, TRIALS, top_k=1, embedder=embedder, directory=directory)
+        assert [trial["id"] for trial, _ in hits] == ["NCT-LUNG"]
+
+
+def test_stale_index_served_while_rebuilding_in_background():
+    embedder = HashingEmbedder()
+    features = {"diagnosis": "melanoma", "mutations": ["BRAF V600E"]}
+    with tempfile.TemporaryDirectory() as directory:
+        TrialEmbeddingIndex.build(TRIALS[:2], embedder, directory)
+        hits = retrieve_trials(features, TRIALS, top_k=3, embedder=embedder, directory=directory)
+        assert {trial["id"] for trial, _ in hits} == {"NCT-LUNG", "NCT-BREAST"}
+
+        deadline = time.monotonic() + 10
+        while TrialEmbeddingIndex.load(directory).catalog_hash != catalog_hash(TRIALS):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        hits = retrieve_trials(features, TRIALS, top_k=1, embedder=embedder, directory=directory)
+        assert [trial["id"] for trial, _ in hits] == ["NCT-MELANOMA"]
+
+
+def test_query_embeddings_cached_by_feature_hash():
+    calls = []
+
+    class CountingEmbedder(HashingEmbedder):
+        def embed(self, text):
+            calls.append(text)
+            return super().embed(text)
+
+    embedder = CountingEmbedder()
+    features = {"diagnosis": "SCLC", "stage": "IV", "original_text": "first upload"}
+    embed_features(features, embedder)
+    embed_features(dict(features, original_text="second upload"), embedder)
+    assert len(calls) == 1
+
+
+if __name__ == "__main__":
+    test_index_roundtrip_and_search()
+    test_retrieve_trials_ranks_by_features()
+    test_stale_index_served_while_rebuilding_in_background()
+    test_query_embeddings_cached_by_feature_hash()
@@ -0,0 +1,111 @@
+import os
+import json
+import tempfile
+from app.core.criteria import CriterionCatalog, CriterionEvaluator
+from app.core.evaluation_plan import RejectionStats, build_plan, excluded_mutation_check, run_plan, COST_LLM
+
+TRIAL = {
+    "id": "NCT-EGFR-EXCLUDED", "title": "Immunotherapy in NSCLC", "min_age": "18 Years", "max_age": "Not specified",
+    "gender": "All",
+    "inclusion_criteria": ["Inclusion Criteria:", "* Metastatic NSCLC", "* ECOG 0-1",
+                           "Exclusion Criteria:", "* Known EGFR mutation or ALK rearrangement",
+                           "* Active brain metastases"],
+    "exclusion_criteria": [],
+}
+
+
+class StubLLM:
+    model = "stub"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_text(self, prompt):
+        self.calls += 1
+        return json.dumps({"met": "EGFR" not in prompt, "explanation": "stub"})
+
+
+def _fresh_stats():
+    return RejectionStats(os.path.join(tempfile.mkdtemp(), "rejection_stats.sqlite3"))
+
+
+def test_plan_orders_by_cost_tier():
+    plan = build_plan(TRIAL, CriterionCatalog([TRIAL]), stats=_fresh_stats())
+    costs = [check["cost"] for check in plan]
+    assert costs == sorted(costs)
+    assert plan[-1]["cost"] == COST_LLM
+
+
+def test_regex_exclusion_stops_before_llm():
+    stats = _fresh_stats()
+    llm = StubLLM()
+    catalog = CriterionCatalog([TRIAL])
+    features = {"age": 60, "diagnosis": "NSCLC", "mutations": ["EML4-ALK fusion"]}
+    result = run_plan(TRIAL, features, build_plan(TRIAL, catalog, stats), CriterionEvaluator(features, llm), stats)
+
+    assert result["recommendation"] == "NOT_RECOMMENDED"
+    assert result["rejection_type"] == "excluded_mutation"
+    assert llm.calls == 0
+    assert result["checks_skipped"] > 0
+
+
+def test_excluded_mutation_needs_a_variant_level_match():
+    kras = excluded_mutation_check("Known KRAS G12D mutation")
+    assert kras({"mutations": ["KRAS G12C"]}).startswith("Gene of KRAS G12C")
+    assert kras({"mutations": ["KRAS G12V"]}).startswith("Gene of KRAS G12V")
+    assert excluded_mutation_check("Known KRAS G12C mutation")({"mutations": ["KRAS p.G12C"]}).startswith("Excluded")
+    assert excluded_mutation_check("EGFR exon 20 insertion mutation")({"mutations": ["exon 19 deletion"]}) is None
+
+    # A gene-only match leaves the criterion undecided instead of rejecting the trial
+    stats = _fresh_stats()
+    features = {"age": 60, "diagnosis": "NSCLC", "mutations": ["EGFR ex19del"]}
+    result = run_plan(TRIAL, features, build_plan(TRIAL, stats=stats), stats=stats)
+    assert result["recommendation"] != "NOT_RECOMMENDED"
+
+
+def test_structured_histology_rejection():
+    stats = _fresh_stats()
+    result = run_plan(TRIAL, {"age": 60, "diagnosis": "SCLC"}, build_plan(TRIAL, stats=stats), stats=stats)
+    assert result["rejection_type"] == "histology"
+
+
+def test_llm_exclusion_early_exit_and_adaptive_order():
+    stats = _fresh_stats()
+    llm = StubLLM()
+    catalog = CriterionCatalog([TRIAL])
+    features = {"age": 60, "diagnosis": "NSCLC", "mutations": []}
+    result = run_plan(TRIAL, features, build_plan(TRIAL, catalog, stats), CriterionEvaluator(features, llm), stats)
+    assert result["rejection_type"] == "brain_metastases"
+
+    # brain_metastases now has the highest rejection rate, so it runs first among LLM checks
+    llm_checks = [check for check in build_plan(TRIAL, catalog, stats) if check["cost"] == COST_LLM]
+    assert llm_checks[0]["type"] == "brain_metastases"
+
+
+def test_checks_count_once_per_patient_and_trial():
+    stats = _fresh_stats()
+    features = {"age": 60, "diagnosis": "SCLC"}
+    for _ in range(3):
+        run_plan(TRIAL, features, build_plan(TRIAL, stats=stats), stats=stats)
+    assert stats.counts["histology"] == {"evaluated": 1, "rejected": 1}
+
+
+def test_workers_add_up_their_counts():
+    path = os.path.join(tempfile.mkdtemp(), "rejection_stats.sqlite3")
+    worker_a, worker_b = RejectionStats(path), RejectionStats(path)
+    worker_a.record("histology", True)
+    worker_b.record("histology", False)
+    worker_a.flush()
+    worker_b.flush()
+    assert worker_b.counts["histology"] == {"evaluated": 2, "rejected": 1}
+    assert RejectionStats(path).counts == worker_b.counts
+
+
+if __name__ == "__main__":
+    test_plan_orders_by_cost_tier()
+    test_regex_exclusion_stops_before_llm()
+    test_excluded_mutation_needs_a_variant_level_match()
+    test_structured_histology_rejection()
+    test_llm_exclusion_early_exit_and_adaptive_order()
+    test_checks_count_once_per_patient_and_trial()
+    test_workers_add_up_their_counts()
@@ -0,0 +1,71 @@
+import json
+import app.core.explanations as explanations
+from app.core.cascade import run_cascade
+from test_cascade import TRIALS
+
+FEATURES = {"age": 60, "diagnosis": "NSCLC", "mutations": ["KRAS G12C"]}
+
+
+class StubLLM:
+    model = "large"
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate_text(self, prompt):
+        self.prompts.append(prompt)
+        if "patient-friendly summary" in prompt:
+            return json.dumps({"summary": "You may be eligible.", "key_points": ["KRAS G12C"],
+                               "patient_guidance": "Ask your oncologist."})
+        if "Criterion: " in prompt:
+            return json.dumps({"met": True, "explanation": "stub"})
+        if "criteria_analysis" in prompt:
+            return json.dumps({"match_score": 85, "overall_recommendation": "RECOMMENDED",
+                               "criteria_analysis": {"inclusion_criteria": [{"criterion": "NSCLC", "met": True}]},
+                               "key_factors": {"supporting": ["KRAS G12C"], "opposing": []}})
+        return json.dumps({"match_score": 90, "overall_recommendation": "RECOMMENDED", "summary": "KRAS G12C NSCLC"})
+
+
+def test_matching_scores_without_explanations():
+    llm = StubLLM()
+    results, report = run_cascade(FEATURES, TRIALS, TRIALS, llm)
+    final = [r for r in results if r["stage"] == "final"]
+    assert final and report["promoted"] == len(final)
+    assert all(r["explanation"] == "on_demand" and "key_factors" not in r for r in final)
+    assert not any("criteria_analysis" in prompt for prompt in llm.prompts)
+
+
+def test_explanation_is_generated_once_per_features_and_trial_version():
+    llm = StubLLM()
+    explanation, cached = explanations.explain_match(FEATURES, TRIALS[0], llm)
+    assert not cached and len(llm.prompts) == 2
+    assert explanation["patient_summary"] == "You may be eligible."
+    assert explanation["criteria_analysis"]["inclusion_criteria"][0]["met"] is True
+
+    again, cached = explanations.explain_match(dict(FEATURES), TRIALS[0], llm)
+    assert cached and again == explanation and len(llm.prompts) == 2
+
+    amended = dict(TRIALS[0], inclusion_criteria=["Metastatic NSCLC with KRAS G12C", "ECOG 0-1"])
+    _, cached = explanations.explain_match(FEATURES, amended, llm)
+    assert not cached and len(llm.prompts) == 4
+
+
+
+def test_explanation_disagreeing_with_the_shown_result_is_flagged():
+    llm = StubLLM()
+    trial = dict(TRIALS[0], id="NCT-SHOWN")
+    agreeing, _ = explanations.explain_match(FEATURES, trial, llm, shown={"match_score": 90, "recommendation": "RECOMMENDED"})
+    assert agreeing["match_score"] == 85 and agreeing["mismatch"] is False
+
+    # Same cached analysis, compared with another card
+    flagged, cached = explanations.explain_match(FEATURES, trial, llm,
+                                                 shown={"match_score": 40, "recommendation": "NOT_RECOMMENDED"})
+    assert cached and flagged["mismatch"] is True and flagged["shown_score"] == 40
+    assert "mismatch" not in explanations.explain_match(FEATURES, trial, llm)[0]
+
+
+if __name__ == "__main__":
+    test_matching_scores_without_explanations()
+    test_explanation_is_generated_once_per_features_and_trial_version()
+    test_explanation_disagreeing_with_the_shown_result_is_flagged()
+    print("✅ Explanation tests passed")
@@ -0,0 +1,53 @@
+from app.core.grounding import ground_sources, render_highlights, source_snippets
+
+NOTE = ("65-year-old male with stage IVB non-small cell lung cancer. ECOG PS 1.\n"
+        "EGFR exon 19 deletion mutation detected. Multiple brain metastases on MRI.\n"
+        "He previously received chemotherapy with carboplatin & pemetrexed.")
+
+
+def _by_field(spans):
+    return {span["field"]: span for span in spans}
+
+
+def test_exact_normalized_and_fuzzy_sources():
+    features = {
+        "stage": "IV",
+        "stage_source_text": "stage IVB non-small cell lung cancer",
+        "mutations": ["EGFR"],
+        "mutations_source_text": ["EGFR  exon 19 deletion"],
+        "metastases": ["brain"],
+        "previous_treatments_source_text": ["previously received chemotherapy with carboplatin and pemetrexed"],
+        "ecog": "1",
+        "diagnosis": "not mentioned",
+    }
+    spans = _by_field(ground_sources(NOTE, features))
+    assert set(spans) == {"stage", "mutations", "metastases", "previous_treatments"}
+
+    stage = spans["stage"]
+    assert stage["match"] == "exact" and NOTE[stage["start"]:stage["end"]] == features["stage_source_text"]
+    mutation = spans["mutations"]
+    assert mutation["match"] == "normalized" and NOTE[mutation["start"]:mutation["end"]] == "EGFR exon 19 deletion"
+    assert NOTE[spans["metastases"]["start"]:spans["metastases"]["end"]] == "brain"
+    treatment = spans["previous_treatments"]
+    assert treatment["match"] == "fuzzy" and 0.75 <= treatment["score"] < 1
+    assert NOTE[treatment["start"]:treatment["end"]] == "previously received chemotherapy with carboplatin & pemetrexed"
+
+
+def test_values_match_whole_words_only():
+    assert [s for _, s, _ in source_snippets({"ecog": "1", "stage": "IV", "gender": "not mentioned"})] == ["IV"]
+    spans = ground_sources("IVB disease, stage IV.", {"stage": "IV"})
+    assert [(span["start"], span["end"]) for span in spans] == [(19, 21)]
+
+
+def test_render_escapes_and_clips_overlaps():
+    text = "a <b> EGFR exon 19"
+    spans = [{"field": "mutations", "start": 6, "end": 18}, {"field": "x", "start": 11, "end": 15}]
+    assert render_highlights(text, spans) == (
+        'a &lt;b&gt; <mark data-field="mutations" title="mutations">EGFR exon 19</mark>')
+
+
+if __name__ == "__main__":
+    test_exact_normalized_and_fuzzy_sources()
+    test_values_match_whole_words_only()
+    test_render_escapes_and_clips_overlaps()
+    print("✅ Grounding tests passed")
@@ -0,0 +1,99 @@
+import time
+import app.core.feature_extraction as feature_extraction
+from app.core.cancellation import check_cancelled
+from app.core.hedging import extract_features_hedged, regex_features
+
+NOTE = ("65-year-old male with stage IVB non-small cell lung cancer. ECOG PS 1. "
+        "EGFR exon 19 deletion mutation detected. Multiple brain metastases on MRI. "
+        "He previously received chemotherapy with carboplatin.")
+
+TRIALS = [{"id": "NCT1", "title": "NSCLC"}, {"id": "NCT2", "title": "SCLC"}]
+
+
+def _patched(llm, test):
+    original = (feature_extraction.extract_features_with_llm, feature_extraction.select_candidate_trials,
+                feature_extraction.get_all_trials)
+    selections = []
+
+    def select(features, trials):
+        selections.append(features["diagnosis"])
+        return [t for t in trials if t["title"] == features["diagnosis"]]
+
+    feature_extraction.extract_features_with_llm = llm
+    feature_extraction.select_candidate_trials = select
+    feature_extraction.get_all_trials = lambda: TRIALS
+    try:
+        test(selections)
+    finally:
+        (feature_extraction.extract_features_with_llm, feature_extraction.select_candidate_trials,
+         feature_extraction.get_all_trials) = original
+
+
+def test_regex_features_use_llm_schema():
+    features = regex_features(NOTE)
+    assert features["age"] == 65 and features["gender"] == "male"
+    assert features["diagnosis"] == "NSCLC" and features["stage"] == "IV" and features["ecog"] == "1"
+    assert "EGFR" in features["mutations"] and "brain" in features["metastases"]
+
+
+def test_lung_histology_maps_to_nsclc():
+    assert regex_features("Stage IV lung adenocarcinoma, KRAS G12C.")["diagnosis"] == "NSCLC"
+    assert regex_features("Lung cancer, stage III. Histology: squamous cell carcinoma.")["diagnosis"] == "NSCLC"
+    assert regex_features("Extensive-stage small cell lung cancer.")["diagnosis"] == "SCLC"
+    # Type not stated: unknown, not a non-lung cancer
+    assert regex_features("Newly diagnosed lung cancer, stage IV.")["diagnosis"] == "not mentioned"
+    assert regex_features("Metastatic breast cancer.")["diagnosis"] == "other"
+
+
+def test_llm_features_reuse_provisional_candidates_or_refilter():
+    def same(text):
+        time.sleep(0.1)
+        return regex_features(text)
+
+    def check_reused(selections):
+        result = extract_features_hedged(NOTE, slo_seconds=5)
+        assert not result.degraded
+        assert [t["id"] for t in result.candidates] == ["NCT1"]
+        assert selections == ["NSCLC"]
+
+    _patched(same, check_reused)
+
+    def check_refiltered(selections):
+        result = extract_features_hedged(NOTE, slo_seconds=5)
+        assert result.features["diagnosis"] == "SCLC"
+        assert [t["id"] for t in result.candidates] == ["NCT2"]
+        assert selections == ["NSCLC", "SCLC"]
+
+    _patched(lambda text: dict(regex_features(text), diagnosis="SCLC"), check_refiltered)
+
+
+def test_slow_llm_falls_back_to_regex_features():
+    cancelled = []
+
+    def slow(text):
+        try:
+            for _ in range(100):
+                time.sleep(0.05)
+                check_cancelled()
+        except BaseException:
+            cancelled.append(True)
+            raise
+        return {"diagnosis": "NSCLC"}
+
+    def check(selections):
+        result = extract_features_hedged(NOTE, slo_seconds=0.3)
+        assert result.degraded and result.reason == "llm_slo_exceeded"
+        assert result.features["diagnosis"] == "NSCLC"
+        assert [t["id"] for t in result.candidates] == ["NCT1"]
+        time.sleep(0.2)
+        assert cancelled == [True]
+
+    _patched(slow, check)
+
+
+if __name__ == "__main__":
+    test_regex_features_use_llm_schema()
+    test_lung_histology_maps_to_nsclc()
+    test_llm_features_reuse_provisional_candidates_or_refilter()
+    test_slow_llm_falls_back_to_regex_features()
+    print("✅ Hedging tests passed")
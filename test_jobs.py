@@ -0,0 +1,91 @@
+import os
+import tempfile
+import app.utils as utils
+import app.core.feature_extraction as feature_extraction
+import app.core.match_state as match_state
+from app.core.jobs import JobStore, run_job
+
+
+def _store():
+    return JobStore(os.path.join(tempfile.mkdtemp(), "jobs.sqlite3"))
+
+
+def test_claim_is_fifo_and_exclusive():
+    store = _store()
+    first = store.create(text="first note")
+    second = store.create(text="second note")
+
+    assert store.claim_next("w1")["id"] == first
+    assert store.claim_next("w2")["id"] == second
+    assert store.claim_next("w3") is None
+    assert store.counts() == {"running": 2}
+
+
+def test_partial_results_survive_and_stale_jobs_requeue():
+    store = _store()
+    job_id = store.create(text="note")
+    store.claim_next("w1")
+    store.update(job_id, stage="matching", features={"age": 60}, timings={"feature_extraction": 1.5})
+
+    reopened = JobStore(store.path)
+    job = reopened.get(job_id)
+    assert job["features"] == {"age": 60}
+    assert job["timings"]["feature_extraction"] == 1.5
+
+    assert reopened.requeue_stale(stale_seconds=-1) == 1
+    assert reopened.claim_next("w2")["features"] == {"age": 60}
+
+
+def test_run_job_end_to_end_and_upload_removed():
+    store = _store()
+    upload = os.path.join(tempfile.mkdtemp(), "upload.pdf")
+    with open(upload, "wb") as f:
+        f.write(b"%PDF-1.4")
+    job_id = store.create(pdf_path=upload, pdf_filename="note.pdf", time_budget=0)
+    original = (utils.extract_text_from_pdf, feature_extraction.extract_features_with_llm,
+                feature_extraction.match_trials_llm, match_state._store)
+
+    def fake_match(features, deadline=None, state=None, on_result=None):
+        results = [{"trial_id": "NCT1", "match_score": 40}, {"trial_id": "NCT2", "match_score": 80}]
+        for result in results:
+            on_result(result)
+        return sorted(results, key=lambda r: r["match_score"], reverse=True)
+
+    utils.extract_text_from_pdf = lambda f: "60 year old with NSCLC"
+    feature_extraction.extract_features_with_llm = lambda text: {"age": 60, "diagnosis": "NSCLC"}
+    feature_extraction.match_trials_llm = fake_match
+    # Match states go to a throwaway store, not the server's data/ file
+    match_state._store = match_state.MatchStateStore(os.path.join(tempfile.mkdtemp(), "match_states.sqlite3"))
+    try:
+        run_job(store, store.claim_next("w1"))
+    finally:
+        utils.extract_text_from_pdf, feature_extraction.extract_features_with_llm, \
+            feature_extraction.match_trials_llm, match_state._store = original
+
+    job = store.get(job_id)
+    assert (job["status"], job["stage"]) == ("done", "done")
+    # The note is cleared once the job is done
+    assert job["text"] is None
+    assert job["features"]["diagnosis"] == "NSCLC"
+    assert [t["trial_id"] for t in job["matched_trials"]] == ["NCT2", "NCT1"]
+    assert set(job["timings"]) == {"pdf_extraction", "feature_extraction", "matching"}
+    assert not os.path.exists(upload)
+
+
+def test_finished_jobs_are_purged_after_retention():
+    store = _store()
+    done, queued = store.create(text="done note"), store.create(text="queued note")
+    store.update(done, status="done", stage="done", text=None)
+
+    assert store.purge_expired() == 0
+    assert store.purge_expired(retention_seconds=-1) == 1
+    assert store.get(done) is None
+    assert store.get(queued)["text"] == "queued note"
+
+
+if __name__ == "__main__":
+    test_claim_is_fifo_and_exclusive()
+    test_partial_results_survive_and_stale_jobs_requeue()
+    test_run_job_end_to_end_and_upload_removed()
+    test_finished_jobs_are_purged_after_retention()
+    print("✅ Job store tests passed")
@@ -0,0 +1,77 @@
+import json
+import app.core.llm_processor as llm_processor
+from app.core.feature_extraction import _extract_features
+from app.core.json_repair import salvage_json, get_salvage_stats
+
+
+def test_salvage_chatty_and_truncated_output():
+    assert salvage_json('{"met": true}').status == "clean"
+
+    chatty = salvage_json('Sure {here} it is:\n```json\n{"age": 65, "note": "a } b"}\n```\nAnything else?')
+    assert chatty.status == "extracted" and chatty.value == {"age": 65, "note": "a } b"}
+
+    truncated = salvage_json('{"age": 65, "gender": "male", "diagnosis": "NSC', kind="test")
+    assert truncated.status == "repaired" and truncated.value == {"age": 65, "gender": "male"}
+    assert truncated.incomplete == []
+
+    cut_list = salvage_json('{"age": 65, "mutations": ["EGFR", "KR', kind="test")
+    assert cut_list.value == {"age": 65, "mutations": ["EGFR"]} and cut_list.incomplete == ["mutations"]
+
+    assert salvage_json("no json here", kind="test").value is None
+    stats = get_salvage_stats()["test"]
+    assert stats["repaired"] == 2 and stats["failed"] == 1 and stats["salvage_rate"] == 0.667
+
+
+class _StubLLM:
+    def __init__(self, first, followup):
+        self.first, self.followup = first, followup
+        self.prompts = []
+
+    def generate_response(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return json.dumps({"response": self.first})
+
+    def generate_text(self, prompt, **kwargs):
+        self.prompts.append(prompt)
+        return self.followup
+
+
+def test_only_missing_fields_are_requested_again():
+    truncated = ('Here is the extraction: {"age": 65, "gender": "male", "diagnosis": "NSCLC", "stage": "IVB", '
+                 '"ecog": "1", "mutations": ["EGFR", "KR')
+    stub = _StubLLM(truncated, '{"stage": "IV", "mutations": ["EGFR", "KRAS"], "metastases": ["brain"], '
+                               '"previous_treatments": [], "lab_values": {}, "age": 70}')
+    original = llm_processor.get_llm_processor
+    llm_processor.get_llm_processor = lambda *args, **kwargs: stub
+    try:
+        features = _extract_features("note text")
+    finally:
+        llm_processor.get_llm_processor = original
+
+    assert len(stub.prompts) == 2
+    followup = stub.prompts[1]
+    assert '"stage"' in followup and '"mutations"' in followup and '"lab_values"' in followup
+    assert '"age"' not in followup and '"diagnosis"' not in followup
+    assert features["age"] == 65 and features["diagnosis"] == "NSCLC"
+    assert features["stage"] == "IV" and features["mutations"] == ["EGFR", "KRAS"]
+    assert features["metastases"] == ["brain"]
+
+
+def test_complete_answer_omitting_fields_is_not_requested_again():
+    stub = _StubLLM('{"age": 65, "gender": "male", "diagnosis": "NSCLC", "mutations": ["EGFR"]}', "{}")
+    original = llm_processor.get_llm_processor
+    llm_processor.get_llm_processor = lambda *args, **kwargs: stub
+    try:
+        features = _extract_features("note text")
+    finally:
+        llm_processor.get_llm_processor = original
+
+    assert len(stub.prompts) == 1
+    assert features["diagnosis"] == "NSCLC" and "stage" not in features
+
+
+if __name__ == "__main__":
+    test_salvage_chatty_and_truncated_output()
+    test_only_missing_fields_are_requested_again()
+    test_complete_answer_omitting_fields_is_not_requested_again()
+    print("✅ JSON repair tests passed")
@@ -0,0 +1,56 @@
+import os
+import tempfile
+from app.core.match_state import MatchState, MatchStateStore
+
+FEATURES = {"age": 60, "diagnosis": "NSCLC", "mutations": ["KRAS G12C"]}
+CANDIDATES = [{"id": "NCT-A", "title": "A"}, {"id": "NCT-B", "title": "B"}, {"id": "NCT-C", "title": "C"}]
+
+
+def _state():
+    state = MatchState(FEATURES)
+    state.candidates = CANDIDATES
+    state.screened = {
+        "NCT-A": {"trial_id": "NCT-A", "match_score": 80, "stage": "screen"},
+        "NCT-B": {"trial_id": "NCT-B", "match_score": 50, "stage": "screen"},
+    }
+    state.promoted = ["NCT-A", "NCT-B"]
+    state.finalized = {"NCT-A": {"trial_id": "NCT-A", "match_score": 95, "stage": "final"}}
+    return state
+
+
+def _store():
+    return MatchStateStore(os.path.join(tempfile.mkdtemp(), "match_states.sqlite3"))
+
+
+def test_anytime_results_flag_unfinalized_finalists():
+    by_id = {r["trial_id"]: r for r in _state().results()}
+    assert by_id["NCT-A"]["stage"] == "final" and "pending_final" not in by_id["NCT-A"]
+    assert by_id["NCT-B"]["pending_final"] is True
+    assert by_id["NCT-C"]["stage"] == "not_evaluated"
+
+
+def test_state_saved_by_one_worker_is_loaded_by_another():
+    path = os.path.join(tempfile.mkdtemp(), "match_states.sqlite3")
+    state = _state()
+    MatchStateStore(path).save(state)
+
+    loaded = MatchStateStore(path).load(state.id)
+    assert loaded.results() == state.results()
+    assert loaded.dependencies == state.dependencies and not loaded.running
+    assert MatchStateStore(path).load("unknown") is None
+
+
+def test_only_one_worker_claims_a_state():
+    store = _store()
+    state = _state()
+    store.save(state)
+    assert store.claim(state.id) is True
+    assert store.claim(state.id) is False
+    assert store.load(state.id).running is True
+
+
+if __name__ == "__main__":
+    test_anytime_results_flag_unfinalized_finalists()
+    test_state_saved_by_one_worker_is_loaded_by_another()
+    test_only_one_worker_claims_a_state()
+    print("✅ Match state tests passed")
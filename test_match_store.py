@@ -0,0 +1,90 @@
+import os
+import time
+import tempfile
+import app.core.feature_extraction as feature_extraction
+from app.core.cascade import run_cascade
+from app.core.match_store import MatchResultStore, rescore_stored_patients
+from test_rematch import TRIALS, FEATURES, StubLLM
+
+
+def _store():
+    return MatchResultStore(os.path.join(tempfile.mkdtemp(), "match_results.sqlite3"))
+
+
+def test_saved_patient_skips_unchanged_catalog():
+    store = _store()
+    llm = StubLLM()
+    results, _ = run_cascade(FEATURES, TRIALS[:1], TRIALS, llm)
+    store.save("patient-1", FEATURES, TRIALS, results)
+    assert store.counts() == {"patients": 1, "results": 2}
+
+    llm.criteria_seen = []
+    report = rescore_stored_patients(TRIALS, llm, store)
+    assert report["trials_evaluated"] == 0
+    assert report["trials_skipped"] == 2
+    assert llm.criteria_seen == []
+
+
+def test_amended_trial_reports_newly_eligible_patient():
+    store = _store()
+    llm = StubLLM()
+    # The patient was evaluated when the KRAS trial did not target it yet
+    old_kras = dict(TRIALS[1], title="Placebo study in healthy volunteers", inclusion_criteria=["Healthy volunteers"])
+    results, _ = run_cascade(FEATURES, TRIALS[:1], [TRIALS[0], old_kras], llm)
+    key = store.save("patient-1", FEATURES, [TRIALS[0], old_kras], results)
+
+    llm.criteria_seen = []
+    retrieved = []
+    select = feature_extraction.select_candidate_trials
+    feature_extraction.select_candidate_trials = lambda f, trials: retrieved.append(trials) or select(f, trials)
+    try:
+        report = rescore_stored_patients(TRIALS, llm, store)
+    finally:
+        feature_extraction.select_candidate_trials = select
+    # Retrieval sees the whole catalog, not just the amended trial
+    assert retrieved == [TRIALS]
+    assert report["trials_evaluated"] == 1
+    assert llm.criteria_seen == ["NSCLC with KRAS G12C mutation"]
+    assert report["newly_eligible"] == {"NCT-KRAS": ["patient-1"]}
+    assert store.results(key)["NCT-KRAS"]["stage"] == "final"
+
+
+def test_finalists_without_a_final_verdict_are_not_stored():
+    store = _store()
+    screened = {"trial_id": TRIALS[0]["id"], "match_score": 60, "recommendation": "POTENTIALLY_ELIGIBLE",
+                "stage": "screen", "pending_final": True}
+    store.save("patient-1", FEATURES, TRIALS, [screened])
+    # Only the non-candidate is recorded: the next catalog update finalizes the other trial
+    assert set(store.seen("patient-1")) == {TRIALS[1]["id"]}
+
+
+def test_patients_need_a_reference_and_can_be_deleted():
+    store = _store()
+    try:
+        store.save("  ", FEATURES, TRIALS, [])
+        assert False, "saved without a patient reference"
+    except ValueError:
+        pass
+    store.save("patient-1", FEATURES, TRIALS, [])
+    assert store.delete("patient-1")
+    assert not store.delete("patient-1")
+    assert store.counts() == {"patients": 0, "results": 0}
+
+
+def test_patients_past_retention_are_purged():
+    store = MatchResultStore(os.path.join(tempfile.mkdtemp(), "match_results.sqlite3"), retention_days=1)
+    store.save("patient-1", FEATURES, TRIALS, [])
+    assert store.purge_expired() == 0
+    store.retention = 0
+    time.sleep(0.01)
+    assert store.purge_expired() == 1
+    assert store.counts() == {"patients": 0, "results": 0}
+
+
+if __name__ == "__main__":
+    test_saved_patient_skips_unchanged_catalog()
+    test_amended_trial_reports_newly_eligible_patient()
+    test_finalists_without_a_final_verdict_are_not_stored()
+    test_patients_need_a_reference_and_can_be_deleted()
+    test_patients_past_retention_are_purged()
+    print("✅ Match store tests passed")
@@ -0,0 +1,89 @@
+import os
+import json
+import tempfile
+from app.core.match_state import Deadline
+from app.core.match_store import MatchResultStore
+from app.core.patient_index import PatientIndex, match_patients
+from app.core.vocabulary import annotate_features
+
+TRIAL = {"id": "NCT-G12C", "title": "KRAS G12C inhibitor in lung adenocarcinoma", "min_age": "18 Years",
+         "max_age": "80 Years", "gender": "All", "inclusion_criteria": ["Lung adenocarcinoma with KRAS G12C"],
+         "exclusion_criteria": []}
+
+PATIENTS = {
+    "g12c": {"age": 64, "gender": "male", "diagnosis": "lung adenocarcinoma", "mutations": ["KRAS G12C"]},
+    "egfr": {"age": 58, "gender": "female", "diagnosis": "NSCLC", "mutations": ["EGFR exon 19 deletion"]},
+    "sclc": {"age": 70, "gender": "male", "diagnosis": "small cell lung cancer", "mutations": []},
+    "too_old": {"age": 85, "gender": "female", "diagnosis": "lung adenocarcinoma", "mutations": ["KRAS G12C"]},
+}
+
+
+class StubLLM:
+    model = "large"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_text(self, prompt):
+        self.calls += 1
+        return json.dumps({"match_score": 95, "overall_recommendation": "RECOMMENDED"})
+
+
+def _patients():
+    return [{"patient_ref": name, "features": annotate_features(dict(f))} for name, f in PATIENTS.items()]
+
+
+def test_vectorized_screen_rules_out_and_ranks():
+    index = PatientIndex(_patients())
+    scores = dict(zip(index.keys, index.screen(TRIAL).tolist()))
+    assert scores["too_old"] == -1
+    assert scores["sclc"] == -1
+    assert scores["g12c"] > scores["egfr"] >= 0
+
+
+def test_only_shortlist_reaches_llm_and_records_are_deidentified():
+    store = MatchResultStore(os.path.join(tempfile.mkdtemp(), "match_results.sqlite3"))
+    for patient in _patients():
+        features = dict(patient["features"], original_text="Mario Rossi, 64 anni", age_source_text="64 anni")
+        store.save(patient["patient_ref"], features, [], [])
+    assert all("original_text" not in p["features"] and "age_source_text" not in p["features"]
+               for p in store.patients())
+
+    llm = StubLLM()
+    report = match_patients(TRIAL, llm, shortlist_size=1, store=store)
+    assert report["screened"] == 4
+    assert report["passed_screen"] == 2
+    assert llm.calls == 1
+    assert [p["patient_id"] for p in report["patients"]] == ["g12c"]
+
+
+def test_expired_deadline_stops_llm_checks():
+    store = MatchResultStore(os.path.join(tempfile.mkdtemp(), "match_results.sqlite3"))
+    for patient in _patients():
+        store.save(patient["patient_ref"], patient["features"], [], [])
+    deadline = Deadline(1)
+    deadline.expires_at = 0
+    llm = StubLLM()
+    report = match_patients(TRIAL, llm, store=store, deadline=deadline)
+    assert llm.calls == 0
+    assert report["not_checked"] == 2
+    assert not report["complete"]
+
+
+def test_index_revision_ignores_plain_rematches():
+    store = MatchResultStore(os.path.join(tempfile.mkdtemp(), "match_results.sqlite3"))
+    features = _patients()[0]["features"]
+    store.save("p1", features, [], [])
+    revision = store.revision()
+    store.save("p1", features, [], [])
+    assert store.revision() == revision
+    store.save("p1", dict(features, age=70), [], [])
+    assert store.revision() != revision
+
+
+if __name__ == "__main__":
+    test_vectorized_screen_rules_out_and_ranks()
+    test_only_shortlist_reaches_llm_and_records_are_deidentified()
+    test_expired_deadline_stops_llm_checks()
+    test_index_revision_ignores_plain_rematches()
+    print("✅ Patient index tests passed")
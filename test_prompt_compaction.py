@@ -0,0 +1,52 @@
+import tempfile
+from app.core.prompt_compaction import compact_trial, PromptFragmentStore, TrialFragment
+
+ELIGIBILITY = ["Inclusion Criteria:", "", "* Age  >= 18 years", "* Histologically confirmed   NSCLC", "",
+               "Exclusion Criteria:", "", "* Active brain metastases", "* age >= 18 years", ""]
+
+TRIAL = {
+    "id": "NCT1", "title": "A Study  of Drug X", "phase": "PHASE2", "description": "Long summary " * 50,
+    "inclusion_criteria": ELIGIBILITY, "exclusion_criteria": ELIGIBILITY, "gender": "All",
+    "min_age": "18 Years", "max_age": "Not specified", "status": "RECRUITING", "sponsor": "Sponsor",
+    "start_date": "2024-01", "completion_date": "2026-01", "last_updated": "2024-02",
+}
+
+
+def test_compact_trial_keeps_eligibility_deduplicated_per_section():
+    assert compact_trial(TRIAL) == "\n".join([
+        "ID: NCT1",
+        "Title: A Study of Drug X",
+        "Population: age >= 18 Years",
+        "Inclusion:",
+        "- Age >= 18 years",
+        "- Histologically confirmed NSCLC",
+        "Exclusion:",
+        "- Active brain metastases",
+        "- age >= 18 years",
+    ])
+
+
+def test_store_precomputes_counts_and_reports_savings():
+    amended = dict(TRIAL, id="NCT2", gender="Female")
+    with tempfile.TemporaryDirectory() as directory:
+        PromptFragmentStore.build([TRIAL], count_tokens=lambda text: (len(text), False),
+                                  directory=directory)
+        store = PromptFragmentStore.load(directory)
+
+        fragment = store.get(TRIAL)
+        assert not fragment.estimated and fragment.tokens == len(compact_trial(TRIAL))
+        assert fragment.saved > 0.8 * fragment.original_tokens
+
+        # Trials changed since ingest are compacted on first use
+        assert "Population: sex female, age >= 18 Years" in store.get(amended).text
+        assert store.get(amended).estimated
+        assert {row["trial_id"] for row in store.report()} == {"NCT1", "NCT2"}
+
+    # A counter that had to estimate (no tokenizer reachable) says so
+    assert TrialFragment.build(TRIAL, lambda text: (len(text) // 4, True)).estimated
+
+
+if __name__ == "__main__":
+    test_compact_trial_keeps_eligibility_deduplicated_per_section()
+    test_store_precomputes_counts_and_reports_savings()
+    print("✅ Prompt compaction tests passed")
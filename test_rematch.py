@@ -0,0 +1,95 @@
+import json
+import itertools
+import app.core.rematch as rematch_module
+from app.core.cascade import run_cascade
+from app.core.evaluation_plan import criterion_dependencies
+from app.core.match_state import MatchState
+from app.core.rematch import changed_fields, rematch, MatchBusy
+
+TRIALS = [
+    {"id": "NCT-ECOG", "title": "KRAS G12C inhibitor in NSCLC", "min_age": "18 Years", "max_age": "Not specified",
+     "gender": "All", "inclusion_criteria": ["Metastatic NSCLC with KRAS G12C", "ECOG performance status 0-1"],
+     "exclusion_criteria": []},
+    {"id": "NCT-KRAS", "title": "KRAS G12C combination in NSCLC", "min_age": "18 Years", "max_age": "Not specified",
+     "gender": "All", "inclusion_criteria": ["NSCLC with KRAS G12C mutation"], "exclusion_criteria": []},
+]
+FEATURES = {"age": 60, "diagnosis": "NSCLC", "mutations": ["KRAS G12C"], "ecog": 1}
+
+
+class StubLLM:
+    """Large model answering criterion prompts; a fresh model name keeps each test's verdict cache apart."""
+    _instances = itertools.count()
+
+    def __init__(self):
+        self.model = f"large-{next(self._instances)}"
+        self.criteria_seen = []
+
+    def generate_text(self, prompt):
+        self.criteria_seen.append(prompt.split("Criterion: ", 1)[1].split("\n", 1)[0])
+        return json.dumps({"met": True, "explanation": "stub"})
+
+
+def test_criterion_dependencies():
+    assert criterion_dependencies("ECOG performance status 0-1") == ("ecog",)
+    assert "mutations" in criterion_dependencies("NSCLC with KRAS G12C mutation")
+    assert criterion_dependencies("Signed informed consent") == ()
+
+
+def test_changed_fields_ignores_derived_entries():
+    old = dict(FEATURES, concepts={"biomarker": ["KRAS_G12C"]}, ecog_source_text="ECOG 1")
+    new = dict(FEATURES, ecog=2, ecog_source_text="PS 2")
+    assert changed_fields(old, new) == ["ecog"]
+
+
+def _with_trials(test):
+    original = rematch_module.get_all_trials
+    rematch_module.get_all_trials = lambda: TRIALS
+    try:
+        test()
+    finally:
+        rematch_module.get_all_trials = original
+
+
+def test_ecog_edit_reevaluates_only_dependent_trials():
+    def test():
+        llm = StubLLM()
+        state = MatchState(FEATURES)
+        run_cascade(FEATURES, TRIALS, TRIALS, llm, state=state)
+        assert len(llm.criteria_seen) == 3
+        finalists = sorted(state.finalized)
+
+        llm.criteria_seen = []
+        results, report = rematch(state, dict(FEATURES, ecog=2), llm=llm)
+        assert report["changed"] == ["ecog"]
+        assert report["reevaluated"] == ["NCT-ECOG"]
+        assert report["reused"] == 1
+        assert report["verdicts_reused"] == 2
+        # Every finalist is re-scored, but only the edited criterion is asked again
+        assert report["refinalized"] == finalists
+        assert llm.criteria_seen == ["ECOG performance status 0-1"]
+        assert state.complete and state.features["ecog"] == 2 and not state.running
+        assert {r["trial_id"] for r in results} == {"NCT-ECOG", "NCT-KRAS"}
+
+    _with_trials(test)
+
+
+def test_running_match_is_not_rematched():
+    def test():
+        state = MatchState(FEATURES)
+        state.running = True
+        try:
+            rematch(state, dict(FEATURES, ecog=2), llm=StubLLM())
+            assert False, "expected MatchBusy"
+        except MatchBusy:
+            pass
+        assert state.features["ecog"] == 1
+
+    _with_trials(test)
+
+
+if __name__ == "__main__":
+    test_criterion_dependencies()
+    test_changed_fields_ignores_derived_entries()
+    test_ecog_edit_reevaluates_only_dependent_trials()
+    test_running_match_is_not_rematched()
+    print("✅ Re-match tests passed")
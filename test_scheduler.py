@@ -0,0 +1,51 @@
+import time
+import threading
+from app.core.scheduler import LLMScheduler, SchedulerSaturated
+
+
+def _run_calls(scheduler, calls, order):
+    """Occupy the only slot, queue ``calls`` and record the grant order."""
+    blocker = scheduler.acquire("ingest", "blocker")
+    threads = []
+    for priority, user in calls:
+        def call(priority=priority, user=user):
+            with scheduler.slot(priority, user):
+                order.append((priority, user))
+        thread = threading.Thread(target=call)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+    scheduler.release(blocker)
+    for thread in threads:
+        thread.join(5)
+
+
+def test_interactive_before_batch_and_fair_across_users():
+    scheduler = LLMScheduler(max_concurrency=1, class_limits={"interactive": 1, "batch": 1, "ingest": 1},
+                             queue_limits={"interactive": 10, "batch": 10, "ingest": 10})
+    order = []
+    _run_calls(scheduler, [("batch", "a"), ("batch", "a"), ("batch", "a"), ("batch", "b"), ("interactive", "c")], order)
+    assert order[0] == ("interactive", "c")
+    # b queued after a's three calls but is served right after a's first one
+    assert order[1:3] == [("batch", "a"), ("batch", "b")]
+
+    stats = scheduler.stats()["classes"]
+    assert stats["batch"]["completed"] == 4
+    assert stats["interactive"]["avg_wait_seconds"] > 0
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    scheduler = LLMScheduler(max_concurrency=1, class_limits={"interactive": 1, "batch": 1, "ingest": 1},
+                             queue_limits={"interactive": 0, "batch": 10, "ingest": 10})
+    try:
+        scheduler.acquire("interactive", "u")
+        assert False, "expected SchedulerSaturated"
+    except SchedulerSaturated as e:
+        assert e.retry_after >= 1
+    assert scheduler.stats()["classes"]["interactive"]["rejected"] == 1
+
+
+if __name__ == "__main__":
+    test_interactive_before_batch_and_fair_across_users()
+    test_full_queue_is_rejected_with_retry_after()
+    print("✅ Scheduler tests passed")
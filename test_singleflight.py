@@ -0,0 +1,80 @@
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.core.singleflight import SingleFlight
+
+
+def test_concurrent_duplicates_run_once_in_process():
+    flight = SingleFlight(directory=None)
+    calls = []
+
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"age": 60}
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        results = list(pool.map(lambda _: flight.do("document:abc", work), range(5)))
+
+    assert results == [{"age": 60}] * 5
+    assert len(calls) == 1
+    assert flight.stats()["joined"] == 4
+
+
+def test_duplicate_in_other_worker_reads_leader_result():
+    directory = tempfile.mkdtemp()
+    worker_a, worker_b = SingleFlight(directory), SingleFlight(directory)
+    calls = []
+    started = threading.Event()
+
+    def work():
+        calls.append(1)
+        started.set()
+        time.sleep(0.3)
+        return {"age": 60}
+
+    leader = threading.Thread(target=worker_a.do, args=("document:abc", work))
+    leader.start()
+    started.wait(5)
+    assert worker_b.do("document:abc", work) == {"age": 60}
+    leader.join()
+
+    assert len(calls) == 1
+    assert worker_b.stats()["cross_worker_hits"] == 1
+    # The shared result is deleted once the waiting worker has read it
+    assert not [name for name in os.listdir(directory) if not name.endswith(".lock")]
+
+
+def test_results_stay_in_process_by_default():
+    assert SingleFlight().directory is None
+    directory = tempfile.mkdtemp()
+    SingleFlight(directory).do("document:abc", lambda: {"age": 60})
+    # Nobody waited in another worker: nothing is written
+    assert not [name for name in os.listdir(directory) if not name.endswith(".lock")]
+
+
+def test_errors_propagate_to_joined_callers():
+    flight = SingleFlight(directory=None)
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError("backend down")
+
+    def call(_):
+        try:
+            flight.do("prompt:x", fail)
+        except ValueError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        assert list(pool.map(call, range(3))) == ["backend down"] * 3
+
+
+if __name__ == "__main__":
+    test_concurrent_duplicates_run_once_in_process()
+    test_duplicate_in_other_worker_reads_leader_result()
+    test_results_stay_in_process_by_default()
+    test_errors_propagate_to_joined_callers()
+    print("✅ Single-flight tests passed")
@@ -0,0 +1,46 @@
+import os
+import json
+import tempfile
+from flask import Flask
+import app.core.feature_extraction as feature_extraction
+import app.core.match_state as match_state
+from app.core.streaming import stream_process
+
+
+def _parse(frames):
+    events = []
+    for frame in frames:
+        lines = dict(line.split(": ", 1) for line in frame.strip().splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_emits_features_then_trials_then_summary():
+    original = (feature_extraction.extract_features_with_llm, feature_extraction.match_trials_llm, match_state._store)
+
+    def fake_match(features, deadline=None, state=None, on_result=None):
+        results = [{"trial_id": "NCT1", "match_score": 40}, {"trial_id": "NCT2", "match_score": 80}]
+        for result in results:
+            on_result(result)
+        state.complete = True
+        return sorted(results, key=lambda r: r["match_score"], reverse=True)
+
+    feature_extraction.extract_features_with_llm = lambda text: {"age": 60, "diagnosis": "NSCLC"}
+    feature_extraction.match_trials_llm = fake_match
+    match_state._store = match_state.MatchStateStore(os.path.join(tempfile.mkdtemp(), "match_states.sqlite3"))
+    try:
+        events = _parse(stream_process(Flask(__name__), text="60 year old with NSCLC"))
+    finally:
+        feature_extraction.extract_features_with_llm, feature_extraction.match_trials_llm, \
+            match_state._store = original
+
+    assert [name for name, _ in events] == ["features", "trial", "trial", "summary"]
+    assert events[0][1]["features"]["diagnosis"] == "NSCLC"
+    summary = events[-1][1]
+    assert summary["matched_trials"][0]["trial_id"] == "NCT2"
+    assert summary["timings"]["first_result"] <= summary["timings"]["total"]
+
+
+if __name__ == "__main__":
+    test_stream_emits_features_then_trials_then_summary()
+    print("✅ Streaming tests passed")
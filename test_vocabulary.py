@@ -0,0 +1,42 @@
+from app.core.vocabulary import ClinicalVocabulary, get_vocabulary, annotate_features, trial_concepts
+
+
+def test_bundled_synonyms_map_to_canonical_codes():
+    vocabulary = get_vocabulary()
+    assert vocabulary.normalize("EGFR ex19del") == ["EGFR_EX19DEL"]
+    assert vocabulary.normalize("delezione dell'esone 19") == ["EGFR_EX19DEL"]
+    assert vocabulary.normalize("osimertinib (Tagrisso)") == ["OSIMERTINIB"]
+    assert vocabulary.normalize("adenocarcinoma polmonare") == ["LUAD"]
+    assert vocabulary.normalize("Non-Small Cell Lung Cancer") == ["NSCLC"]
+    assert vocabulary.normalize("small cell lung cancer") == ["SCLC"]
+    assert vocabulary.normalize("all criteria met") == []
+    # Histologies shared with other primaries count only when the lung is named
+    assert vocabulary.normalize("squamous cell carcinoma of the skin, colon adenocarcinoma") == []
+    assert vocabulary.normalize("squamous cell carcinoma of the lung") == ["LUSC"]
+    assert vocabulary.expand(["LUAD", "EGFR_EX19DEL"]) == ["LUAD", "NSCLC_NONSQUAMOUS", "NSCLC", "EGFR_EX19DEL", "EGFR"]
+
+
+def test_longest_match_at_word_boundaries():
+    vocabulary = ClinicalVocabulary({"biomarker": {"KRAS": ["kras"], "KRAS_G12C": ["kras g12c"], "RET": ["ret"]}})
+    assert vocabulary.find("KRAS-G12C, KRAS wild type, retreated, RET+") == [
+        ("biomarker", "KRAS_G12C"), ("biomarker", "KRAS"), ("biomarker", "RET")]
+
+
+def test_features_and_trials_share_codes():
+    features = annotate_features({"diagnosis": "NSCLC", "mutations": ["EGFR exon 19 deletion"],
+                                  "previous_treatments": ["carboplatino", "Keytruda"]})
+    assert features["concepts"] == {"histology": ["NSCLC"], "biomarker": ["EGFR_EX19DEL"],
+                                    "treatment": ["CARBOPLATIN", "PEMBROLIZUMAB"]}
+    trial = {"id": "NCT1", "title": "Osimertinib in EGFR ex19del NSCLC",
+             "inclusion_criteria": ["Inclusion Criteria:", "* adenocarcinoma of the lung", "Exclusion Criteria:", "* prior docetaxel"]}
+    concepts = trial_concepts(trial)
+    assert concepts["biomarker"] == ["EGFR_EX19DEL"]
+    assert concepts["histology"] == ["NSCLC", "LUAD"] and concepts["treatment"] == ["OSIMERTINIB"]
+    assert trial_concepts(dict(trial, concepts={"biomarker": ["ALK"]})) == {"biomarker": ["ALK"]}
+
+
+if __name__ == "__main__":
+    test_bundled_synonyms_map_to_canonical_codes()
+    test_longest_match_at_word_boundaries()
+    test_features_and_trials_share_codes()
+    print("✅ Vocabulary tests passed")